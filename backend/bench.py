@@ -0,0 +1,602 @@
+"""Benchmark harness for the Infotafel backend.
+
+Starts the app with uvicorn in a subprocess against a throw-away ``DATA_DIR``
+(Open-Meteo is replaced by a local stub) and runs four scenarios:
+
+- ``kiosks``: N simulated kiosks poll ``/api/state`` with ``If-None-Match`` and
+  hold a ``/ws`` connection while an admin fires config changes; reports poll
+  latency and how long the resulting delta/refresh takes to reach each socket.
+- ``upload``: batches of synthetic JPEG/PNG images at several resolutions go
+  through ``POST /api/folders/{id}/images``; reports images/s, MB/s and the
+  per-stage timings of the image pipeline.
+- ``index``: the image index is seeded with 100/1k/10k entries; reports
+  startup time and the latency of full/304 ``/api/state``, ``/api/playlist``,
+  the admin image list (whole folder and one page with contact sheet map)
+  and an index write.
+- ``startup``: the server is started repeatedly; reports time until
+  ``/healthz`` answers, the phases the server measured itself (imports,
+  module, ready) and the transfer size of the kiosk page with its assets.
+  The OS page cache stays warm, so a Pi after a power cut is slower still.
+
+Every scenario also records RSS and CPU time of the server (including pool
+workers). Results are written as JSON so runs can be compared over time::
+
+    python backend/bench.py                       # all scenarios
+    python backend/bench.py --scenario kiosks --kiosks 100 --duration 20
+    python backend/bench.py --store sqlite --out bench-results/sqlite.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+try:
+    import websockets
+except ImportError:  # comes with uvicorn[standard]; without it kiosks only poll
+    websockets = None
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+ADMIN_PASSWORD = "bench"
+H = {"X-Admin-Password": ADMIN_PASSWORD}
+
+UPLOAD_SIZES = [(1280, 720), (1920, 1080), (4032, 3024)]
+UPLOAD_FORMATS = ["JPEG", "PNG"]
+INDEX_SIZES = [100, 1000, 10000]
+IMAGES_PER_FOLDER = 500
+
+WEATHER_PAYLOAD = {
+    "current": {"temperature_2m": 18.5, "apparent_temperature": 17.9, "is_day": 1,
+                "weather_code": 2, "wind_speed_10m": 9.4},
+    "daily": {"time": ["2026-01-01", "2026-01-02", "2026-01-03"],
+              "temperature_2m_max": [20.1, 21.0, 19.2], "temperature_2m_min": [9.8, 10.4, 8.7],
+              "weather_code": [2, 3, 61]},
+}
+
+# ---- Helpers ----
+
+def percentiles(samples: List[float]) -> Dict[str, Any]:
+    """p50/p90/p99/max in milliseconds (nearest rank)."""
+    if not samples:
+        return {"n": 0}
+    s = sorted(samples)
+
+    def rank(p: float) -> float:
+        return round(s[min(len(s) - 1, max(0, int(round(p / 100.0 * len(s))) - 1))] * 1000.0, 2)
+
+    return {"n": len(s), "p50_ms": rank(50), "p90_ms": rank(90), "p99_ms": rank(99),
+            "max_ms": round(s[-1] * 1000.0, 2), "mean_ms": round(sum(s) / len(s) * 1000.0, 2)}
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _proc_tree(pid: int) -> List[int]:
+    """``pid`` and its descendants (Linux /proc; just ``pid`` elsewhere)."""
+    parents: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return [pid]
+    for name in entries:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                stat = f.read().rsplit(b")", 1)[1].split()
+        except OSError:
+            continue
+        parents.setdefault(int(stat[1]), []).append(int(name))
+    out, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        out.append(p)
+        todo.extend(parents.get(p, []))
+    return out
+
+def resource_usage(pid: int) -> Dict[str, Any]:
+    """RSS (MB) and user+system CPU seconds of the server and its workers."""
+    rss_kb, cpu_ticks = 0, 0
+    tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    for p in _proc_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+            with open(f"/proc/{p}/stat", "rb") as f:
+                stat = f.read().rsplit(b")", 1)[1].split()
+            cpu_ticks += int(stat[11]) + int(stat[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return {"rss_mb": round(rss_kb / 1024.0, 1), "cpu_sec": round(cpu_ticks / tick, 2)}
+
+def usage_delta(before: Dict[str, Any], after: Dict[str, Any], wall: float) -> Dict[str, Any]:
+    cpu = round(after["cpu_sec"] - before["cpu_sec"], 2)
+    return {"rss_mb": after["rss_mb"], "cpu_sec": cpu, "cpu_util": round(cpu / wall, 3) if wall > 0 else None}
+
+def synthetic_image(width: int, height: int, fmt: str, seed: int) -> bytes:
+    """Noise over a gradient: cheap to make, not trivially compressible."""
+    rnd = random.Random(seed)
+    base = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + rnd.randint(0, 20))
+    im = Image.merge("RGB", (base, noise, Image.eval(base, lambda v: 255 - v)))
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        im.save(buf, "JPEG", quality=88)
+    else:
+        im.save(buf, "PNG", compress_level=1)
+    return buf.getvalue()
+
+def seed_data_dir(data_dir: Path, images: int) -> None:
+    """Write folders.json/index.json with ``images`` entries (files need not exist)."""
+    folders, index = [], {}
+    for n in range(0, max(images, 1), IMAGES_PER_FOLDER):
+        fid = uuid.uuid4().hex
+        folders.append({"id": fid, "name": f"Bench {len(folders) + 1}", "slug": f"bench-{len(folders) + 1}",
+                        "created_at": "2026-01-01T00:00:00+0000"})
+        entries = []
+        for i in range(n, min(images, n + IMAGES_PER_FOLDER)):
+            iid = uuid.uuid4().hex
+            entries.append({
+                "id": iid, "type": "image", "filename": f"{iid}.webp", "thumb": f"{iid}_thumb.webp",
+                "original_name": f"IMG_{i:05d}.jpg", "uploaded_at": "2026-01-01T00:00:00+0000",
+                "width": 1920, "height": 1080,
+                "renditions": [{"h": 720, "width": 1280, "height": 720, "webp": f"{iid}_720p.webp"},
+                               {"h": 1080, "width": 1920, "height": 1080, "webp": f"{iid}.webp"}],
+            })
+        index[fid] = entries
+    data_dir.mkdir(parents=True, exist_ok=True)
+    (data_dir / "folders.json").write_text(json.dumps({"folders": folders}), encoding="utf-8")
+    (data_dir / "index.json").write_text(json.dumps({"images": index}), encoding="utf-8")
+
+# ---- Weather stub ----
+
+class WeatherStub:
+    """Minimal HTTP/1.1 server answering every request with a fixed forecast."""
+
+    def __init__(self) -> None:
+        self.port = 0
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        body = json.dumps(WEATHER_PAYLOAD).encode("utf-8")
+        self._response = (
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+        )
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head:
+                    break
+                self.requests += 1
+                writer.write(self._response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/v1/forecast"
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+# ---- Server ----
+
+class Server:
+    """The app under uvicorn in its own process, with its own data directory."""
+
+    def __init__(self, data_dir: Path, weather_url: str, args: argparse.Namespace) -> None:
+        self.data_dir = data_dir
+        self.port = _free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.startup_sec = 0.0
+        self.startup_phases: Dict[str, float] = {}
+        env = dict(os.environ)
+        env.update({
+            "DATA_DIR": str(data_dir),
+            "ADMIN_PASSWORD": ADMIN_PASSWORD,
+            "WEATHER_BASE_URL": weather_url,
+            "STORE_BACKEND": args.store,
+            "RECONCILE_INTERVAL_SEC": "0",  # seeded entries have no files; keep the reconciler out of the numbers
+        })
+        if args.workers > 1:
+            env.setdefault("BROADCAST_BACKEND", "unix")
+        self._env = env
+        self._cmd = [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1",
+                     "--port", str(self.port), "--log-level", "warning", "--workers", str(args.workers)]
+        self.proc: Optional[subprocess.Popen] = None
+
+    async def start(self, timeout: float = 60.0) -> None:
+        t0 = time.perf_counter()
+        self.proc = subprocess.Popen(self._cmd, cwd=str(REPO_DIR), env=self._env)
+        async with httpx.AsyncClient(base_url=self.base, timeout=2.0) as c:
+            while time.perf_counter() - t0 < timeout:
+                if self.proc.poll() is not None:
+                    raise RuntimeError(f"server exited with {self.proc.returncode}")
+                try:
+                    r = await c.get("/healthz")
+                    if r.status_code == 200:
+                        self.startup_sec = round(time.perf_counter() - t0, 3)
+                        self.startup_phases = r.json().get("startup", {})
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.05)
+        raise RuntimeError("server did not become ready")
+
+    def usage(self) -> Dict[str, Any]:
+        assert self.proc is not None
+        return resource_usage(self.proc.pid)
+
+    def stop(self) -> None:
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+# ---- Scenarios ----
+
+async def _kiosk(
+    client: httpx.AsyncClient,
+    ws_url: str,
+    interval: float,
+    stop_at: float,
+    polls: List[float],
+    codes: Dict[int, int],
+    arrivals: List[float],
+    ready: asyncio.Event,
+) -> None:
+    etag = ""
+
+    async def poll() -> None:
+        nonlocal etag
+        # spread the first polls over one interval like real kiosks booting at different times
+        await asyncio.sleep(random.random() * interval)
+        while time.perf_counter() < stop_at:
+            t0 = time.perf_counter()
+            r = await client.get("/api/state?images=0", headers={"If-None-Match": etag} if etag else {})
+            polls.append(time.perf_counter() - t0)
+            codes[r.status_code] = codes.get(r.status_code, 0) + 1
+            etag = r.headers.get("etag", etag)
+            await asyncio.sleep(interval)
+
+    async def listen() -> None:
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            ready.set()
+            while True:
+                remaining = stop_at - time.perf_counter()
+                if remaining <= 0:
+                    return
+                try:
+                    text = await asyncio.wait_for(ws.recv(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return
+                msg = json.loads(text)
+                if msg.get("type") == "ping":
+                    await ws.send("pong")
+                    continue
+                if msg.get("type") in ("delta", "refresh"):
+                    arrivals.append(time.perf_counter())
+
+    if websockets is None:
+        ready.set()
+        await poll()
+    else:
+        await asyncio.gather(poll(), listen())
+
+async def bench_kiosks(server: Server, args: argparse.Namespace) -> Dict[str, Any]:
+    seed_data_dir(server.data_dir, args.kiosk_images)
+    await server.start()
+    n = args.kiosks
+    limits = httpx.Limits(max_connections=n + 4, max_keepalive_connections=n + 4)
+    async with httpx.AsyncClient(base_url=server.base, limits=limits, timeout=30.0,
+                                 headers={"Accept-Encoding": "gzip"}) as client:
+        await client.get("/api/state")  # warm the body cache
+        before, t0 = server.usage(), time.perf_counter()
+        stop_at = t0 + args.duration
+        polls: List[float] = []
+        codes: Dict[int, int] = {}
+        arrivals: List[List[float]] = [[] for _ in range(n)]
+        ready = [asyncio.Event() for _ in range(n)]
+        ws_url = server.base.replace("http://", "ws://") + "/ws"
+        kiosks = [asyncio.create_task(_kiosk(client, ws_url, args.poll_interval, stop_at,
+                                             polls, codes, arrivals[i], ready[i])) for i in range(n)]
+        await asyncio.wait_for(asyncio.gather(*(e.wait() for e in ready)), timeout=30)
+
+        # admin: one config change per mutation interval
+        sent: List[float] = []
+        mutation_lat: List[float] = []
+        i = 0
+        while time.perf_counter() < stop_at - args.mutation_interval:
+            i += 1
+            payload = {"ticker": {"enabled": True, "speed": 70, "items": [f"Benchmark {i}"]}}
+            m0 = time.perf_counter()
+            r = await client.put("/api/config", json=payload, headers=H)
+            r.raise_for_status()
+            sent.append(m0)
+            mutation_lat.append(time.perf_counter() - m0)
+            await asyncio.sleep(args.mutation_interval)
+        await asyncio.gather(*kiosks)
+        wall = time.perf_counter() - t0
+        after = server.usage()
+        stats = (await client.get("/api/ws/stats", headers=H)).json()
+
+    # each arrival belongs to the latest mutation sent before it (first arrival per mutation counts)
+    delivery: List[float] = []
+    for times in arrivals:
+        seen = set()
+        for t in times:
+            k = max((j for j, s in enumerate(sent) if s <= t), default=None)
+            if k is not None and k not in seen:
+                seen.add(k)
+                delivery.append(t - sent[k])
+    return {
+        "kiosks": n,
+        "images": args.kiosk_images,
+        "duration_sec": round(wall, 2),
+        "poll": {**percentiles(polls), "per_sec": round(len(polls) / wall, 1),
+                 "status": {str(k): v for k, v in sorted(codes.items())}},
+        "mutations": {**percentiles(mutation_lat), "sent": len(sent)},
+        "ws_delivery": {**percentiles(delivery),
+                        "expected": len(sent) * n if websockets is not None else 0,
+                        "dropped": stats.get("dropped_total", 0)},
+        "server": usage_delta(before, after, wall),
+    }
+
+async def _wait_job(client: httpx.AsyncClient, job_id: str, timeout: float = 900.0) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        job = (await client.get(f"/api/jobs/{job_id}", headers=H)).json()
+        if job.get("status") not in ("queued", "running"):
+            return job
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"job {job_id} did not finish")
+
+async def bench_upload(server: Server, args: argparse.Namespace) -> Dict[str, Any]:
+    await server.start()
+    runs: List[Dict[str, Any]] = []
+    async with httpx.AsyncClient(base_url=server.base, timeout=600.0) as client:
+        r = await client.post("/api/folders", json={"name": "Bench Upload"}, headers=H)
+        r.raise_for_status()
+        fid = r.json()["folder"]["id"]
+        for fmt in UPLOAD_FORMATS:
+            for w, h in UPLOAD_SIZES:
+                files = [synthetic_image(w, h, fmt, seed) for seed in range(args.batch)]
+                ext = "jpg" if fmt == "JPEG" else "png"
+                size = sum(len(b) for b in files)
+                before, t0 = server.usage(), time.perf_counter()
+                r = await client.post(
+                    f"/api/folders/{fid}/images",
+                    files=[("files", (f"bench_{i}.{ext}", b, f"image/{ext.replace('jpg', 'jpeg')}"))
+                           for i, b in enumerate(files)],
+                    headers=H,
+                )
+                r.raise_for_status()
+                accepted = time.perf_counter() - t0
+                job = await _wait_job(client, r.json()["job"]["id"])
+                wall = time.perf_counter() - t0
+                stages: Dict[str, List[float]] = {}
+                for f in job.get("files", []):
+                    for stage, ms in (f.get("timings_ms") or {}).items():
+                        stages.setdefault(stage, []).append(ms / 1000.0)
+                done = sum(1 for f in job.get("files", []) if f.get("status") == "done")
+                runs.append({
+                    "format": fmt,
+                    "size": f"{w}x{h}",
+                    "files": args.batch,
+                    "done": done,
+                    "upload_mb": round(size / 1e6, 2),
+                    "accept_sec": round(accepted, 3),
+                    "wall_sec": round(wall, 3),
+                    "images_per_sec": round(done / wall, 2),
+                    "mb_per_sec": round(size / 1e6 / wall, 2),
+                    "stages": {k: percentiles(v) for k, v in stages.items()},
+                    "server": usage_delta(before, server.usage(), wall),
+                })
+    return {"batch": args.batch, "runs": runs}
+
+async def _timed(client: httpx.AsyncClient, rounds: int, method: str, url: str, **kw: Any) -> Dict[str, Any]:
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        r = await client.request(method, url, **kw)
+        samples.append(time.perf_counter() - t0)
+        if r.status_code >= 400:
+            raise RuntimeError(f"{method} {url}: {r.status_code}")
+    # bytes on the wire (httpx hands out the decoded body)
+    return {**percentiles(samples), "bytes": int(r.headers.get("content-length", len(r.content)))}
+
+async def bench_index(args: argparse.Namespace, weather_url: str, root: Path) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for size in args.index_sizes:
+        server = Server(root / f"index-{size}", weather_url, args)
+        seed_data_dir(server.data_dir, size)
+        try:
+            await server.start()
+            rounds = args.rounds
+            async with httpx.AsyncClient(base_url=server.base, timeout=120.0) as client:
+                r = await client.get("/api/state")
+                etag = r.headers.get("etag", "")
+                fid = next(iter(r.json()["images"]))
+                ids = [im["id"] for im in r.json()["images"][fid]]
+                before, t0 = server.usage(), time.perf_counter()
+                res = {
+                    "startup_sec": server.startup_sec,
+                    "state_full": await _timed(client, rounds, "GET", "/api/state",
+                                               headers={"Accept-Encoding": "identity"}),
+                    "state_gzip": await _timed(client, rounds, "GET", "/api/state",
+                                               headers={"Accept-Encoding": "gzip"}),
+                    "state_304": await _timed(client, rounds, "GET", "/api/state",
+                                              headers={"If-None-Match": etag}),
+                    "playlist": await _timed(client, rounds, "GET", "/api/playlist?limit=10&seed=1&w=1920&h=1080"),
+                    "list_images": await _timed(client, rounds, "GET", f"/api/folders/{fid}/images", headers=H),
+                    "list_images_page": await _timed(client, rounds, "GET",
+                                                     f"/api/folders/{fid}/images?limit=120&order=desc&sheet=1",
+                                                     headers=H),
+                }
+                deletes = []
+                for iid in ids[: min(rounds, len(ids))]:
+                    d0 = time.perf_counter()
+                    (await client.delete(f"/api/folders/{fid}/images/{iid}", headers=H)).raise_for_status()
+                    deletes.append(time.perf_counter() - d0)
+                res["delete_image"] = percentiles(deletes)
+                res["server"] = usage_delta(before, server.usage(), time.perf_counter() - t0)
+            out[str(size)] = res
+        finally:
+            server.stop()
+    return out
+
+async def _page_bytes(client: httpx.AsyncClient, path: str, encoding: str) -> Dict[str, Any]:
+    """Wire size of an HTML page plus the stylesheets and scripts it references."""
+    headers = {"Accept-Encoding": encoding}
+    r = await client.get(path, headers=headers)
+    sizes = {path: int(r.headers.get("content-length", len(r.content)))}
+    for ref in re.findall(r'(?:href|src)="(/static/[^"]+)"', r.text):
+        a = await client.get(ref, headers=headers)
+        sizes[ref] = int(a.headers.get("content-length", len(a.content)))
+        # module imports of the script (one level is enough for this frontend)
+        for dep in re.findall(r'from "\./([^"]+)"', a.text):
+            url = ref.rpartition("/")[0] + "/" + dep
+            d = await client.get(url, headers=headers)
+            sizes[url] = int(d.headers.get("content-length", len(d.content)))
+    return {"total": sum(sizes.values()), "files": sizes}
+
+async def bench_startup(args: argparse.Namespace, weather_url: str, root: Path) -> Dict[str, Any]:
+    ready: List[float] = []
+    phases: Dict[str, List[float]] = {}
+    first_page: List[float] = []
+    pages: Dict[str, Any] = {}
+    for i in range(args.starts):
+        server = Server(root / "startup", weather_url, args)
+        try:
+            await server.start()
+            ready.append(server.startup_sec)
+            for k, v in server.startup_phases.items():
+                phases.setdefault(k, []).append(v)
+            async with httpx.AsyncClient(base_url=server.base, timeout=30.0) as client:
+                t0 = time.perf_counter()
+                (await client.get("/")).raise_for_status()
+                first_page.append(time.perf_counter() - t0)
+                if i == args.starts - 1:
+                    # compressed variants are built and cached on the first request per encoding
+                    for enc in ("identity", "gzip", "br"):
+                        pages[enc] = await _page_bytes(client, "/", enc)
+        finally:
+            server.stop()
+    return {
+        "starts": args.starts,
+        "healthz_sec": percentiles(ready),
+        "phases_sec": {k: percentiles(v) for k, v in phases.items()},
+        "first_page": percentiles(first_page),
+        "kiosk_page_bytes": pages,
+    }
+
+# ---- Main ----
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stub = WeatherStub()
+    weather_url = await stub.start()
+    root = Path(tempfile.mkdtemp(prefix="infotafel-bench-"))
+    results: Dict[str, Any] = {}
+    try:
+        for name in args.scenario:
+            print(f"[bench] {name} ...", file=sys.stderr, flush=True)
+            if name in ("index", "startup"):
+                fn = bench_index if name == "index" else bench_startup
+                results[name] = await fn(args, weather_url, root)
+                continue
+            server = Server(root / name, weather_url, args)
+            try:
+                fn = bench_kiosks if name == "kiosks" else bench_upload
+                results[name] = await fn(server, args)
+                results[name]["startup_sec"] = server.startup_sec
+            finally:
+                server.stop()
+        results["weather_stub_requests"] = stub.requests
+    finally:
+        await stub.stop()
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k != "out"},
+        },
+        "results": results,
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--scenario", action="append", choices=["kiosks", "upload", "index", "startup"],
+                   help="scenario to run (repeatable, default: all)")
+    p.add_argument("--out", help="result file (default: bench-results/bench-<time>.json)")
+    p.add_argument("--store", choices=["json", "sqlite"], default="json", help="STORE_BACKEND of the server")
+    p.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    p.add_argument("--kiosks", type=int, default=50)
+    p.add_argument("--kiosk-images", type=int, default=1000, help="index size for the kiosk scenario")
+    p.add_argument("--duration", type=float, default=15.0, help="kiosk scenario length in seconds")
+    p.add_argument("--poll-interval", type=float, default=1.0, help="seconds between /api/state polls per kiosk")
+    p.add_argument("--mutation-interval", type=float, default=1.0, help="seconds between admin changes")
+    p.add_argument("--batch", type=int, default=8, help="images per upload batch")
+    p.add_argument("--index-sizes", type=lambda v: [int(x) for x in v.split(",")], default=INDEX_SIZES)
+    p.add_argument("--rounds", type=int, default=50, help="requests per measurement in the index scenario")
+    p.add_argument("--starts", type=int, default=5, help="server starts in the startup scenario")
+    p.add_argument("--keep", action="store_true", help="keep the temporary data directories")
+    args = p.parse_args(argv)
+    args.scenario = args.scenario or ["kiosks", "upload", "index", "startup"]
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    out = Path(args.out) if args.out else Path("bench-results") / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(json.dumps(report["results"], indent=2))
+    print(f"[bench] written to {out}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
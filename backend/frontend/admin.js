@@ -3,7 +3,6 @@ import { markdownToHtml, clamp } from "./utils.js";
 let adminPw = localStorage.getItem("kita_admin_pw") || "";
 let config = null;
 let folders = null; // Die Liste der Ordner (aus /api/folders)
-let imagesIndex = null; // Die Bilder zu den Ordnern (aus /api/state)
 
 // --- Basis Funktionen ---
 
@@ -311,8 +310,15 @@ function el(tag, cls) {
 
 // --- Bilder & Ordner Management (Neu & Korrigiert) ---
 
+const IMAGE_PAGE_SIZE = 120;
+
 let currentFolderId = "";
-let currentFolderImages = [];
+let currentFolderSlug = "";
+let currentFolderImages = []; // bisher geladene Seiten
+let currentFolderTotal = 0;
+let imagesCursor = null; // Cursor der nächsten Seite (null = alles geladen)
+let loadingImages = false;
+let imageSort = localStorage.getItem("kita_image_sort") || "uploaded:asc";
 let selectedImages = new Set(); // Speichert IDs der ausgewählten Bilder
 
 function renderFolders() {
@@ -334,7 +340,7 @@ function renderFolders() {
   // ⚡ Bolt: Use DocumentFragment to batch DOM insertions and prevent excessive reflows
   const frag = document.createDocumentFragment();
   for (const f of fList) {
-    const ims = imagesIndex?.[f.id] || [];
+    const ims = f.preview || []; // die ersten Medien des Ordners (aus /api/folders)
 
     // Karte
     const card = el("div", "folder-card");
@@ -370,7 +376,7 @@ function renderFolders() {
     const strongName = document.createElement("strong");
     strongName.textContent = f.name;
     const spanMuted = el("span", "muted");
-    spanMuted.textContent = ` (${ims.length} Medien)`;
+    spanMuted.textContent = ` (${f.image_count ?? 0} Medien)`;
     title.appendChild(strongName);
     title.appendChild(spanMuted);
 
@@ -419,23 +425,42 @@ function renderFolders() {
         const totalFiles = files.length;
         let uploadedFiles = 0;
 
+        const jobIds = [];
+
         for (let i = 0; i < totalFiles; i += batchSize) {
           const batch = files.slice(i, i + batchSize);
-          await uploadToFolder(f.id, batch, (percent) => {
+          const res = await uploadToFolder(f.id, batch, (percent) => {
             const overallProgress =
               ((uploadedFiles + (percent / 100) * batch.length) / totalFiles) *
               100;
             progressBar.style.width = `${overallProgress}%`;
-            if (overallProgress >= 99.9) {
-              toastEl.firstChild.textContent =
-                "Upload beendet. Server verarbeitet nun die Bilder...";
-            }
           });
+          if (res.job) jobIds.push(res.job.id);
           uploadedFiles += batch.length;
         }
 
+        // Der Server verarbeitet die Dateien im Hintergrund (Upload-Jobs)
+        toastEl.firstChild.textContent =
+          "Upload beendet. Server verarbeitet nun die Bilder...";
+        progressBar.style.width = "0%";
+        const processed = new Map();
+        let failed = 0;
+        for (const jobId of jobIds) {
+          const job = await waitForJob(jobId, (j) => {
+            processed.set(j.id, j.done + j.failed);
+            let sum = 0;
+            for (const n of processed.values()) sum += n;
+            progressBar.style.width = `${(sum / totalFiles) * 100}%`;
+          });
+          failed += job.failed;
+        }
+
         toastEl.remove();
-        showToast("Upload und Verarbeitung abgeschlossen!");
+        showToast(
+          failed > 0
+            ? `Upload abgeschlossen, ${failed} Datei(en) konnten nicht verarbeitet werden.`
+            : "Upload und Verarbeitung abgeschlossen!",
+        );
       } catch (err) {
         toastEl.remove();
         showToast("Fehler beim Upload.");
@@ -482,8 +507,8 @@ function renderFolders() {
     preview.style.cssText =
       "display:flex; gap:5px; margin-top:8px; overflow:hidden;";
 
-    for (const im of ims.slice(0, 6)) {
-      if (im.type === "video") {
+    for (const im of ims) {
+      if (im.type === "video" && !im.thumb) {
         const d = el("div");
         d.textContent = "VIDEO";
         d.style.cssText =
@@ -506,11 +531,13 @@ function renderFolders() {
 
 function openFolder(folderId, folderName) {
   currentFolderId = folderId;
-  currentFolderImages = imagesIndex?.[folderId] || [];
+  currentFolderImages = [];
+  currentFolderTotal = 0;
+  imagesCursor = null;
 
   // Slug finden für URLs
   const fObj = folders.folders.find((x) => x.id === folderId);
-  const slug = fObj ? fObj.slug : "";
+  currentFolderSlug = fObj ? fObj.slug : "";
 
   selectedImages.clear();
   updateDeleteButton();
@@ -519,12 +546,47 @@ function openFolder(folderId, folderName) {
   document.getElementById("folderDetail").style.display = "block";
   document.getElementById("detailTitle").textContent = folderName;
   document.getElementById("selectAllBox").checked = false;
+  document.getElementById("imageSort").value = imageSort;
+  document.getElementById("detailGrid").innerHTML = "";
 
-  const grid = document.getElementById("detailGrid");
-  grid.innerHTML = "";
+  loadImagePage();
+}
+
+// Lädt die nächste Seite (IMAGE_PAGE_SIZE Bilder) samt Kontaktabzug:
+// eine JSON-Antwort + ein Sprite-Bild statt einer Anfrage pro Vorschaubild.
+async function loadImagePage() {
+  if (loadingImages) return;
+  loadingImages = true;
+  const folderId = currentFolderId;
+  const [sort, order] = imageSort.split(":");
+  const params = new URLSearchParams({
+    limit: IMAGE_PAGE_SIZE,
+    sort,
+    order,
+    sheet: "1",
+  });
+  if (imagesCursor) params.set("cursor", imagesCursor);
+
+  try {
+    const page = await apiGet(`/api/folders/${folderId}/images?${params}`);
+    if (folderId !== currentFolderId) return; // Ordner inzwischen gewechselt
+    currentFolderImages.push(...page.images);
+    currentFolderTotal = page.total;
+    imagesCursor = page.next;
+    renderImagePage(page.images, page.sheet);
+  } catch (e) {
+    console.error(e);
+    showToast("Fehler beim Laden der Bilder.");
+  } finally {
+    loadingImages = false;
+    updateImagePaging();
+  }
+}
 
+function renderImagePage(images, sheet) {
+  const grid = document.getElementById("detailGrid");
   const selectAllRow = document.getElementById("selectAllRow");
-  if (currentFolderImages.length === 0) {
+  if (currentFolderTotal === 0) {
     if (selectAllRow) selectAllRow.style.display = "none";
     const emptyMsg = document.createElement("p");
     emptyMsg.className = "muted";
@@ -536,9 +598,10 @@ function openFolder(folderId, folderName) {
   }
   if (selectAllRow) selectAllRow.style.display = "";
 
+  const slug = currentFolderSlug;
   // ⚡ Bolt: Use DocumentFragment to batch DOM insertions and prevent excessive reflows
   const frag = document.createDocumentFragment();
-  for (const im of currentFolderImages) {
+  for (const im of images) {
     const wrap = el("div", "img-wrap");
     wrap.style.cssText =
       "position:relative; cursor:pointer; display:inline-block; margin:5px;";
@@ -548,10 +611,30 @@ function openFolder(folderId, folderName) {
     };
 
     let content;
-    if (im.type === "video") {
+    const tile = sheet?.tiles?.[im.id];
+    if (tile) {
+      // Ausschnitt aus dem Kontaktabzug: [x, y, Breite, Höhe]
+      const [x, y, w, h] = tile;
+      content = el("div");
+      content.setAttribute("role", "img");
+      content.setAttribute("aria-label", im.original_name || im.filename);
+      content.style.cssText = `width:${w}px; height:${h}px; border-radius:4px; background:#000 url("${sheet.url}") -${x}px -${y}px no-repeat;`;
+      if (im.type === "video") {
+        const badge = el("span");
+        badge.textContent = "VIDEO";
+        badge.style.cssText =
+          "position:absolute; bottom:5px; right:5px; background:rgba(0,0,0,0.7); color:#fff; font-size:10px; font-weight:bold; padding:2px 4px; border-radius:3px;";
+        wrap.appendChild(badge);
+      }
+    } else if (im.type === "video") {
       content = document.createElement("video");
       content.src = `/media/${slug}/${im.filename}`;
-      content.preload = "metadata";
+      if (im.poster) {
+        content.poster = `/media/${slug}/${im.poster}`;
+        content.preload = "none";
+      } else {
+        content.preload = "metadata";
+      }
       content.style.cssText =
         "height:120px; border-radius:4px; display:block; background:#000;";
     } else {
@@ -573,13 +656,38 @@ function openFolder(folderId, folderName) {
     // Dataset ID speichern für schnelles UI Update
     wrap.dataset.imgid = im.id;
 
-    wrap.appendChild(content);
+    wrap.prepend(content);
     wrap.appendChild(check);
     frag.appendChild(wrap);
   }
   grid.appendChild(frag);
 }
 
+function updateImagePaging() {
+  const count = document.getElementById("imageCount");
+  count.textContent =
+    currentFolderTotal > currentFolderImages.length
+      ? `${currentFolderImages.length} von ${currentFolderTotal} geladen`
+      : `${currentFolderTotal} Dateien`;
+  document.getElementById("btnMoreImages").style.display = imagesCursor
+    ? "inline-block"
+    : "none";
+}
+
+function changeImageSort(value) {
+  imageSort = value;
+  localStorage.setItem("kita_image_sort", value);
+  const fObj = folders.folders.find((x) => x.id === currentFolderId);
+  if (fObj) openFolder(fObj.id, fObj.name);
+}
+
+// Nächste Seite automatisch laden, sobald der "Weitere laden"-Knopf sichtbar wird
+if ("IntersectionObserver" in window) {
+  new IntersectionObserver((entries) => {
+    if (entries.some((e) => e.isIntersecting) && imagesCursor) loadImagePage();
+  }).observe(document.getElementById("btnMoreImages"));
+}
+
 function closeFolder() {
   document.getElementById("folderList").style.display = "block";
   document.getElementById("folderDetail").style.display = "none";
@@ -697,15 +805,21 @@ function uploadToFolder(folderId, fileList, onProgress) {
   });
 }
 
+async function waitForJob(jobId, onUpdate) {
+  for (;;) {
+    const job = await apiGet(`/api/jobs/${jobId}`);
+    if (onUpdate) onUpdate(job);
+    if (job.status === "done" || job.status === "failed") return job;
+    await new Promise((r) => setTimeout(r, 1000));
+  }
+}
+
 // --- App State ---
 
 async function reloadAll() {
   config = await apiGet("/api/config");
-  folders = await apiGet("/api/folders"); // { folders: [...] }
-  const state = await fetch("/api/state", { cache: "no-store" }).then((r) =>
-    r.json(),
-  );
-  imagesIndex = state.images; // { "folderID": [img1, img2...], ... }
+  // { folders: [...] } mit Anzahl und Vorschau je Ordner, ohne den Bildindex
+  folders = await apiGet("/api/folders");
 
   bindConfigToForm();
   renderFolders();
@@ -1054,5 +1168,7 @@ async function init() {
 window.closeFolder = closeFolder;
 window.toggleSelectAll = toggleSelectAll;
 window.deleteSelected = deleteSelected;
+window.changeImageSort = changeImageSort;
+window.loadMoreImages = loadImagePage;
 
 init();
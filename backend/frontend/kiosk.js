@@ -7,6 +7,7 @@ import {
 } from "./utils.js";
 
 let state = null;
+let stateEtag = null;
 let ws = null;
 let tickerAnim = null;
 
@@ -49,72 +50,148 @@ function buildTextPanel(cfg) {
   return wrap;
 }
 
-function pickCarouselImages(cfg, folders, imagesIndex) {
-  let folderIds = [];
-  if (cfg.carousel?.folders === "all") {
-    folderIds = folders.map((f) => f.id);
-  } else if (Array.isArray(cfg.carousel?.folders)) {
-    folderIds = cfg.carousel.folders;
+function pictureElement() {
+  const picture = document.createElement("picture");
+  picture.style.display = "contents"; // keep the .slide img layout
+  const source = document.createElement("source");
+  source.type = "image/avif";
+  const img = document.createElement("img");
+  img.alt = ""; // Decorative carousel image
+  picture.appendChild(source);
+  picture.appendChild(img);
+  return { picture, source, img };
+}
+
+// Keep at most this many preload hints in <head>
+const MAX_PRELOAD_LINKS = 6;
+
+// Turn the playlist's `Link: <url>; rel=preload` header into <link> elements;
+// fetch() responses don't trigger preloads on their own.
+function applyPreloadHints(header) {
+  if (!header) return;
+  for (const part of header.split(",")) {
+    const m = part.match(/<([^>]+)>/);
+    if (!m || !/rel=preload/.test(part)) continue;
+    if (document.head.querySelector(`link[rel="preload"][href="${m[1]}"]`)) continue;
+    const link = document.createElement("link");
+    link.rel = "preload";
+    link.as = "image";
+    const type = part.match(/type="([^"]+)"/);
+    if (type) link.type = type[1];
+    link.href = m[1];
+    document.head.appendChild(link);
+  }
+  const links = document.head.querySelectorAll('link[rel="preload"]');
+  for (let i = 0; i < links.length - MAX_PRELOAD_LINKS; i++) links[i].remove();
+}
+
+// Server-ordered carousel (/api/playlist), held as a small window of pages.
+// A pass ends when the server returns `next: null`; the following pass
+// starts over with a fresh shuffle.
+class PlaylistWindow {
+  constructor(pageSize = 10) {
+    this.pageSize = pageSize;
+    this.queue = [];
+    this.total = 0;
+    this.seed = null;
+    this.nextOffset = 0;
+    this.loading = null;
+    this.generation = 0;
+  }
+
+  // Images changed: drop the prefetched items (they may be gone) and reload
+  // from the first one not shown yet, keeping the seed of the current pass.
+  invalidate() {
+    const pending = this.queue.length;
+    // nextOffset 0 after the last page: an empty queue starts the next pass
+    const end = this.nextOffset || (pending ? this.total : 0);
+    this.nextOffset = Math.max(0, end - pending);
+    this.queue = [];
+    this.generation++;
+    this.loading = null;
   }
 
-  // ⚡ Bolt: Cache folders in a Map to replace O(N^2) search with O(N) lookup
-  const folderMap = new Map();
-  for (let i = 0; i < folders.length; i++) {
-    folderMap.set(folders[i].id, folders[i]);
+  async fetchPage() {
+    const generation = this.generation;
+    const dpr = window.devicePixelRatio || 1;
+    const params = new URLSearchParams({
+      offset: String(this.nextOffset),
+      limit: String(this.pageSize),
+      w: String(Math.round(window.innerWidth * dpr)),
+      h: String(Math.round(window.innerHeight * dpr)),
+    });
+    if (this.nextOffset > 0 && this.seed != null) params.set("seed", String(this.seed));
+    const r = await fetch(`/api/playlist?${params}`, { cache: "no-store" });
+    if (!r.ok) throw new Error("playlist load failed");
+    applyPreloadHints(r.headers.get("Link"));
+    const page = await r.json();
+    if (generation !== this.generation) return; // invalidated meanwhile
+    this.seed = page.seed;
+    this.total = page.total;
+    this.nextOffset = page.next ?? 0;
+    this.queue.push(...page.items);
   }
 
-  const list = [];
-  for (const fid of folderIds) {
-    const folder = folderMap.get(fid);
-    if (!folder) continue;
-    const ims = imagesIndex?.[fid] || [];
-    for (const im of ims) {
-      list.push({
-        ...im,
-        type: im.type || "image",
-        folder_id: fid,
-        folder_slug: folder.slug,
-        folder_name: folder.name,
-        url: `/media/${folder.slug}/${im.filename}`,
+  refill() {
+    if (!this.loading) {
+      const loading = this.fetchPage().finally(() => {
+        if (this.loading === loading) this.loading = null;
       });
+      this.loading = loading;
     }
+    return this.loading;
   }
-  return list;
-}
 
-function shuffleInPlace(arr) {
-  for (let i = arr.length - 1; i > 0; i--) {
-    const j = Math.floor(Math.random() * (i + 1));
-    [arr[i], arr[j]] = [arr[j], arr[i]];
+  async next() {
+    // retry when a page was dropped by invalidate() or the offset ran past a shrunken list
+    for (let tries = 0; this.queue.length === 0 && tries < 3; tries++) {
+      await this.refill();
+      if (this.queue.length === 0 && this.total === 0) break;
+    }
+    const item = this.queue.shift();
+    // fetch the following page while the remaining items are still showing
+    if (this.queue.length <= 2 && this.total > 1) this.refill().catch(() => {});
+    return item;
   }
-  return arr;
 }
 
-function buildCarousel(cfg, folders, imagesIndex) {
+function buildCarousel(cfg) {
   const container = el("div", "carousel");
-
-  const slides = [];
-  let images = pickCarouselImages(cfg, folders, imagesIndex);
-  if (cfg.carousel?.shuffle) images = shuffleInPlace(images);
-  if (images.length === 0) {
-    const empty = el("div", "kioskText");
-    empty.innerHTML = `<h1>Keine Bilder</h1><p>Bitte in der Adminseite einen Ordner anlegen und Bilder hochladen.</p>`;
-    return empty;
-  }
-
+  const playlist = new PlaylistWindow();
   const animationStyle = cfg.carousel?.animation || "fade";
   const animClass = `anim-${animationStyle}`;
+  const slides = [];
+  let timer = null;
+  let destroyed = false;
 
-  if (images.length === 1) {
-    const item = images[0];
+  // cleanup hook
+  container.__destroy = () => {
+    destroyed = true;
+    clearTimeout(timer);
+    slides.forEach((s) => {
+      if (s.vid) s.vid.pause();
+    });
+  };
+
+  // image changes: a running carousel only reloads its playlist window;
+  // the empty/single-item views return false and are rebuilt
+  let cycling = false;
+  container.__refresh = () => {
+    if (!cycling) return false;
+    playlist.invalidate();
+    return true;
+  };
+
+  function showSingle(item) {
     const s = el("div", `slide active ${animClass}`); // active immediately
 
     const cap = el("div", "caption");
-    cap.textContent = item.folder_name;
+    cap.textContent = item.caption;
 
     if (item.type === "video") {
       const vid = document.createElement("video");
       vid.src = item.url;
+      vid.poster = item.poster || "";
       vid.style.width = "100%";
       vid.style.height = "100%";
       vid.style.objectFit = "cover";
@@ -122,26 +199,25 @@ function buildCarousel(cfg, folders, imagesIndex) {
       vid.loop = true;
       vid.muted = false;
       s.appendChild(vid);
+      slides.push({ vid });
     } else {
-      const img = document.createElement("img");
+      const { picture, source, img } = pictureElement();
+      source.srcset = item.avif || "";
       img.src = item.url;
-      img.alt = ""; // Decorative carousel image
       img.style.width = "100%";
       img.style.height = "100%";
       img.style.objectFit = "cover";
-      s.appendChild(img);
+      s.appendChild(picture);
     }
     s.appendChild(cap);
     container.appendChild(s);
-    return container;
   }
 
   // two-slide pool (more performant)
   for (let i = 0; i < 2; i++) {
     const s = el("div", `slide ${animClass}`);
 
-    const img = document.createElement("img");
-    img.alt = ""; // Decorative carousel image
+    const { picture, source, img } = pictureElement();
     img.loading = "eager";
     img.decoding = "async";
 
@@ -154,41 +230,67 @@ function buildCarousel(cfg, folders, imagesIndex) {
 
     const cap = el("div", "caption");
 
-    s.appendChild(img);
+    s.appendChild(picture);
     s.appendChild(vid);
     s.appendChild(cap);
-    container.appendChild(s);
-    slides.push({ root: s, img, vid, cap });
+    slides.push({ root: s, picture, source, img, vid, cap });
   }
 
-  let idx = 0;
   let active = 0;
 
-  function setSlide(slot, image) {
-    if (image.type === "video") {
-      slot.img.style.display = "none";
+  function setSlide(slot, item) {
+    if (item.type === "video") {
+      slot.picture.style.display = "none";
       slot.vid.style.display = "block";
-      slot.vid.src = image.url;
+      slot.vid.poster = item.poster || "";
+      slot.vid.src = item.url;
       slot.vid.muted = false;
     } else {
       slot.vid.style.display = "none";
-      slot.img.style.display = "block";
-      slot.img.src = image.url;
+      slot.picture.style.display = "contents";
+      // an empty srcset makes the browser skip the AVIF source
+      slot.source.srcset = item.avif || "";
+      slot.img.src = item.url;
       slot.vid.src = ""; // unload video
     }
-    slot.cap.textContent = image.folder_name;
+    slot.cap.textContent = item.caption;
   }
 
-  setSlide(slides[0], images[0]);
-  slides[0].root.classList.add("active");
-
-  const interval =
-    clamp(parseInt(cfg.carousel?.interval_sec ?? 10, 10), 3, 120) * 1000;
-  let timer = null;
+  // Show the item for its duration; videos advance when they end.
+  function play(item, slot) {
+    if (item.type !== "video") {
+      timer = setTimeout(scheduleNext, item.duration * 1000);
+      return;
+    }
+    const vid = slot.vid;
+    vid.currentTime = 0;
+    vid.muted = false;
+    const onEnded = () => {
+      vid.removeEventListener("ended", onEnded);
+      scheduleNext();
+    };
+    vid.addEventListener("ended", onEnded);
+    vid.play().catch((e) => {
+      console.error("Video play failed", e);
+      const interval = clamp(parseInt(cfg.carousel?.interval_sec ?? 10, 10), 3, 120);
+      timer = setTimeout(scheduleNext, interval * 1000);
+    });
+  }
 
-  function scheduleNext() {
-    idx = (idx + 1) % images.length;
-    const nextItem = images[idx];
+  async function scheduleNext() {
+    let nextItem;
+    try {
+      nextItem = await playlist.next();
+    } catch (e) {
+      // server unreachable: keep the current slide and try again later
+      if (!destroyed) timer = setTimeout(scheduleNext, 10000);
+      return;
+    }
+    if (destroyed) return;
+    if (!nextItem) {
+      timer = setTimeout(scheduleNext, 10000);
+      return;
+    }
     const nextSlot = 1 - active;
 
     setSlide(slides[nextSlot], nextItem);
@@ -221,53 +323,35 @@ function buildCarousel(cfg, folders, imagesIndex) {
     }, 1000);
 
     active = nextSlot;
-
-    if (nextItem.type === "video") {
-      const vid = slides[nextSlot].vid;
-      vid.currentTime = 0;
-      vid.muted = false;
-
-      const onEnded = () => {
-        vid.removeEventListener("ended", onEnded);
-        scheduleNext();
-      };
-      vid.addEventListener("ended", onEnded);
-
-      vid.play().catch((e) => {
-        console.error("Video play failed", e);
-        timer = setTimeout(scheduleNext, interval);
-      });
-    } else {
-      timer = setTimeout(scheduleNext, interval);
-    }
+    play(nextItem, slides[nextSlot]);
   }
 
   // Start logic
-  const firstItem = images[0];
-  if (firstItem.type === "video") {
-    const vid = slides[0].vid;
-    vid.currentTime = 0;
-    vid.muted = false;
-    const onEnded = () => {
-      vid.removeEventListener("ended", onEnded);
-      scheduleNext();
-    };
-    vid.addEventListener("ended", onEnded);
-    vid.play().catch((e) => {
-      console.error("First video play failed", e);
-      timer = setTimeout(scheduleNext, interval);
-    });
-  } else {
-    timer = setTimeout(scheduleNext, interval);
-  }
-
-  // cleanup hook
-  container.__destroy = () => {
-    clearTimeout(timer);
-    slides.forEach((s) => {
-      if (s.vid) s.vid.pause();
+  playlist
+    .next()
+    .then((first) => {
+      if (destroyed) return;
+      if (!first) {
+        const empty = el("div", "kioskText");
+        empty.innerHTML = `<h1>Keine Bilder</h1><p>Bitte in der Adminseite einen Ordner anlegen und Bilder hochladen.</p>`;
+        container.appendChild(empty);
+        return;
+      }
+      if (playlist.total === 1) {
+        slides.length = 0;
+        showSingle(first);
+        return;
+      }
+      for (const s of slides) container.appendChild(s.root);
+      cycling = true;
+      setSlide(slides[0], first);
+      slides[0].root.classList.add("active");
+      play(first, slides[0]);
+    })
+    .catch((err) => {
+      if (destroyed) return;
+      container.innerHTML = `<div class="kioskText"><h1>Fehler</h1><p>${String(err)}</p></div>`;
     });
-  };
 
   return container;
 }
@@ -526,6 +610,17 @@ function buildEventBox(cfg) {
   return box;
 }
 
+// Folders or images changed: only the carousel's playlist is affected.
+function refreshPlaylist() {
+  if ((state.config.layout?.mode || "carousel") === "text") return;
+  const main = document.getElementById("mainPanel");
+  const current = main.firstChild;
+  if (current && current.__refresh && current.__refresh()) return;
+  destroyMainPanel(current);
+  main.innerHTML = "";
+  main.appendChild(buildCarousel(state.config));
+}
+
 function render(state) {
   const cfg = state.config;
   setTheme(cfg.theme);
@@ -583,19 +678,73 @@ function render(state) {
   if (mode === "text") {
     main.appendChild(buildTextPanel(cfg));
   } else {
-    main.appendChild(buildCarousel(cfg, state.folders, state.images));
+    main.appendChild(buildCarousel(cfg));
   }
 
   buildInfoColumn(cfg, state.weather);
   startTicker(cfg);
 }
 
-async function fetchState() {
-  const r = await fetch("/api/state", { cache: "no-store" });
+// Returns null when the server answers 304 (nothing changed since `since`).
+// The kiosk never needs the image index: the carousel pages /api/playlist.
+async function fetchState(since) {
+  const url = since != null ? `/api/state?images=0&since=${since}` : "/api/state?images=0";
+  const headers = since != null && stateEtag ? { "If-None-Match": stateEtag } : {};
+  const r = await fetch(url, { cache: "no-store", headers });
+  if (r.status === 304) return null;
   if (!r.ok) throw new Error("state load failed");
+  stateEtag = r.headers.get("ETag");
   return await r.json();
 }
 
+// Apply a delta (from /api/state?since or a WebSocket "delta"). Config
+// changes re-render the page; folder and image changes only reload the
+// carousel's playlist window, so the current slide keeps playing.
+function applyDelta(d) {
+  state = { ...state, version: d.version };
+  if (d.weather !== undefined) {
+    state.weather = d.weather;
+    state.server_time = d.server_time;
+  }
+  if (d.folders) state.folders = d.folders;
+  if (d.config) {
+    state.config = d.config;
+    render(state);
+  } else if (d.folders || d.image_folders) {
+    refreshPlaylist();
+    if (d.weather !== undefined) buildInfoColumn(state.config, state.weather);
+  } else if (d.weather !== undefined) {
+    buildInfoColumn(state.config, state.weather);
+  }
+}
+
+async function refreshState() {
+  const s2 = await fetchState(state?.version);
+  if (!s2) return;
+  if (!s2.delta) {
+    state = s2;
+    render(state);
+    return;
+  }
+  applyDelta(s2);
+}
+
+let refreshTimer = null;
+
+// Refetch after a random delay within the server's jitter hint, so not every
+// screen hits /api/state in the same millisecond. Further events while a
+// refetch is pending are merged into it.
+function scheduleRefresh(jitterMs) {
+  if (refreshTimer) return;
+  const delay = Math.random() * clamp(parseInt(jitterMs ?? 0, 10) || 0, 0, 10000);
+  refreshTimer = setTimeout(async () => {
+    refreshTimer = null;
+    try {
+      await refreshState();
+    } catch (_) {}
+  }, delay);
+}
+
 function connectWs() {
   try {
     const proto = location.protocol === "https:" ? "wss" : "ws";
@@ -603,9 +752,23 @@ function connectWs() {
     ws.onmessage = async (ev) => {
       try {
         const msg = JSON.parse(ev.data);
-        if (msg.type === "refresh") {
-          state = await fetchState();
-          render(state);
+        if (msg.type === "ping") {
+          // server heartbeat; answering keeps the connection from being reaped
+          ws.send("pong");
+        } else if (msg.type === "delta") {
+          if (state && msg.from === state.version) {
+            applyDelta(msg);
+          } else if (!state || msg.version > state.version) {
+            // version gap: we missed something, fall back to a fetch
+            scheduleRefresh(0);
+          }
+        } else if (msg.type === "weather") {
+          if (state) {
+            state = { ...state, weather: msg.weather };
+            buildInfoColumn(state.config, state.weather);
+          }
+        } else if (msg.type === "refresh") {
+          scheduleRefresh(msg.jitter_ms);
         }
       } catch (_) {}
     };
@@ -633,16 +796,8 @@ async function init() {
   );
   setInterval(async () => {
     try {
-      const s2 = await fetchState();
-      // naive diff: compare config string
-      if (
-        JSON.stringify(s2.config) !== JSON.stringify(state.config) ||
-        JSON.stringify(s2.images) !== JSON.stringify(state.images) ||
-        JSON.stringify(s2.weather) !== JSON.stringify(state.weather)
-      ) {
-        state = s2;
-        render(state);
-      }
+      // ETag + ?since: unchanged state costs a 304, changes arrive as a delta
+      await refreshState();
     } catch (_) {}
   }, poll * 1000);
 }
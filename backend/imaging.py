@@ -0,0 +1,212 @@
+"""Image work that runs in the ``ImagePool`` workers.
+
+Spawned pool workers import only this module, so it must stay free of side
+effects: no FastAPI app, no data directories, no store. It depends on the
+standard library only; Pillow is imported on first use.
+"""
+from __future__ import annotations
+
+import io
+import math
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Resize targets
+MAX_IMAGE_EDGE = 1920
+THUMB_EDGE = 480
+OUTPUT_FORMAT = "WEBP"  # Chromium supports WebP well (size win)
+OUTPUT_QUALITY = 85
+
+# Image processing profiles (IMAGE_PROFILE):
+#   draft        JPEG reduced-resolution decoding when the source is >= 2x the target
+#   resample     Pillow resampling filter; reducing_gap enables staged reduction (None = off)
+#   method_*     WebP encoder effort 0 (fastest) .. 6 (smallest) for main image and thumbnail
+#   avif_speed   AVIF encoder speed 0 (slowest, smallest) .. 10 (fastest)
+IMAGE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "fast": {"draft": True, "resample": "BILINEAR", "reducing_gap": 2.0, "method_main": 2, "method_thumb": 0,
+             "avif_speed": 10},
+    "balanced": {"draft": True, "resample": "LANCZOS", "reducing_gap": 3.0, "method_main": 4, "method_thumb": 2,
+                 "avif_speed": 8},
+    "max-compression": {"draft": False, "resample": "LANCZOS", "reducing_gap": None, "method_main": 6,
+                        "method_thumb": 6, "avif_speed": 4},
+}
+IMAGE_PROFILE = os.environ.get("IMAGE_PROFILE", "balanced")
+# decompression-bomb guard: refuse sources above this many pixels
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", str(80_000_000)))
+
+# Rendition ladder for kiosk displays, as display heights (720 -> 1280 px long edge, 16:9).
+# Rungs are only produced below the source size; the one matching MAX_IMAGE_EDGE reuses the main file.
+IMAGE_LADDER = [int(x) for x in os.environ.get("IMAGE_LADDER", "720,1080,1440,2160").split(",") if x.strip()]
+# Additional AVIF files next to each rung (slow to encode on a Pi, so opt-in; skipped if Pillow lacks AVIF)
+IMAGE_AVIF = os.environ.get("IMAGE_AVIF", "0") == "1"
+AVIF_QUALITY = 60
+
+SheetTile = Tuple[str, int, int, int, int]  # thumbnail file, x, y, w, h
+
+def pil() -> Any:
+    """Pillow's ``Image`` module, imported on first use.
+
+    Neither the kiosk nor the admin UI need Pillow until something is uploaded,
+    so it stays out of the cold start; pool workers import it when warmed.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    return Image
+
+def warm_worker() -> int:
+    # load Pillow's codec plugins once per worker instead of on the first upload
+    pil().init()
+    return os.getpid()
+
+def run_tool(args: List[Any], timeout: float) -> bytes:
+    """Run ffmpeg/ffprobe; raises RuntimeError with the last stderr line on failure."""
+    proc = subprocess.run([str(a) for a in args], capture_output=True, timeout=timeout, check=False)
+    if proc.returncode != 0:
+        lines = proc.stderr.decode("utf-8", "replace").strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"{Path(str(args[0])).name} exited with {proc.returncode}")
+    return proc.stdout
+
+def _resize_to_edge(im: Image.Image, edge: int, profile: Dict[str, Any]) -> Image.Image:
+    w, h = im.size
+    scale = min(1.0, float(edge) / max(w, h))
+    if scale >= 1.0:
+        return im
+    return im.resize(
+        (int(w * scale), int(h * scale)),
+        pil().Resampling[profile["resample"]],
+        reducing_gap=profile["reducing_gap"],
+    )
+
+def _ladder_edge(height: int) -> int:
+    return height * 16 // 9
+
+# ⚡ Bolt: Process image and thumbnail together to avoid redundant I/O and resizing from massive original files.
+def process_image(
+    src_path: Path,
+    dst_path: Path,
+    thumb_path: Path,
+    profile_name: str = IMAGE_PROFILE,
+    ladder: Optional[List[int]] = None,
+    avif: bool = IMAGE_AVIF,
+) -> Dict[str, Any]:
+    """Write the main WebP, the rendition ladder and the thumbnail.
+
+    Returns ``width``/``height`` of the main image, the produced ``renditions``
+    (display height, size, formats; ``main`` marks the rung that is the main
+    file) and per-stage ``timings`` in ms.
+    """
+    from PIL import ImageOps, features
+
+    Image = pil()
+    profile = IMAGE_PROFILES.get(profile_name) or IMAGE_PROFILES["balanced"]
+    ladder = IMAGE_LADDER if ladder is None else ladder
+    avif = avif and features.check("avif")
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal t0
+        now = time.perf_counter()
+        timings[stage] = round((now - t0) * 1000.0, 1)
+        t0 = now
+
+    with Image.open(src_path) as im:
+        w, h = im.size
+        if w * h > IMAGE_MAX_PIXELS:
+            raise ValueError(f"image has {w * h} pixels (max {IMAGE_MAX_PIXELS})")
+        src_edge = max(w, h)
+        # rungs strictly below the source size (no upscaling), plus the main size
+        rungs = {hgt: _ladder_edge(hgt) for hgt in ladder if _ladder_edge(hgt) < src_edge}
+        need_edge = max([min(MAX_IMAGE_EDGE, src_edge)] + list(rungs.values()))
+        scale = float(need_edge) / src_edge
+        if profile["draft"] and scale <= 0.5:
+            # JPEG: let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the target size
+            im.draft("RGB", (math.ceil(w * scale), math.ceil(h * scale)))
+        im.load()
+        lap("decode")
+        im = ImageOps.exif_transpose(im)
+        im = im.convert("RGB")
+        lap("convert")
+
+        # staged reduction: every size is derived from the next larger one
+        edges = sorted(set(rungs.values()) | {MAX_IMAGE_EDGE}, reverse=True)
+        sized: Dict[int, Image.Image] = {}
+        cur = im
+        for edge in edges:
+            cur = _resize_to_edge(cur, edge, profile)
+            sized[edge] = cur
+        main_im = sized[MAX_IMAGE_EDGE]
+        lap("resize")
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        main_im.save(dst_path, OUTPUT_FORMAT, quality=OUTPUT_QUALITY, method=profile["method_main"])
+        lap("encode")
+
+        renditions: List[Dict[str, Any]] = []
+        for hgt, edge in sorted(rungs.items()):
+            r_im = sized[edge]
+            is_main = edge == MAX_IMAGE_EDGE
+            stem = dst_path.parent / f"{dst_path.stem}_{hgt}p"
+            if not is_main:
+                r_im.save(stem.with_suffix(".webp"), OUTPUT_FORMAT, quality=OUTPUT_QUALITY,
+                          method=profile["method_main"])
+            formats = ["webp"]
+            if avif:
+                r_im.save(stem.with_suffix(".avif"), "AVIF", quality=AVIF_QUALITY, speed=profile["avif_speed"])
+                formats.append("avif")
+            rw, rh = r_im.size
+            renditions.append({"h": hgt, "width": rw, "height": rh, "formats": formats, "main": is_main})
+        if rungs:
+            lap("renditions")
+
+        # thumbnail from the smallest image that is still large enough
+        thumb_src = min((img for img in sized.values() if max(img.size) >= THUMB_EDGE),
+                        key=lambda img: max(img.size), default=main_im)
+        thumb_im = _resize_to_edge(thumb_src, THUMB_EDGE, profile)
+        thumb_path.parent.mkdir(parents=True, exist_ok=True)
+        thumb_im.save(thumb_path, OUTPUT_FORMAT, quality=78, method=profile["method_thumb"])
+        lap("thumb")
+
+        mw, mh = main_im.size
+        return {"width": mw, "height": mh, "renditions": renditions, "timings": timings}
+
+def video_poster(
+    ffmpeg: str, src_path: Path, poster_path: Path, thumb_path: Path, at_sec: float, profile_name: str
+) -> None:
+    """Grab one frame at ``at_sec`` and write it as WebP poster and thumbnail."""
+    profile = IMAGE_PROFILES.get(profile_name) or IMAGE_PROFILES["balanced"]
+    png = run_tool(
+        [ffmpeg, "-v", "error", "-ss", f"{at_sec:.2f}", "-i", src_path,
+         "-frames:v", "1", "-f", "image2pipe", "-c:v", "png", "-"],
+        120,
+    )
+    with pil().open(io.BytesIO(png)) as im:
+        frame = im.convert("RGB")
+    poster = _resize_to_edge(frame, MAX_IMAGE_EDGE, profile)
+    poster.save(poster_path, OUTPUT_FORMAT, quality=OUTPUT_QUALITY, method=profile["method_main"])
+    thumb = _resize_to_edge(poster, THUMB_EDGE, profile)
+    thumb.save(thumb_path, OUTPUT_FORMAT, quality=78, method=profile["method_thumb"])
+
+def render_sheet(folder_dir: str, tiles: List[SheetTile], size: Tuple[int, int], dst: str) -> int:
+    """Paste thumbnails into one WebP sprite; missing thumbnails stay blank."""
+    from PIL import ImageOps
+
+    Image = pil()
+    sheet = Image.new("RGB", size, (34, 34, 34))
+    for name, x, y, w, h in tiles:
+        try:
+            with Image.open(os.path.join(folder_dir, name)) as im:
+                sheet.paste(ImageOps.fit(im.convert("RGB"), (w, h), Image.Resampling.BILINEAR), (x, y))
+        except (OSError, ValueError):
+            continue
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    sheet.save(tmp, OUTPUT_FORMAT, quality=80, method=4)
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
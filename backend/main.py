@@ -2,24 +2,61 @@
 from __future__ import annotations
 
 import asyncio
+import base64
+import bisect
+import concurrent.futures
+import copy
+import gzip
+import hashlib
 import json
+import mimetypes
+import multiprocessing
 import os
+import random
 import re
 import shutil
+import socket
+import sqlite3
+import stat
+import subprocess
+import threading
 import time
+import urllib.parse
 import uuid
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple
-from PIL import Image, ImageOps
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 
-import httpx
 from fastapi import (
-    FastAPI, File, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
+    FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 )
 from fastapi.responses import FileResponse, HTMLResponse, Response
-from fastapi.staticfiles import StaticFiles
-from PIL import Image
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+try:  # optional: brotli-compressed /api/state bodies
+    import brotli
+except ImportError:  # pragma: no cover - depends on the image
+    brotli = None
+
+try:  # only the "unix" broadcast backend needs it
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from .imaging import (
+    IMAGE_PROFILE, SheetTile, pil, process_image, render_sheet, run_tool, video_poster, warm_worker
+)
+
+if TYPE_CHECKING:  # httpx is imported on first use
+    import httpx
 
 APP_NAME = "Kita-Infotafel"
 DATA_DIR = Path(os.environ.get("DATA_DIR", "/data")).resolve()
@@ -27,6 +64,15 @@ MEDIA_DIR = DATA_DIR / "media"
 CONFIG_PATH = DATA_DIR / "config.json"
 FOLDERS_PATH = DATA_DIR / "folders.json"
 INDEX_PATH = DATA_DIR / "index.json"
+JOBS_DIR = DATA_DIR / "jobs"
+# content-addressed derivatives, shared (hardlinked) by every folder that uses them
+CAS_DIR = MEDIA_DIR / ".cas"
+UPLOAD_STAGING_DIR = DATA_DIR / "tmp_upload"
+ASSET_CACHE_DIR = DATA_DIR / ".assets"  # gzip/brotli variants of the frontend files
+SHEET_DIR = DATA_DIR / ".sheets"  # contact sheets of the admin image grid, per folder
+# Folders + image index: "json" (folders.json/index.json) or "sqlite" (WAL database)
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "json").strip().lower()
+DB_PATH = DATA_DIR / "infotafel.db"
 
 import secrets
 
@@ -41,21 +87,90 @@ DEFAULT_LON = float(os.environ.get("DEFAULT_LON", "10.3"))
 MAX_UPLOAD_FILES = 30
 MAX_UPLOAD_MB_PER_FILE = 500  # allow larger files for videos
 
-# Resize targets
-MAX_IMAGE_EDGE = 1920
-THUMB_EDGE = 480
-OUTPUT_FORMAT = "WEBP"  # Chromium supports WebP well (size win)
-OUTPUT_QUALITY = 85
+# Resize targets, profiles and the rendition ladder live in imaging.py (IMAGE_PROFILE, IMAGE_LADDER, ...)
+# Image processing pool: "process" (one core per worker) or "thread"
+IMAGE_POOL_KIND = os.environ.get("IMAGE_POOL", "process")
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
 
 ALLOWED_VIDEO_EXTS = {".mp4", ".webm", ".mov"}
 
+# Video pipeline (ffmpeg/ffprobe on PATH; without them videos are stored as uploaded)
+FFMPEG_BIN = shutil.which(os.environ.get("FFMPEG_BIN", "ffmpeg"))
+FFPROBE_BIN = shutil.which(os.environ.get("FFPROBE_BIN", "ffprobe"))
+# Kiosk rendition for videos the Pi can't play smoothly: "h264" (.mp4), "vp9" (.webm) or "" (off)
+VIDEO_TRANSCODE = os.environ.get("VIDEO_TRANSCODE", "").strip().lower()
+VIDEO_MAX_EDGE = int(os.environ.get("VIDEO_MAX_EDGE", "1920"))
+VIDEO_MAX_BITRATE = int(os.environ.get("VIDEO_MAX_BITRATE", "6000000"))
+VIDEO_WORKERS = int(os.environ.get("VIDEO_WORKERS", "1"))
+VIDEO_TIMEOUT_SEC = 1800
+PLAYABLE_VIDEO_CODECS = {"h264", "vp8", "vp9"}
+
+# Media delivery: file names are random ids whose content never changes
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_CHUNK_BYTES = 512 * 1024
+MEDIA_HASH_MAX_BYTES = 64 * 1024 * 1024  # larger files (videos) get a stat-based ETag
+
+# Media reconciler: finds orphaned files, stale temp data and entries whose files are gone
+RECONCILE_INTERVAL_SEC = int(os.environ.get("RECONCILE_INTERVAL_SEC", str(6 * 3600)))
+RECONCILE_REMOVE = os.environ.get("RECONCILE_REMOVE", "0") == "1"  # otherwise report only
+RECONCILE_BATCH = 256  # directory entries per step
+RECONCILE_PAUSE_SEC = 0.02  # between steps, so requests never queue behind the scan
+RECONCILE_GRACE_SEC = 3600  # younger files may belong to an upload in progress
+RECONCILE_REPORT_MAX = 200  # paths listed per report category
+
+# Kiosk playlist paging
+PLAYLIST_PAGE_DEFAULT = 10
+PLAYLIST_PAGE_MAX = 50
+PLAYLIST_PRELOAD = 3  # Link: preload hints for the first items of a page
+
+# Admin image listing: cursor pages and contact sheets (one sprite of thumbnails per page)
+IMAGE_PAGE_MAX = 500
+FOLDER_PREVIEW = 6  # entries per folder card in /api/folders
+IMAGE_SORTS = ("uploaded", "name")
+SHEET_TILE_HEIGHT = 120  # px, the row height of the admin grid
+SHEET_WIDTH = 1600  # tiles are packed into rows up to this width
+SHEET_KEEP = 32  # rendered sheets kept per folder
+
+# Weather (Open-Meteo); base URL can point at a local stand-in for tests
+WEATHER_BASE_URL = os.environ.get("WEATHER_BASE_URL", "https://api.open-meteo.com/v1/forecast")
+WEATHER_TTL_SEC = 1800
+WEATHER_REFRESH_AHEAD_SEC = 300  # background refresh this long before expiry
+WEATHER_POLL_SEC = 60
+WEATHER_BACKOFF_MAX_SEC = 1800
+
+# WebSocket keepalive: server pings every HEARTBEAT, clients silent for IDLE_TIMEOUT are dropped
+WS_HEARTBEAT_SEC = 25
+WS_IDLE_TIMEOUT_SEC = 75
+
+# Several uvicorn workers (--workers N / WEB_CONCURRENCY) need "unix": broadcasts are relayed
+# between the workers through sockets in BROADCAST_DIR and state versions are shared
+BROADCAST_BACKEND = os.environ.get(
+    "BROADCAST_BACKEND", "unix" if int(os.environ.get("WEB_CONCURRENCY") or 1) > 1 else "local"
+).lower()
+BROADCAST_DIR = Path(os.environ.get("BROADCAST_DIR", str(DATA_DIR / ".bus")))
+BROADCAST_POLL_SEC = 2.0  # catch-up interval for missed datagrams and edits by hand
+
 # ---- Utilities ----
 
-def _atomic_write_json(path: Path, data: Any) -> None:
+def _atomic_write_text(path: Path, text: str, durable: bool = False) -> None:
+    """Replace ``path`` atomically; ``durable`` also fsyncs the data and the directory entry."""
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + ".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
     tmp.replace(path)
+    if durable:
+        fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _atomic_write_json(path: Path, data: Any) -> None:
+    _atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
 
 def _load_json(path: Path, default: Any) -> Any:
     try:
@@ -103,6 +218,226 @@ def safe_filename(original: str) -> str:
         base = stem[:100] + suf
     return base or "upload"
 
+def _process_age() -> Optional[float]:
+    """Seconds since this process was started (Linux only, 10 ms resolution)."""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            # the command name may contain spaces; starttime is the 20th field after it
+            fields = f.read().rsplit(b")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class StartupTimer:
+    """Cold-start phases in seconds since the process started.
+
+    ``imports`` is reached once the module's imports are done, ``module`` at
+    the end of the module body and ``ready`` when the lifespan starts serving.
+    Where the process start time is unknown, times count from the first import.
+    """
+
+    def __init__(self) -> None:
+        self._t0 = time.monotonic() - (_process_age() or 0.0)
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        self.phases[phase] = round(time.monotonic() - self._t0, 3)
+
+startup = StartupTimer()
+startup.mark("imports")
+
+# ---- Metrics ----
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0, 600.0)
+
+def _label_str(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [
+        n + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for n, v in zip(names, values)
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Monotonic counter per label tuple. ``inc`` is a dict update, cheap enough for hot paths."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [(self.name, _label_str(self.labels, k), v) for k, v in list(self._values.items())]
+
+class Histogram:
+    """Cumulative-bucket histogram per label tuple (seconds).
+
+    ``observe`` only bumps one bucket slot; the cumulative counts Prometheus
+    expects are summed up at scrape time.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ) -> None:
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label tuple -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        s[0][bisect.bisect_left(self.buckets, value)] += 1
+        s[1] += value
+        s[2] += 1
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        out: List[Tuple[str, str, float]] = []
+        for key, (counts, total, n) in list(self._series.items()):
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), list(counts)):
+                acc += c
+                out.append((self.name + "_bucket", _label_str(self.labels, key, f'le="{"+Inf" if le == float("inf") else le}"'), acc))
+            out.append((self.name + "_sum", _label_str(self.labels, key), total))
+            out.append((self.name + "_count", _label_str(self.labels, key), n))
+        return out
+
+class Gauge:
+    """Value(s) read at scrape time from ``fn``, which returns ``{label tuple: value}``.
+
+    Also used with ``kind="counter"`` for totals another component already keeps.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], Dict[Tuple[str, ...], float]],
+        labels: Tuple[str, ...] = (),
+        kind: str = "gauge",
+    ) -> None:
+        self.name, self.help, self.labels, self._fn, self.kind = name, help, labels, fn, kind
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        try:
+            values = self._fn()
+        except Exception:
+            return []
+        return [(self.name, _label_str(self.labels, k), v) for k, v in values.items()]
+
+class Metrics:
+    """Process-local registry rendered in the Prometheus text format by ``GET /metrics``."""
+
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+
+    def _add(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(
+        self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        fn: Callable[[], Dict[Tuple[str, ...], float]],
+        labels: Tuple[str, ...] = (),
+        kind: str = "gauge",
+    ) -> Gauge:
+        return self._add(Gauge(name, help, fn, labels, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+metric_http_seconds = metrics.histogram(
+    "infotafel_http_request_duration_seconds", "HTTP request latency until the last body byte.", ("method", "route")
+)
+metric_http_requests = metrics.counter(
+    "infotafel_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")
+)
+metric_media_stage_seconds = metrics.histogram(
+    "infotafel_media_stage_duration_seconds", "Upload processing time per pipeline stage.",
+    ("pipeline", "stage"), STAGE_BUCKETS,
+)
+metric_media_bytes = metrics.counter(
+    "infotafel_media_bytes_total", "Upload bytes read (in) and media bytes written (out).", ("pipeline", "direction")
+)
+metric_media_uploads = metrics.counter(
+    "infotafel_media_uploads_total", "Processed uploads by outcome (processed, dedup, failed).", ("pipeline", "result")
+)
+metric_weather_lookups = metrics.counter(
+    "infotafel_weather_cache_lookups_total", "Weather cache lookups (hit, stale, miss).", ("result",)
+)
+metric_weather_fetch_seconds = metrics.histogram(
+    "infotafel_weather_fetch_duration_seconds", "Upstream weather fetch latency.", ("result",)
+)
+metric_store_reads = metrics.counter(
+    "infotafel_store_reads_total", "State documents (re)loaded from disk.", ("doc",)
+)
+metric_store_read_seconds = metrics.histogram(
+    "infotafel_store_read_duration_seconds", "Time to load a state document from disk.", ("doc",)
+)
+metric_store_write_seconds = metrics.histogram(
+    "infotafel_store_write_duration_seconds", "Time to commit a state document.", ("doc",)
+)
+
+class MetricsMiddleware:
+    """Plain ASGI middleware timing HTTP requests per route template.
+
+    The route is read from the scope after routing, so ``/media/a/b.webp`` and
+    ``/api/folders/x/images`` are counted under their path patterns and the
+    label set stays small. WebSockets and lifespan events pass through untouched.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            metric_http_seconds.observe(time.perf_counter() - t0, method, path)
+            metric_http_requests.inc(method, path, str(status))
+
 # ---- Data model (JSON files) ----
 
 def default_config() -> Dict[str, Any]:
@@ -166,7 +501,10 @@ def default_config() -> Dict[str, Any]:
             ],
         },
         "autorefresh": {
-            "poll_fallback_sec": 30
+            "poll_fallback_sec": 30,
+            "debounce_ms": 300,  # quiet window for merging refresh events
+            "max_delay_ms": 2000,  # upper bound while mutations keep arriving
+            "jitter_ms": 1500,  # kiosks spread their refetch over this window (0 = off)
         }
     }
 
@@ -181,437 +519,3759 @@ def default_index() -> Dict[str, Any]:
         "images": {}
     }
 
-def load_config() -> Dict[str, Any]:
-    cfg = _load_json(CONFIG_PATH, default_config())
+def _deep_merge(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
+    for k, v in src.items():
+        if k not in dst:
+            dst[k] = v
+        elif isinstance(v, dict) and isinstance(dst.get(k), dict):
+            _deep_merge(dst[k], v)
+    return dst
+
+def _merge_config_defaults(cfg: Any) -> Dict[str, Any]:
     # merge missing keys (simple forward-compat)
-    def deep_merge(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
-        for k, v in src.items():
-            if k not in dst:
-                dst[k] = v
-            elif isinstance(v, dict) and isinstance(dst.get(k), dict):
-                deep_merge(dst[k], v)
-        return dst
-    return deep_merge(cfg, default_config())
+    if not isinstance(cfg, dict):
+        cfg = {}
+    return _deep_merge(cfg, default_config())
 
-def save_config(cfg: Dict[str, Any]) -> None:
-    _atomic_write_json(CONFIG_PATH, cfg)
+# ---- Cross-process broadcast ----
 
-def load_folders() -> Dict[str, Any]:
-    return _load_json(FOLDERS_PATH, default_folders())
+class SharedLog:
+    """Commit lock and change log shared by all workers on one DATA_DIR.
 
-def save_folders(data: Dict[str, Any]) -> None:
-    _atomic_write_json(FOLDERS_PATH, data)
+    Workers hold the lock exclusively while they modify a state document and
+    append a record ``{"v": version, "s": section, "f": folder_ids}`` for it,
+    so versions are allocated in one sequence and mean the same in every
+    worker. Readers take it shared to reload documents and adopt new records
+    consistently. The lock is a ``flock`` on ``commit.lock`` plus an RLock,
+    because flock does not exclude threads of the same process.
+    """
 
-def load_index() -> Dict[str, Any]:
-    return _load_json(INDEX_PATH, default_index())
+    ROTATE_BYTES = 256 * 1024
+    KEEP_RECORDS = 256
 
-def save_index(data: Dict[str, Any]) -> None:
-    _atomic_write_json(INDEX_PATH, data)
+    def __init__(self, directory: Path) -> None:
+        self.dir = directory
+        self.path = directory / "changes.log"
+        self._fd: Optional[int] = None
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self.exclusive = False  # meaningful while held
+        # read position in changes.log
+        self._ino = 0
+        self._offset = 0
 
-# ---- WebSocket broadcast ----
+    def _lock_fd(self) -> int:
+        if self._fd is None:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.dir / "commit.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
 
-class Hub:
-    def __init__(self) -> None:
-        self._queues: Dict[WebSocket, asyncio.Queue] = {}
-        self._lock = asyncio.Lock()
+    @contextmanager
+    def locked(self, exclusive: bool, blocking: bool = True) -> Iterator[bool]:
+        """Hold the lock; yields False instead when ``blocking`` is off and it is busy."""
+        if not self._rlock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            if self._depth == 0:
+                mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+                try:
+                    fcntl.flock(self._lock_fd(), mode if blocking else mode | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                self.exclusive = exclusive
+            elif exclusive and not self.exclusive:
+                raise RuntimeError("shared state lock cannot be upgraded")
+            self._depth += 1
+            try:
+                yield True
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._lock_fd(), fcntl.LOCK_UN)
+        finally:
+            self._rlock.release()
 
-    async def connect(self, ws: WebSocket) -> asyncio.Queue:
-        await ws.accept()
-        q: asyncio.Queue = asyncio.Queue(maxsize=20)
-        async with self._lock:
-            self._queues[ws] = q
-        return q
+    def changed(self) -> bool:
+        """Cheap check whether anything was appended since the last ``read_new``."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return st.st_ino != self._ino or st.st_size != self._offset
 
-    async def disconnect(self, ws: WebSocket) -> None:
-        async with self._lock:
-            self._queues.pop(ws, None)
+    def read_new(self) -> List[Dict[str, Any]]:
+        """Records appended since the last call (lock held)."""
+        try:
+            with open(self.path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self._ino or st.st_size < self._offset:
+                    self._ino, self._offset = st.st_ino, 0  # rotated: start over, old versions are skipped
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        self._offset += len(data)
+        out = []
+        for line in data.splitlines():
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                pass
+        return out
 
-    async def broadcast(self, msg: Dict[str, Any]) -> None:
-        async with self._lock:
-            dead: List[WebSocket] = []
-            for ws, q in self._queues.items():
-                try:
-                    if q.full():
-                        # drop one to keep freshest updates
-                        _ = q.get_nowait()
-                    q.put_nowait(msg)
-                except Exception:
-                    dead.append(ws)
-            for ws in dead:
-                self._queues.pop(ws, None)
+    def append(self, records: List[Dict[str, Any]]) -> None:
+        """Append ``records`` (exclusive lock held, after ``read_new``)."""
+        data = b"".join(json.dumps(r, separators=(",", ":")).encode("utf-8") + b"\n" for r in records)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(data)
+            st = os.fstat(f.fileno())
+        self._ino, self._offset = st.st_ino, st.st_size
+        if st.st_size > self.ROTATE_BYTES:
+            keep = b"".join(self.path.read_bytes().splitlines(keepends=True)[-self.KEEP_RECORDS:])
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_bytes(keep)
+            tmp.replace(self.path)
+            st = os.stat(self.path)
+            self._ino, self._offset = st.st_ino, st.st_size
 
-hub = Hub()
+class LocalBroadcast:
+    """Single process: the hub already reaches every socket, nothing to relay."""
 
-# ---- Weather cache ----
+    shared: Optional[SharedLog] = None
 
+    def start(self, handler: Callable[[Dict[str, Any]], None]) -> None:
+        pass
 
-@dataclass
-class WeatherCache:
-    ts: float = 0.0
-    payload: Optional[Dict[str, Any]] = None
+    async def stop(self) -> None:
+        pass
 
-weather_cache = WeatherCache()
+    def send(self, msg: Dict[str, Any]) -> None:
+        pass
 
-async def fetch_weather(lat: float, lon: float, units: str = "metric") -> Dict[str, Any]:
-    # Open-Meteo: no key required
-    # docs: https://open-meteo.com/
-    temp_unit = "celsius" if units == "metric" else "fahrenheit"
-    wind_unit = "kmh" if units == "metric" else "mph"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "current": "temperature_2m,apparent_temperature,is_day,weather_code,wind_speed_10m",
-        "daily": "temperature_2m_max,temperature_2m_min,weather_code",
-        "timezone": "auto",
-        "temperature_unit": temp_unit,
-        "wind_speed_unit": wind_unit,
-    }
-    url = "https://api.open-meteo.com/v1/forecast"
-    async with httpx.AsyncClient(timeout=8.0) as client:
-        r = await client.get(url, params=params)
-        r.raise_for_status()
-        data = r.json()
+    def is_leader(self) -> bool:
+        return True
 
-    # minimal normalization for frontend
-    current = data.get("current", {})
-    daily = data.get("daily", {})
-    out = {
-        "fetched_at": now_iso(),
-        "current": {
-            "temp": current.get("temperature_2m"),
-            "feels": current.get("apparent_temperature"),
-            "wind": current.get("wind_speed_10m"),
-            "code": current.get("weather_code"),
-            "is_day": current.get("is_day"),
-        },
-        "daily": []
-    }
-    times = daily.get("time", []) or []
-    tmax = daily.get("temperature_2m_max", []) or []
-    tmin = daily.get("temperature_2m_min", []) or []
-    codes = daily.get("weather_code", []) or []
-    for i in range(min(3, len(times))):
-        out["daily"].append({
-            "date": times[i],
-            "tmax": tmax[i] if i < len(tmax) else None,
-            "tmin": tmin[i] if i < len(tmin) else None,
-            "code": codes[i] if i < len(codes) else None,
-        })
-    return out
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "local"}
 
-async def get_weather_cached(cfg: Dict[str, Any]) -> Dict[str, Any]:
-    wcfg = cfg.get("info_boxes", {}).get("weather", {})
-    lat = float(wcfg.get("lat", DEFAULT_LAT))
-    lon = float(wcfg.get("lon", DEFAULT_LON))
-    units = wcfg.get("units", "metric")
-    now = time.time()
-    # refresh every 30 minutes
-    if weather_cache.payload is None or (now - weather_cache.ts) > 1800:
-        try:
-            weather_cache.payload = await fetch_weather(lat, lon, units)
-            weather_cache.ts = now
-        except Exception as e:
-            # keep last payload; surface error info
-            if weather_cache.payload is None:
-                weather_cache.payload = {"error": str(e), "fetched_at": now_iso(), "current": None, "daily": []}
-    return weather_cache.payload
+class UnixBroadcast:
+    """Relay between uvicorn workers that share one DATA_DIR.
 
-# ---- Images ----
+    Every worker binds a Unix datagram socket ``w<pid>.sock`` in ``directory``;
+    ``send`` writes one datagram to each other socket found there (stale ones
+    of dead workers are removed). Delivery is best effort, so a poll every
+    ``BROADCAST_POLL_SEC`` also reports "sync" to pick up anything missed. The
+    worker holding ``leader.lock`` runs the once-per-deployment background work.
+    """
 
-def _ensure_data_dirs() -> None:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+    MAX_BYTES = 60 * 1024
 
-def _find_folder(folder_id: str) -> Dict[str, Any]:
-    folders = load_folders().get("folders", [])
-    for f in folders:
-        if f.get("id") == folder_id:
-            return f
-    raise HTTPException(status_code=404, detail="Folder not found")
+    def __init__(self, directory: Path) -> None:
+        if fcntl is None:
+            raise RuntimeError("BROADCAST_BACKEND=unix needs a POSIX system")
+        self.dir = directory
+        self.shared: Optional[SharedLog] = SharedLog(directory)
+        self.path = directory / f"w{os.getpid()}.sock"
+        self._sock: Optional[socket.socket] = None
+        self._handler: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._leader_fd: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
 
-def _folder_path(folder: Dict[str, Any]) -> Path:
-    return MEDIA_DIR / folder["slug"]
+    def start(self, handler: Callable[[Dict[str, Any]], None]) -> None:
+        if self._sock is not None:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # the pid may have been reused since a crash left the file behind
+        self.path.unlink(missing_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(str(self.path))
+        sock.setblocking(False)
+        self._sock, self._handler = sock, handler
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+        self._task = asyncio.create_task(self._poll())
 
-def _image_list_for(folder_id: str) -> List[Dict[str, Any]]:
-    idx = load_index()
-    return idx.get("images", {}).get(folder_id, []) or []
-
-def _save_image_list_for(folder_id: str, images: List[Dict[str, Any]]) -> None:
-    idx = load_index()
-    idx.setdefault("images", {})
-    idx["images"][folder_id] = images
-    save_index(idx)
-
-# ⚡ Bolt: Process image and thumbnail together to avoid redundant I/O and resizing from massive original files.
-def _process_image(src_path: Path, dst_path: Path, thumb_path: Path) -> Tuple[int, int]:
-    with Image.open(src_path) as im:
-        im = ImageOps.exif_transpose(im)
-        im = im.convert("RGB")
-        w, h = im.size
-        scale = min(1.0, float(MAX_IMAGE_EDGE) / max(w, h))
-        if scale < 1.0:
-            main_im = im.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
-        else:
-            main_im = im
-        dst_path.parent.mkdir(parents=True, exist_ok=True)
-        main_im.save(dst_path, OUTPUT_FORMAT, quality=OUTPUT_QUALITY, method=6)
-
-        mw, mh = main_im.size
-        thumb_scale = min(1.0, float(THUMB_EDGE) / max(mw, mh))
-        if thumb_scale < 1.0:
-            thumb_im = main_im.resize((int(mw * thumb_scale), int(mh * thumb_scale)), Image.LANCZOS)
-        else:
-            thumb_im = main_im
-        thumb_path.parent.mkdir(parents=True, exist_ok=True)
-        thumb_im.save(thumb_path, OUTPUT_FORMAT, quality=78, method=6)
+    def _on_readable(self) -> None:
+        assert self._sock is not None and self._handler is not None
+        while True:
+            try:
+                data = self._sock.recv(self.MAX_BYTES + 1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            try:
+                msg = json.loads(data)
+            except ValueError:
+                continue
+            self.received += 1
+            self._handler(msg)
 
-        return main_im.size
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(BROADCAST_POLL_SEC)
+            if self._handler is not None:
+                self._handler({"type": "sync"})
 
-# ---- App ----
+    def send(self, msg: Dict[str, Any]) -> None:
+        if self._sock is None:
+            return
+        data = json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if len(data) > self.MAX_BYTES:
+            self.dropped += 1
+            return
+        try:
+            peers = [e.path for e in os.scandir(self.dir) if e.name.endswith(".sock") and e.name != self.path.name]
+        except OSError:
+            return
+        for peer in peers:
+            try:
+                self._sock.sendto(data, peer)
+                self.sent += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(peer)  # worker is gone
+                except OSError:
+                    pass
+            except OSError:
+                self.dropped += 1  # peer queue full; its poll will catch up
 
-app = FastAPI(title=APP_NAME)
+    def is_leader(self) -> bool:
+        if self._leader_fd is None:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.dir / "leader.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._leader_fd = fd  # held until the process exits
+        return True
 
-# Mount static frontend
-FRONTEND_DIR = Path(__file__).parent / "frontend"
-app.mount("/static", StaticFiles(directory=str(FRONTEND_DIR)), name="static")
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+            self.path.unlink(missing_ok=True)
 
-# Mount /media
-_ensure_data_dirs()
-app.mount("/media", StaticFiles(directory=str(MEDIA_DIR)), name="media")
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "unix",
+            "worker": os.getpid(),
+            "leader": self._leader_fd is not None,
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
 
+broadcast: Any = UnixBroadcast(BROADCAST_DIR) if BROADCAST_BACKEND == "unix" else LocalBroadcast()
 
-@app.get("/", response_class=HTMLResponse)
-def kiosk_index() -> str:
-    return (FRONTEND_DIR / "index.html").read_text(encoding="utf-8")
+# ---- State store ----
 
-@app.get("/admin", response_class=HTMLResponse)
-def admin_index() -> str:
-    return (FRONTEND_DIR / "admin.html").read_text(encoding="utf-8")
+class JsonDocument:
+    """One JSON file held in memory.
 
-@app.get("/healthz")
-def healthz() -> Dict[str, str]:
-    return {"status": "ok"}
+    The file is parsed once and then only re-read when its (inode, mtime, size)
+    stamp changes, i.e. when somebody edited it outside this process. Saves are
+    write-through: the file is replaced atomically and the cache is refreshed
+    from the exact text that was written.
+    """
 
-# ---- Public API for kiosk ----
+    def __init__(
+        self,
+        name: str,
+        path: Path,
+        default: Callable[[], Any],
+        normalize: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        self.name = name
+        self.path = path
+        self._default = default
+        self._normalize = normalize
+        # called as on_change(name, old, new) whenever the cached value is replaced
+        self.on_change: Optional[Callable[[str, Any, Any], None]] = None
+        self._data: Any = None
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._loaded = False
+        self._lock = threading.Lock()
 
-@app.get("/api/state")
-async def api_state() -> Dict[str, Any]:
-    cfg = load_config()
-    folders = load_folders().get("folders", [])
-    idx = load_index().get("images", {})
-    weather = None
-    if cfg.get("info_boxes", {}).get("weather_enabled", True):
-        weather = await get_weather_cached(cfg)
-    return {
-        "config": cfg,
-        "folders": folders,
-        "images": idx,
-        "weather": weather,
-        "server_time": now_iso(),
-    }
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
 
-@app.get("/api/weather")
-async def api_weather() -> Dict[str, Any]:
-    cfg = load_config()
-    return await get_weather_cached(cfg)
+    def _replace_locked(self, data: Any, stamp: Optional[Tuple[int, int, int]]) -> None:
+        old, was_loaded = self._data, self._loaded
+        self._data = data
+        self._stamp = stamp
+        self._loaded = True
+        # a touched file or a save without changes must not bump the state version
+        if was_loaded and self.on_change is not None and old != data:
+            self.on_change(self.name, old, data)
 
-# ---- Admin API ----
+    def _reload_locked(self, stamp: Optional[Tuple[int, int, int]]) -> None:
+        t0 = time.perf_counter()
+        data = _load_json(self.path, self._default())
+        if self._normalize is not None:
+            data = self._normalize(data)
+        metric_store_reads.inc(self.name)
+        metric_store_read_seconds.observe(time.perf_counter() - t0, self.name)
+        self._replace_locked(data, stamp)
 
-@app.get("/api/config")
-def get_config(request: Request) -> Dict[str, Any]:
-    ensure_admin(request)
-    return load_config()
+    def snapshot(self) -> Any:
+        """Shared cached value. Callers must treat it as read-only."""
+        stamp = self._stat()
+        if not self._loaded or stamp != self._stamp:
+            if not self._lock.acquire(blocking=self._loaded is False):
+                # a save is in progress: keep serving the last committed value
+                return self._data
+            try:
+                stamp = self._stat()
+                if not self._loaded or stamp != self._stamp:
+                    self._reload_locked(stamp)
+            finally:
+                self._lock.release()
+        return self._data
 
-@app.put("/api/config")
-async def put_config(request: Request) -> Dict[str, Any]:
-    ensure_admin(request)
-    payload = await request.json()
-    if not isinstance(payload, dict):
-        raise HTTPException(status_code=400, detail="config must be an object")
-    cfg = load_config()
-    # allow overwrite of known top-level keys only to keep it safer
-    for key in ["theme","layout","carousel","text_panel","info_boxes","ticker","autorefresh","events"]:
-        if key in payload:
-            cfg[key] = payload[key]
-    save_config(cfg)
-    await hub.broadcast({"type": "refresh", "reason": "config"})
-    return {"ok": True, "config": cfg}
+    def load(self) -> Any:
+        """Private deep copy for read-modify-write callers."""
+        return copy.deepcopy(self.snapshot())
 
-@app.get("/api/folders")
-def list_folders(request: Request) -> Dict[str, Any]:
-    ensure_admin(request)
-    return load_folders()
+    def save(self, data: Any) -> None:
+        t0 = time.perf_counter()
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+        fresh = json.loads(text)
+        if self._normalize is not None:
+            fresh = self._normalize(fresh)
+        with self._lock:
+            _atomic_write_text(self.path, text, durable=True)
+            self._replace_locked(fresh, self._stat())
+        metric_store_write_seconds.observe(time.perf_counter() - t0, self.name)
 
-@app.post("/api/folders")
-async def create_folder(request: Request) -> Dict[str, Any]:
-    ensure_admin(request)
-    data = await request.json()
-    name = str(data.get("name", "")).strip()
-    if not name:
-        raise HTTPException(status_code=400, detail="name required")
-    folders_data = load_folders()
-    folders = folders_data.get("folders", [])
-    # unique slug
-    slug = slugify(name)
-    used = {f["slug"] for f in folders}
-    base_slug = slug
-    i = 2
-    while slug in used:
-        slug = f"{base_slug}-{i}"
-        i += 1
-    folder_id = uuid.uuid4().hex
-    folder = {"id": folder_id, "name": name, "slug": slug, "created_at": now_iso()}
-    folders.append(folder)
-    folders_data["folders"] = folders
-    save_folders(folders_data)
-    _folder_path(folder).mkdir(parents=True, exist_ok=True)
-    # init index
-    _save_image_list_for(folder_id, [])
-    await hub.broadcast({"type": "refresh", "reason": "folders"})
-    return {"ok": True, "folder": folder}
 
-@app.delete("/api/folders/{folder_id}")
-async def delete_folder(folder_id: str, request: Request) -> Dict[str, Any]:
-    ensure_admin(request)
-    folders_data = load_folders()
-    folders = folders_data.get("folders", [])
-    folder = None
-    for f in folders:
-        if f["id"] == folder_id:
-            folder = f
-            break
-    if folder is None:
-        raise HTTPException(status_code=404, detail="Folder not found")
-    # delete media directory
-    try:
-        # ⚡ Bolt: Offload blocking I/O (directory deletion) to thread to prevent blocking the async event loop
-        await asyncio.to_thread(shutil.rmtree, _folder_path(folder), ignore_errors=True)
-    except Exception:
-        pass
-    # remove from folders
-    folders = [f for f in folders if f["id"] != folder_id]
-    folders_data["folders"] = folders
-    save_folders(folders_data)
-    # remove index
-    idx = load_index()
-    idx.get("images", {}).pop(folder_id, None)
-    save_index(idx)
-    await hub.broadcast({"type": "refresh", "reason": "folders"})
-    return {"ok": True}
+class SqliteDatabase:
+    """SQLite (WAL) file holding folders and the image index.
 
-@app.get("/api/folders/{folder_id}/images")
-def list_images(folder_id: str, request: Request) -> Dict[str, Any]:
-    ensure_admin(request)
-    _find_folder(folder_id)
-    return {"images": _image_list_for(folder_id)}
+    One connection shared by both documents and guarded by ``lock``. On first
+    open an existing folders.json/index.json is imported once and renamed to
+    ``*.migrated``; ``export_json`` writes them back for switching to the JSON
+    backend or for backups.
+    """
 
-@app.post("/api/folders/{folder_id}/images")
-async def upload_images(folder_id: str, request: Request, files: List[UploadFile] = File(...)) -> Dict[str, Any]:
-    ensure_admin(request)
-    folder = _find_folder(folder_id)
-    if len(files) > MAX_UPLOAD_FILES:
-        raise HTTPException(status_code=400, detail=f"too many files (max {MAX_UPLOAD_FILES})")
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS folders (
+            id TEXT PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS images (
+            folder_id TEXT NOT NULL, id TEXT NOT NULL, position INTEGER NOT NULL, data TEXT NOT NULL,
+            PRIMARY KEY (folder_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS images_by_folder ON images (folder_id, position);
+        CREATE INDEX IF NOT EXISTS images_by_id ON images (id);
+    """
 
-    folder_dir = _folder_path(folder)
-    folder_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
 
-    images = _image_list_for(folder_id)
-    added: List[Dict[str, Any]] = []
+    def conn(self) -> sqlite3.Connection:
+        with self.lock:
+            if self._conn is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=FULL")
+                conn.executescript(self.SCHEMA)
+                self._conn = conn
+                self._migrate_json()
+            return self._conn
 
-    for up in files:
-        orig_name = safe_filename(up.filename or "upload")
-        ext = os.path.splitext(orig_name)[1].lower()
+    def data_version(self) -> int:
+        """Changes whenever another connection (another worker, the sqlite3 shell) commits."""
+        with self.lock:
+            return self.conn().execute("PRAGMA data_version").fetchone()[0]
 
-        tmp_path = DATA_DIR / "tmp_upload"
-        tmp_path.mkdir(parents=True, exist_ok=True)
-        tmp_file = tmp_path / f"{uuid.uuid4().hex}_{orig_name}"
+    def _migrate_json(self) -> None:
+        conn = self._conn
+        assert conn is not None
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+            return
+        folders = _load_json(FOLDERS_PATH, default_folders()).get("folders", [])
+        images = _load_json(INDEX_PATH, default_index()).get("images", {})
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO folders (id, position, data) VALUES (?, ?, ?)",
+                [(f["id"], i, json.dumps(f, ensure_ascii=False)) for i, f in enumerate(folders)],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO images (folder_id, id, position, data) VALUES (?, ?, ?, ?)",
+                [
+                    (fid, im["id"], i, json.dumps(im, ensure_ascii=False))
+                    for fid, ims in images.items() for i, im in enumerate(ims or [])
+                ],
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)", (now_iso(),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for path in (FOLDERS_PATH, INDEX_PATH):
+            if path.exists():
+                os.replace(path, path.with_name(path.name + ".migrated"))
 
-        # stream file to disk in 1MB chunks to prevent memory exhaustion DoS
-        limit_bytes = MAX_UPLOAD_MB_PER_FILE * 1024 * 1024
-        written = 0
-        too_large = False
+    def export_json(self, folders: Dict[str, Any], index: Dict[str, Any]) -> List[str]:
+        _atomic_write_json(FOLDERS_PATH, folders)
+        _atomic_write_json(INDEX_PATH, index)
+        return [str(FOLDERS_PATH), str(INDEX_PATH)]
 
-        with open(tmp_file, "wb") as out:
-            while chunk := await up.read(1024 * 1024):
-                written += len(chunk)
-                if written > limit_bytes:
-                    too_large = True
-                    break
-                out.write(chunk)
+class SqliteDocument:
+    """Folders or the image index stored in :class:`SqliteDatabase`.
 
-        if too_large:
-            tmp_file.unlink(missing_ok=True)
-            continue
+    Same interface as :class:`JsonDocument`. Reads are served from an
+    in-memory copy that is reloaded when ``PRAGMA data_version`` moves. A save
+    only writes what differs from the cached value: folder lists and entries
+    are compared by identity first, so an upload or delete touches the rows of
+    one folder (an append only its new rows) instead of rewriting the index.
+    """
 
-        img_id = uuid.uuid4().hex
+    def __init__(self, name: str, db: SqliteDatabase) -> None:
+        self.name = name
+        self.db = db
+        self.on_change: Optional[Callable[[str, Any, Any], None]] = None
+        self._data: Any = None
+        self._version: Optional[int] = None
+        self._loaded = False
+        # folder_id -> image id -> stored position, mirrors the images table
+        self._positions: Dict[str, Dict[str, int]] = {}
 
-        # Check for video
-        if ext in ALLOWED_VIDEO_EXTS:
-            filename = f"{img_id.lower()}{ext}"
-            dst = folder_dir / filename
-            # Move tmp file to dst directly
-            try:
-                # ⚡ Bolt: Offload blocking I/O (large file move) to thread to prevent blocking the async event loop
-                await asyncio.to_thread(shutil.move, str(tmp_file), str(dst))
-            except Exception:
-                # cleanup if move fails
-                try:
-                    tmp_file.unlink(missing_ok=True)
-                except Exception:
-                    pass
-                continue
+    def _replace_locked(self, data: Any) -> None:
+        old, was_loaded = self._data, self._loaded
+        self._data = data
+        self._version = self.db.data_version()
+        self._loaded = True
+        if was_loaded and self.on_change is not None and old != data:
+            self.on_change(self.name, old, data)
 
-            meta = {
-                "id": img_id,
-                "type": "video",
-                "filename": filename,
-                "thumb": None,
-                "original_name": orig_name,
-                "uploaded_at": now_iso(),
-                "width": 0,
-                "height": 0,
-            }
-            images.append(meta)
-            added.append(meta)
-            continue
+    def snapshot(self) -> Any:
+        """Shared cached value. Callers must treat it as read-only."""
+        if not self.db.lock.acquire(blocking=self._loaded is False):
+            # a save is in progress: keep serving the last committed value
+            return self._data
+        try:
+            if not self._loaded or self.db.data_version() != self._version:
+                t0 = time.perf_counter()
+                data = self._read(self.db.conn())
+                metric_store_reads.inc(self.name)
+                metric_store_read_seconds.observe(time.perf_counter() - t0, self.name)
+                self._replace_locked(data)
+            return self._data
+        finally:
+            self.db.lock.release()
 
-        # Handle Image
-        filename = f"{img_id.lower()}.webp"
-        dst = folder_dir / filename
-        thumb = folder_dir / f"{img_id.lower()}_thumb.webp"
+    def load(self) -> Any:
+        """Private deep copy for read-modify-write callers."""
+        return copy.deepcopy(self.snapshot())
 
-        try:
-            loop = asyncio.get_running_loop()
-            w, h = await loop.run_in_executor(None, _process_image, tmp_file, dst, thumb)
-        except Exception:
-            # not an image or corrupted
+    def save(self, data: Any) -> None:
+        t0 = time.perf_counter()
+        with self.db.lock:
+            old = self.snapshot()
+            conn = self.db.conn()
+            conn.execute("BEGIN IMMEDIATE")
             try:
-                tmp_file.unlink(missing_ok=True)
+                fresh = self._write(conn, old, data)
+                conn.execute("COMMIT")
             except Exception:
-                pass
-            continue
-        finally:
-            try:
-                tmp_file.unlink(missing_ok=True)
+                conn.execute("ROLLBACK")
+                self._loaded = False  # cached positions may be ahead of the table
+                raise
+            self._replace_locked(fresh)
+        metric_store_write_seconds.observe(time.perf_counter() - t0, self.name)
+
+    def _read(self, conn: sqlite3.Connection) -> Any:
+        if self.name == "folders":
+            rows = conn.execute("SELECT data FROM folders ORDER BY position")
+            return {"folders": [json.loads(d) for (d,) in rows]}
+        images: Dict[str, List[Dict[str, Any]]] = {}
+        self._positions = {}
+        rows = conn.execute("SELECT folder_id, id, position, data FROM images ORDER BY folder_id, position")
+        for fid, iid, pos, d in rows:
+            images.setdefault(fid, []).append(json.loads(d))
+            self._positions.setdefault(fid, {})[iid] = pos
+        return {"images": images}
+
+    def _write(self, conn: sqlite3.Connection, old: Any, new: Any) -> Any:
+        if self.name == "folders":
+            # a handful of rows: rewrite them all
+            folders = json.loads(json.dumps(new.get("folders", []), ensure_ascii=False))
+            conn.execute("DELETE FROM folders")
+            conn.executemany(
+                "INSERT INTO folders (id, position, data) VALUES (?, ?, ?)",
+                [(f["id"], i, json.dumps(f, ensure_ascii=False)) for i, f in enumerate(folders)],
+            )
+            return {"folders": folders}
+
+        old_images = (old or {}).get("images", {}) or {}
+        new_images = new.get("images", {}) or {}
+        out: Dict[str, List[Dict[str, Any]]] = {}
+        for fid in set(old_images) | set(new_images):
+            before, after = old_images.get(fid), new_images.get(fid)
+            if after is None:
+                conn.execute("DELETE FROM images WHERE folder_id = ?", (fid,))
+                self._positions.pop(fid, None)
+            elif after is before:
+                out[fid] = before
+            else:
+                out[fid] = self._write_folder(conn, fid, before or [], after)
+        return {"images": out}
+
+    def _write_folder(
+        self, conn: sqlite3.Connection, fid: str, before: List[Dict[str, Any]], after: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        positions = self._positions.setdefault(fid, {})
+        n = len(before)
+        if len(after) >= n and all(a is b for a, b in zip(after, before)):
+            # append only (uploads): insert the tail after the last stored position
+            start = max(positions.values(), default=-1) + 1
+            tail = json.loads(json.dumps(after[n:], ensure_ascii=False))
+            conn.executemany(
+                "INSERT OR REPLACE INTO images (folder_id, id, position, data) VALUES (?, ?, ?, ?)",
+                [(fid, im["id"], start + i, json.dumps(im, ensure_ascii=False)) for i, im in enumerate(tail)],
+            )
+            positions.update((im["id"], start + i) for i, im in enumerate(tail))
+            return before + tail
+
+        old_by_id = {im["id"]: im for im in before}
+        # keep stored positions while the surviving entries are still in order; new ones go after them
+        kept = [positions[im["id"]] for im in after if im["id"] in positions]
+        renumber = any(x >= y for x, y in zip(kept, kept[1:]))
+        next_pos = max(positions.values(), default=-1) + 1
+        result: List[Dict[str, Any]] = []
+        rows = []
+        new_positions: Dict[str, int] = {}
+        for i, im in enumerate(after):
+            iid = im["id"]
+            if renumber:
+                pos = i
+            elif iid in positions:
+                pos = positions[iid]
+            else:
+                pos, next_pos = next_pos, next_pos + 1
+            new_positions[iid] = pos
+            prev = old_by_id.get(iid)
+            if prev is not None and (prev is im or prev == im):
+                result.append(prev)
+                if positions.get(iid) == pos:
+                    continue  # row is up to date
+            else:
+                im = json.loads(json.dumps(im, ensure_ascii=False))
+                result.append(im)
+            rows.append((fid, iid, pos, json.dumps(im, ensure_ascii=False)))
+        gone = set(positions) - set(new_positions)
+        conn.executemany("DELETE FROM images WHERE folder_id = ? AND id = ?", [(fid, i) for i in gone])
+        conn.executemany(
+            "INSERT OR REPLACE INTO images (folder_id, id, position, data) VALUES (?, ?, ?, ?)", rows
+        )
+        self._positions[fid] = new_positions
+        return result
+
+@dataclass
+class StateChange:
+    version: int
+    section: str  # config | folders | images
+    folder_ids: Tuple[str, ...] = ()
+
+
+class StateStore:
+    """Process-wide cache of config.json, folders.json and index.json.
+
+    Every change to one of the documents (our own saves as well as external
+    edits) bumps ``version``. The version starts at the boot time in
+    milliseconds so it keeps increasing across restarts, and a short change
+    log allows answering "what changed since version N".
+
+    With several workers (``shared`` set) versions come from the
+    :class:`SharedLog` instead: detected changes stay pending until
+    ``sync_shared`` matches them with the records other workers appended, and
+    only changes nobody recorded (our own commits, edits by hand) get new ones.
+    """
+
+    CHANGELOG_SIZE = 256
+
+    def __init__(self) -> None:
+        self.config = JsonDocument("config", CONFIG_PATH, default_config, _merge_config_defaults)
+        self.db: Optional[SqliteDatabase] = None
+        self.folders: Any
+        self.index: Any
+        if STORE_BACKEND == "sqlite":
+            self.db = SqliteDatabase(DB_PATH)
+            self.folders = SqliteDocument("folders", self.db)
+            self.index = SqliteDocument("images", self.db)
+        else:
+            self.folders = JsonDocument("folders", FOLDERS_PATH, default_folders)
+            self.index = JsonDocument("images", INDEX_PATH, default_index)
+        self.version = time.time_ns() // 1_000_000
+        # oldest version the change log can still answer `since` queries for
+        self._floor = self.version
+        self._changes: deque = deque()
+        self._version_lock = threading.Lock()
+        self.shared: Optional[SharedLog] = broadcast.shared
+        # (section, folder_ids) seen locally but not yet in the shared log
+        self._pending: List[Tuple[str, Tuple[str, ...]]] = []
+        for doc in self.documents():
+            doc.on_change = self._on_change
+
+    def _on_change(self, section: str, old: Any, new: Any) -> None:
+        folder_ids: Tuple[str, ...] = ()
+        if section == "images":
+            old_images = (old or {}).get("images", {}) or {}
+            new_images = (new or {}).get("images", {}) or {}
+            folder_ids = tuple(
+                fid for fid in set(old_images) | set(new_images)
+                if old_images.get(fid) != new_images.get(fid)
+            )
+        with self._version_lock:
+            if self.shared is not None:
+                self._pending.append((section, folder_ids))
+                return
+            self.version += 1
+            self._log_locked(StateChange(self.version, section, folder_ids))
+
+    def _log_locked(self, change: StateChange) -> None:
+        self._changes.append(change)
+        while len(self._changes) > self.CHANGELOG_SIZE:
+            self._floor = self._changes.popleft().version
+
+    def changes_since(self, since: int) -> Optional[List[StateChange]]:
+        """Changes newer than ``since``, or None if the log no longer reaches back that far."""
+        with self._version_lock:
+            if since < self._floor or since > self.version:
+                return None
+            changes = [c for c in self._changes if c.version > since]
+            # a worker (re)started in between: it may have loaded edits made while it was down
+            return None if any(c.section == "boot" for c in changes) else changes
+
+    def _adopt_locked(self, records: List[Dict[str, Any]]) -> None:
+        sections: Set[str] = set()
+        for r in records:
+            v = r.get("v", 0)
+            if v <= self.version:
+                continue
+            self.version = v
+            self._log_locked(StateChange(v, r.get("s", ""), tuple(r.get("f") or ())))
+            sections.add(r.get("s", ""))
+        if "boot" in sections:
+            self._pending = []
+        elif sections:
+            self._pending = [p for p in self._pending if p[0] not in sections]
+
+    def _record_pending_locked(self) -> None:
+        assert self.shared is not None
+        records = []
+        v = self.version
+        for section, folder_ids in self._pending:
+            # boot records keep versions at or above the wall clock, like a single process does
+            v = max(v + 1, time.time_ns() // 1_000_000) if section == "boot" else v + 1
+            records.append({"v": v, "s": section, "f": list(folder_ids), "pid": os.getpid()})
+        self.shared.append(records)
+        self._adopt_locked(records)
+
+    def sync_shared(self, blocking: bool = True, boot: bool = False) -> bool:
+        """Catch up with the other workers; True if ``version`` moved.
+
+        Reloads changed documents and adopts new log records under the shared
+        lock. Changes no record accounts for are recorded under the exclusive
+        lock (right away when the caller already holds it, e.g. a commit).
+        """
+        shared = self.shared
+        assert shared is not None
+        before = self.version
+        exclusive = boot
+        while True:
+            with shared.locked(exclusive=exclusive, blocking=blocking) as held:
+                if not held:
+                    break
+                for doc in self.documents():
+                    doc.snapshot()
+                with self._version_lock:
+                    self._adopt_locked(shared.read_new())
+                    if boot:
+                        self._pending.append(("boot", ()))
+                        boot = False
+                    if not self._pending:
+                        break
+                    if shared.exclusive:
+                        self._record_pending_locked()
+                        break
+            exclusive = True
+        return self.version != before
+
+    def documents(self) -> List[Any]:
+        return [self.config, self.folders, self.index]
+
+    def export_json(self) -> List[str]:
+        """Write folders.json/index.json from the current state (SQLite backend only)."""
+        if self.db is None:
+            return []
+        return self.db.export_json(self.folders.snapshot(), self.index.snapshot())
+
+    def sync(self) -> None:
+        """Re-stat every document; reloads (and version bumps) happen for external edits."""
+        for doc in self.documents():
+            doc.snapshot()
+        if self.shared is not None and (self._pending or self.shared.changed()):
+            # never wait for another worker's commit on the request path
+            self.sync_shared(blocking=False)
+
+store = StateStore()
+
+def load_config() -> Dict[str, Any]:
+    return store.config.load()
+
+def save_config(cfg: Dict[str, Any]) -> None:
+    store.config.save(cfg)
+
+def load_folders() -> Dict[str, Any]:
+    return store.folders.load()
+
+def save_folders(data: Dict[str, Any]) -> None:
+    store.folders.save(data)
+
+def load_index() -> Dict[str, Any]:
+    return store.index.load()
+
+def save_index(data: Dict[str, Any]) -> None:
+    store.index.save(data)
+
+class Mutations:
+    """Serialized, group-committed writes to the state documents.
+
+    A change is a function ``fn(current) -> new`` (None: nothing to change)
+    that must not modify ``current``. Changes are queued per document; one
+    writer task per document applies everything queued so far in order and
+    persists the result with a single durable save in a worker thread, so
+    concurrent handlers never lose each other's updates and the event loop
+    never waits on disk. ``update`` returns once the change is on disk.
+
+    ``folder(folder_id)`` is an asyncio lock for sequences that must not
+    interleave with other work on the same folder (index change + files).
+    Locks are only referenced weakly, so a lock disappears once no task holds
+    or waits for it, and deleted or unknown folders leave nothing behind.
+
+    With several workers the whole read-modify-write runs in a thread under
+    the exclusive :class:`SharedLog` lock, starting from the latest committed
+    document, so workers do not overwrite each other's changes either.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[str, List[Tuple[Callable[[Any], Any], asyncio.Future]]] = {}
+        self._writers: Dict[str, asyncio.Task] = {}
+        self._folder_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.commits = 0
+        self.mutations = 0
+
+    def folder(self, folder_id: str) -> asyncio.Lock:
+        lock = self._folder_locks.get(folder_id)
+        if lock is None:
+            # the caller's ``async with`` keeps it alive while it is held or awaited
+            lock = self._folder_locks[folder_id] = asyncio.Lock()
+        return lock
+
+    async def update(self, doc: Any, fn: Callable[[Any], Any]) -> Any:
+        """Queue ``fn`` for ``doc``; returns the committed document value."""
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(doc.name, []).append((fn, fut))
+        writer = self._writers.get(doc.name)
+        if writer is None or writer.done():
+            self._writers[doc.name] = asyncio.create_task(self._drain(doc))
+        return await fut
+
+    @staticmethod
+    def _apply(value: Any, batch: List[Any]) -> Tuple[Any, bool, List[Any]]:
+        """Run the queued functions; returns (value, changed, [(future, exception or None)])."""
+        changed = False
+        outcomes: List[Any] = []
+        for fn, fut in batch:
+            try:
+                new = fn(value)
+            except Exception as e:
+                outcomes.append((fut, e))
+                continue
+            if new is not None:
+                value, changed = new, True
+            outcomes.append((fut, None))
+        return value, changed, outcomes
+
+    def _commit_shared(self, doc: Any, batch: List[Any]) -> Tuple[Any, ...]:
+        shared = store.shared
+        assert shared is not None
+        with shared.locked(exclusive=True):
+            store.sync_shared()  # start from what the other workers committed
+            value, changed, outcomes = self._apply(doc.snapshot(), batch)
+            try:
+                if changed:
+                    doc.save(value)
+                    store.sync_shared()  # records our change
+                    value = doc.snapshot()
+            except Exception as e:
+                return value, changed, outcomes, e
+        return value, changed, outcomes, None
+
+    async def _drain(self, doc: Any) -> None:
+        while self._pending.get(doc.name):
+            batch = self._pending.pop(doc.name)
+            error: Optional[BaseException] = None
+            if store.shared is None:
+                value, changed, outcomes = self._apply(doc.snapshot(), batch)
+                try:
+                    if changed:
+                        await asyncio.to_thread(doc.save, value)
+                        value = doc.snapshot()
+                except Exception as e:
+                    error = e
+            else:
+                try:
+                    value, changed, outcomes, error = await asyncio.to_thread(self._commit_shared, doc, batch)
+                except Exception as e:  # lock or reload failed: nothing was applied
+                    changed, outcomes, error = False, [(fut, None) for _, fut in batch], e
+            applied: List[asyncio.Future] = []
+            for fut, exc in outcomes:
+                if exc is None:
+                    applied.append(fut)
+                elif not fut.done():
+                    fut.set_exception(exc)
+            if error is not None:
+                for fut in applied:
+                    if not fut.done():
+                        fut.set_exception(error)
+                continue
+            if changed:
+                self.commits += 1
+            self.mutations += len(applied)
+            for fut in applied:
+                if not fut.done():
+                    fut.set_result(value)
+
+mutations = Mutations()
+
+# ---- WebSocket broadcast ----
+
+class Subscriber:
+    __slots__ = ("ws", "queue", "peer", "connected_at", "last_seen", "sent", "dropped", "closed")
+
+    def __init__(self, ws: WebSocket, maxsize: int) -> None:
+        self.ws = ws
+        # holds already-encoded message text; None tells the writer to stop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        client = ws.client
+        self.peer = f"{client.host}:{client.port}" if client else "?"
+        self.connected_at = time.time()
+        self.last_seen = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, text: str) -> None:
+        """Queue a reply for this client only, skipping it if the queue is full."""
+        if not self.closed and not self.queue.full():
+            self.queue.put_nowait(text)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Hub:
+    """Fan-out of broadcast messages to every connected WebSocket.
+
+    Messages are JSON-encoded once per broadcast, not once per client. Publishing
+    walks an immutable snapshot of the subscribers, so it needs no lock and never
+    awaits; connect/disconnect simply swap the snapshot.
+
+    A single heartbeat task pings every client each ``WS_HEARTBEAT_SEC`` and
+    closes those that have not sent anything for ``WS_IDLE_TIMEOUT_SEC``.
+    ``publish_all`` also hands the message to the broadcast ``backend`` for the
+    clients of other workers.
+    """
+
+    QUEUE_SIZE = 20
+
+    def __init__(self, backend: Any = None) -> None:
+        self.backend = backend if backend is not None else LocalBroadcast()
+        self._subs: Dict[WebSocket, Subscriber] = {}
+        self._snapshot: Tuple[Subscriber, ...] = ()
+        self._task: Optional[asyncio.Task] = None
+        self.messages = 0
+        self.dropped_total = 0
+        self.connects_total = 0
+        self.disconnects_total = 0
+        self.reaped_idle_total = 0
+        self.peak_connected = 0
+
+    def _rebuild(self) -> None:
+        self._snapshot = tuple(self._subs.values())
+
+    async def connect(self, ws: WebSocket) -> Subscriber:
+        await ws.accept()
+        sub = Subscriber(ws, self.QUEUE_SIZE)
+        self._subs[ws] = sub
+        self._rebuild()
+        self.connects_total += 1
+        self.peak_connected = max(self.peak_connected, len(self._snapshot))
+        return sub
+
+    async def disconnect(self, ws: WebSocket) -> None:
+        sub = self._subs.pop(ws, None)
+        if sub is not None:
+            sub.close()
+            self._rebuild()
+            self.disconnects_total += 1
+
+    def publish(self, msg: Dict[str, Any]) -> int:
+        """Queue ``msg`` for every subscriber; returns the number of subscribers reached."""
+        return self.publish_text(json.dumps(msg, ensure_ascii=False, separators=(",", ":")))
+
+    def publish_text(self, text: str) -> int:
+        subs = self._snapshot
+        self.messages += 1
+        for sub in subs:
+            if sub.closed:
+                continue
+            q = sub.queue
+            if q.full():
+                # keep the freshest updates, but account for what the client missed
+                try:
+                    q.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+                sub.dropped += 1
+                self.dropped_total += 1
+            q.put_nowait(text)
+        return len(subs)
+
+    def publish_all(self, msg: Dict[str, Any]) -> int:
+        """Like ``publish``, for the subscribers of every worker."""
+        text = json.dumps(msg, ensure_ascii=False, separators=(",", ":"))
+        self.backend.send({"type": "message", "text": text})
+        return self.publish_text(text)
+
+    async def broadcast(self, msg: Dict[str, Any]) -> None:
+        self.publish(msg)
+
+    def heartbeat(self) -> None:
+        now = time.monotonic()
+        for sub in self._snapshot:
+            if not sub.closed and now - sub.last_seen > WS_IDLE_TIMEOUT_SEC:
+                self.reaped_idle_total += 1
+                sub.close()
+        self.publish({"type": "ping"})
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SEC)
+            self.heartbeat()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for sub in self._snapshot:
+            sub.close()
+
+    def stats(self) -> Dict[str, Any]:
+        subs = self._snapshot
+        now = time.monotonic()
+        return {
+            "connected": len(subs),
+            "broadcast": self.backend.stats(),
+            "peak_connected": self.peak_connected,
+            "connects_total": self.connects_total,
+            "disconnects_total": self.disconnects_total,
+            "reaped_idle_total": self.reaped_idle_total,
+            "messages": self.messages,
+            "dropped_total": self.dropped_total,
+            "clients": [
+                {
+                    "peer": sub.peer,
+                    "connected_at": sub.connected_at,
+                    "idle_sec": round(now - sub.last_seen, 1),
+                    "queued": sub.queue.qsize(),
+                    "sent": sub.sent,
+                    "dropped": sub.dropped,
+                }
+                for sub in subs
+            ],
+        }
+
+hub = Hub(broadcast)
+
+# larger deltas are replaced by a plain "refresh" and kiosks refetch /api/state
+WS_DELTA_MAX_BYTES = 256 * 1024
+
+
+@dataclass
+class StateCapture:
+    version: int
+    config: Dict[str, Any]
+    folders: List[Dict[str, Any]]
+    images: Dict[str, List[Dict[str, Any]]]
+
+
+def _capture_state() -> StateCapture:
+    # snapshots are replaced, never mutated, so holding on to them is free
+    return StateCapture(
+        version=store.version,
+        config=store.config.snapshot(),
+        folders=store.folders.snapshot().get("folders", []),
+        images=store.index.snapshot().get("images", {}),
+    )
+
+
+def _state_diff(base: StateCapture, cur: StateCapture) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    if cur.config is not base.config and cur.config != base.config:
+        out["config"] = cur.config
+    if cur.folders is not base.folders and cur.folders != base.folders:
+        out["folders"] = cur.folders
+    if cur.images is not base.images:
+        # kiosks page the carousel from /api/playlist; they only need to know which folders changed
+        changed = [fid for fid in set(base.images) | set(cur.images) if base.images.get(fid) != cur.images.get(fid)]
+        if changed:
+            out["image_folders"] = sorted(changed)
+    return out
+
+
+class RefreshCoalescer:
+    """Merges bursts of mutation notifications into one broadcast.
+
+    Each ``request`` re-arms a quiet-window timer (``autorefresh.debounce_ms``);
+    the event goes out once no new request arrived for that long, or at the
+    latest ``autorefresh.max_delay_ms`` after the first one.
+
+    The event is a ``delta`` from the state version of the previous event to
+    the current one: changed config/folders and the ids of the folders whose
+    images changed (``image_folders``). Kiosks holding exactly the ``from``
+    version apply it in place and reload their playlist window; everybody
+    else refetches. Oversized deltas fall back to
+    a ``refresh`` carrying a ``jitter_ms`` hint so kiosks spread their refetch.
+    Reasons requested with ``relay`` are passed on to the other workers, which
+    then push their own delta to their kiosks (see :class:`PeerSync`).
+    """
+
+    def __init__(self, hub: Hub) -> None:
+        self.hub = hub
+        self._reasons: List[str] = []
+        self._relay: List[str] = []
+        self._first_at = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._base: Optional[StateCapture] = None
+
+    def _settings(self) -> Tuple[float, float, int]:
+        ar = store.config.snapshot().get("autorefresh", {})
+        try:
+            quiet = max(0.0, float(ar.get("debounce_ms", 300)) / 1000.0)
+            max_delay = max(quiet, float(ar.get("max_delay_ms", 2000)) / 1000.0)
+            jitter = max(0, int(ar.get("jitter_ms", 0)))
+        except (TypeError, ValueError):
+            quiet, max_delay, jitter = 0.3, 2.0, 0
+        return quiet, max_delay, jitter
+
+    def request(self, reason: str, relay: bool = True) -> None:
+        loop = asyncio.get_running_loop()
+        quiet, max_delay, _ = self._settings()
+        now = loop.time()
+        if not self._reasons:
+            self._first_at = now
+        if reason not in self._reasons:
+            self._reasons.append(reason)
+        if relay and reason not in self._relay:
+            self._relay.append(reason)
+        if self._handle is not None:
+            self._handle.cancel()
+        delay = min(quiet, max(0.0, self._first_at + max_delay - now))
+        self._handle = loop.call_later(delay, self.flush)
+
+    def reset(self) -> None:
+        """Take the current state as the baseline for the next delta."""
+        self._base = _capture_state()
+
+    def flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self._reasons:
+            return
+        reasons, self._reasons = self._reasons, []
+        if self._relay:
+            self.hub.backend.send({"type": "state", "reasons": self._relay})
+            self._relay = []
+        base, cur = self._base, _capture_state()
+        self._base = cur
+        if base is not None:
+            msg: Dict[str, Any] = {"type": "delta", "from": base.version, "version": cur.version, "reasons": reasons}
+            msg.update(_state_diff(base, cur))
+            text = json.dumps(msg, ensure_ascii=False, separators=(",", ":"))
+            if len(text) <= WS_DELTA_MAX_BYTES:
+                self.hub.publish_text(text)
+                return
+        _, _, jitter = self._settings()
+        self.hub.publish({
+            "type": "refresh",
+            "reason": reasons[0] if len(reasons) == 1 else "multiple",
+            "reasons": reasons,
+            "version": cur.version,
+            "jitter_ms": jitter,
+        })
+
+refresher = RefreshCoalescer(hub)
+
+class PeerSync:
+    """Applies what other workers committed to this worker.
+
+    On a "state" message (or the backend's periodic "sync") the store catches
+    up with the shared log in a thread; then the refresher pushes the change to
+    this worker's kiosks right away, the sender already waited out the debounce.
+    """
+
+    def __init__(self) -> None:
+        self._reasons: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def request(self, reasons: List[str]) -> None:
+        self._reasons.extend(r for r in reasons if r not in self._reasons)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            reasons, self._reasons = self._reasons, []
+            try:
+                changed = await asyncio.to_thread(store.sync_shared)
+            except Exception:
+                changed = False
+            if reasons or changed:
+                for reason in reasons or ["external"]:
+                    refresher.request(reason, relay=False)
+                refresher.flush()
+            if not self._reasons:
+                return
+
+peer_sync = PeerSync()
+
+def _on_broadcast(msg: Dict[str, Any]) -> None:
+    """Message from another worker (or the backend's own poll), on the event loop."""
+    if msg.get("type") == "message":
+        hub.publish_text(str(msg.get("text", "")))
+    elif store.shared is not None:
+        peer_sync.request([str(r) for r in msg.get("reasons") or []])
+
+# ---- Weather cache ----
+
+WeatherKey = Tuple[float, float, str]
+
+
+@dataclass
+class WeatherEntry:
+    ts: float = 0.0
+    payload: Optional[Dict[str, Any]] = None
+    ok: bool = False  # False while payload is only an error placeholder
+
+
+def _weather_key(cfg: Dict[str, Any]) -> WeatherKey:
+    wcfg = cfg.get("info_boxes", {}).get("weather", {})
+    lat = float(wcfg.get("lat", DEFAULT_LAT))
+    lon = float(wcfg.get("lon", DEFAULT_LON))
+    units = wcfg.get("units", "metric")
+    return (round(lat, 4), round(lon, 4), units)
+
+async def fetch_weather(
+    lat: float,
+    lon: float,
+    units: str = "metric",
+    client: Optional[httpx.AsyncClient] = None,
+    base_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    # Open-Meteo: no key required
+    # docs: https://open-meteo.com/
+    temp_unit = "celsius" if units == "metric" else "fahrenheit"
+    wind_unit = "kmh" if units == "metric" else "mph"
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "current": "temperature_2m,apparent_temperature,is_day,weather_code,wind_speed_10m",
+        "daily": "temperature_2m_max,temperature_2m_min,weather_code",
+        "timezone": "auto",
+        "temperature_unit": temp_unit,
+        "wind_speed_unit": wind_unit,
+    }
+    url = base_url or WEATHER_BASE_URL
+    if client is None:
+        import httpx
+
+        async with httpx.AsyncClient(timeout=8.0) as own_client:
+            r = await own_client.get(url, params=params)
+    else:
+        r = await client.get(url, params=params)
+    r.raise_for_status()
+    data = r.json()
+
+    # minimal normalization for frontend
+    current = data.get("current", {})
+    daily = data.get("daily", {})
+    out = {
+        "fetched_at": now_iso(),
+        "current": {
+            "temp": current.get("temperature_2m"),
+            "feels": current.get("apparent_temperature"),
+            "wind": current.get("wind_speed_10m"),
+            "code": current.get("weather_code"),
+            "is_day": current.get("is_day"),
+        },
+        "daily": []
+    }
+    times = daily.get("time", []) or []
+    tmax = daily.get("temperature_2m_max", []) or []
+    tmin = daily.get("temperature_2m_min", []) or []
+    codes = daily.get("weather_code", []) or []
+    for i in range(min(3, len(times))):
+        out["daily"].append({
+            "date": times[i],
+            "tmax": tmax[i] if i < len(tmax) else None,
+            "tmin": tmin[i] if i < len(tmin) else None,
+            "code": codes[i] if i < len(codes) else None,
+        })
+    return out
+
+class WeatherService:
+    """Weather cache keyed on (lat, lon, units).
+
+    Entries are refreshed ahead of expiry by a background task using one pooled
+    HTTP client. Requests never wait for a refresh when any data is cached
+    (stale-while-revalidate); concurrent misses for the same key share one fetch.
+    Upstream failures back off exponentially instead of being retried per request.
+    """
+
+    MAX_ENTRIES = 8
+
+    def __init__(self, base_url: str = WEATHER_BASE_URL) -> None:
+        self.base_url = base_url
+        self.version = 0  # bumped whenever any cached payload is replaced
+        self._entries: Dict[WeatherKey, WeatherEntry] = {}
+        self._inflight: Dict[WeatherKey, asyncio.Task] = {}
+        self._failures: Dict[WeatherKey, int] = {}
+        self._retry_at: Dict[WeatherKey, float] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=8.0,
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=2),
+            )
+        return self._client
+
+    def _is_fresh(self, entry: WeatherEntry, now: float, margin: float = 0.0) -> bool:
+        return entry.ok and (now - entry.ts) < (WEATHER_TTL_SEC - margin)
+
+    def _refresh(self, key: WeatherKey) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        return task
+
+    async def _fetch(self, key: WeatherKey) -> Dict[str, Any]:
+        lat, lon, units = key
+        entry = self._entries.get(key)
+        t0 = time.perf_counter()
+        try:
+            payload = await fetch_weather(lat, lon, units, client=self._get_client(), base_url=self.base_url)
+        except Exception as e:
+            metric_weather_fetch_seconds.observe(time.perf_counter() - t0, "error")
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            self._retry_at[key] = time.time() + min(WEATHER_BACKOFF_MAX_SEC, 30.0 * 2 ** (failures - 1))
+            # keep last payload; surface error info only if we have nothing else
+            if entry is None or entry.payload is None:
+                entry = WeatherEntry(
+                    ts=time.time(),
+                    payload={"error": str(e), "fetched_at": now_iso(), "current": None, "daily": []},
+                )
+                self._store(key, entry)
+            return entry.payload
+        metric_weather_fetch_seconds.observe(time.perf_counter() - t0, "ok")
+        self._failures.pop(key, None)
+        self._retry_at.pop(key, None)
+        self._store(key, WeatherEntry(ts=time.time(), payload=payload, ok=True))
+        return payload
+
+    def _store(self, key: WeatherKey, entry: WeatherEntry) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.pop(next(iter(self._entries)))
+        self.version += 1
+        cfg = store.config.snapshot()
+        if cfg.get("info_boxes", {}).get("weather_enabled", True) and _weather_key(cfg) == key:
+            hub.publish({"type": "weather", "weather": entry.payload})
+
+    def _backing_off(self, key: WeatherKey, now: float) -> bool:
+        return now < self._retry_at.get(key, 0.0)
+
+    async def get(self, cfg: Dict[str, Any]) -> Dict[str, Any]:
+        key = _weather_key(cfg)
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry.payload is not None:
+            if self._is_fresh(entry, now):
+                metric_weather_lookups.inc("hit")
+            else:
+                metric_weather_lookups.inc("stale")
+                if not self._backing_off(key, now):
+                    self._refresh(key)
+            return entry.payload
+        metric_weather_lookups.inc("miss")
+        return await asyncio.shield(self._refresh(key))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                cfg = store.config.snapshot()
+                if cfg.get("info_boxes", {}).get("weather_enabled", True):
+                    key = _weather_key(cfg)
+                    now = time.time()
+                    entry = self._entries.get(key)
+                    stale = entry is None or not self._is_fresh(entry, now, margin=WEATHER_REFRESH_AHEAD_SEC)
+                    if stale and not self._backing_off(key, now):
+                        await self._refresh(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+            await asyncio.sleep(WEATHER_POLL_SEC)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+weather_service = WeatherService()
+
+async def get_weather_cached(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    return await weather_service.get(cfg)
+
+# ---- Serialized state cache ----
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    return body
+
+def _pick_encoding(request: Request) -> str:
+    accepted: Dict[str, float] = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return "identity"
+
+class StateBodyCache:
+    """Full /api/state response bodies, serialized once and reused until something changes.
+
+    The config/folders(/images) part is encoded once per state version and
+    variant (kiosks ask without the image index). Weather is spliced in after
+    it, so a weather refresh only concatenates bytes instead of re-encoding the
+    image index. Compressed variants are built lazily, at most once per (state
+    version, weather version), variant and encoding.
+    """
+
+    def __init__(self) -> None:
+        self._prefixes: Dict[bool, Tuple[int, bytes]] = {}
+        self._key: Optional[Tuple[int, int]] = None
+        self._tail = b""
+        self._bodies: Dict[Tuple[bool, str], bytes] = {}
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _build_prefix(version: int, images: bool) -> bytes:
+        head: Dict[str, Any] = {
+            "config": store.config.snapshot(),
+            "folders": store.folders.snapshot().get("folders", []),
+        }
+        if images:
+            head["images"] = store.index.snapshot().get("images", {})
+        head["version"] = version
+        text = json.dumps(head, ensure_ascii=False, separators=(",", ":"))
+        # drop the closing brace so weather and server_time can be appended
+        return text[:-1].encode("utf-8") + b',"weather":'
+
+    async def body(
+        self, version: int, weather_version: int, weather: Any, encoding: str, images: bool = True
+    ) -> bytes:
+        key = (version, weather_version)
+        bodies = self._bodies
+        if self._key != key or (images, encoding) not in bodies:
+            async with self._lock:
+                if self._key != key:
+                    tail = json.dumps(weather, ensure_ascii=False, separators=(",", ":"))
+                    tail += ',"server_time":' + json.dumps(now_iso()) + "}"
+                    self._tail = tail.encode("utf-8")
+                    self._bodies = {}
+                    self._key = key
+                bodies = self._bodies
+                if (images, "identity") not in bodies:
+                    prefix = self._prefixes.get(images)
+                    if prefix is None or prefix[0] != version:
+                        prefix = (version, await asyncio.to_thread(self._build_prefix, version, images))
+                        self._prefixes[images] = prefix
+                    bodies[(images, "identity")] = prefix[1] + self._tail
+                if (images, encoding) not in bodies:
+                    bodies[(images, encoding)] = await asyncio.to_thread(
+                        _compress, bodies[(images, "identity")], encoding
+                    )
+        return bodies[(images, encoding)]
+
+state_body_cache = StateBodyCache()
+
+# ---- Images ----
+
+def _ensure_data_dirs() -> None:
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+
+def _find_folder(folder_id: str) -> Dict[str, Any]:
+    folders = store.folders.snapshot().get("folders", [])
+    for f in folders:
+        if f.get("id") == folder_id:
+            return f
+    raise HTTPException(status_code=404, detail="Folder not found")
+
+def _folder_path(folder: Dict[str, Any]) -> Path:
+    return MEDIA_DIR / folder["slug"]
+
+def _image_list_for(folder_id: str) -> List[Dict[str, Any]]:
+    # shallow copy: callers append/filter the list but never edit entries in place
+    idx = store.index.snapshot()
+    return list(idx.get("images", {}).get(folder_id, []) or [])
+
+def _index_with(idx: Dict[str, Any], folder_id: str, images: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Shallow copy of the index with one folder's list replaced (None removes the folder)."""
+    out = dict(idx)
+    all_images = dict(idx.get("images", {}))
+    if images is None:
+        all_images.pop(folder_id, None)
+    else:
+        all_images[folder_id] = images
+    out["images"] = all_images
+    return out
+
+async def _update_image_list(
+    folder_id: str, fn: Callable[[List[Dict[str, Any]]], Optional[List[Dict[str, Any]]]]
+) -> None:
+    """Queue ``fn(images) -> new images`` (None: unchanged) for one folder's list."""
+
+    def apply(idx: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        new = fn(list(idx.get("images", {}).get(folder_id, []) or []))
+        return None if new is None else _index_with(idx, folder_id, new)
+
+    await mutations.update(store.index, apply)
+
+class ImagePool:
+    """Bounded executor for image decode/resize/encode.
+
+    ``IMAGE_POOL=process`` (default) uses a ``ProcessPoolExecutor`` so a batch
+    upload can use every core; ``IMAGE_POOL=thread`` uses a thread pool of the
+    same size, which is lighter on memory (Pillow releases the GIL while
+    coding and resampling). Workers are started and warmed shortly after the
+    app has started, so Pillow stays out of the cold start.
+    """
+
+    def __init__(self, kind: str, workers: int) -> None:
+        self.kind = kind if kind in ("process", "thread") else "process"
+        self.workers = max(1, workers)
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._warm: Optional[asyncio.TimerHandle] = None
+
+    def executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.kind == "thread":
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="image"
+                )
+            else:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+        return self._executor
+
+    def start(self, delay: float = 0.0) -> None:
+        if delay > 0:
+            # let the server start listening first; warming imports Pillow in every worker
+            self._warm = asyncio.get_running_loop().call_later(delay, self.start)
+            return
+        self._warm = None
+        ex = self.executor()
+        for _ in range(self.workers):
+            ex.submit(warm_worker)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor(), fn, *args)
+        except concurrent.futures.process.BrokenProcessPool:
+            # a worker died (e.g. OOM on a huge image); start a fresh pool for the next job
+            self._executor = None
+            raise
+
+    def shutdown(self) -> None:
+        if self._warm is not None:
+            self._warm.cancel()
+            self._warm = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+IMAGE_WARM_DELAY_SEC = 10.0
+image_pool = ImagePool(IMAGE_POOL_KIND, IMAGE_WORKERS)
+
+def _rendition_files(img_id: str, renditions: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Content-store role -> file name for the rendition files of an image (main file excluded)."""
+    out: Dict[str, str] = {}
+    for r in renditions:
+        for fmt in r.get("formats", []):
+            if fmt == "webp" and r.get("main"):
+                continue
+            out[f"{r['h']}p-{fmt}"] = f"{img_id.lower()}_{r['h']}p.{fmt}"
+    return out
+
+def _rendition_entries(img_id: str, renditions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Index form of the ladder: one entry per rung with a file name per format."""
+    out: List[Dict[str, Any]] = []
+    for r in renditions:
+        entry: Dict[str, Any] = {"h": r["h"], "width": r["width"], "height": r["height"]}
+        for fmt in r.get("formats", []):
+            if fmt == "webp" and r.get("main"):
+                entry[fmt] = f"{img_id.lower()}.webp"
+            else:
+                entry[fmt] = f"{img_id.lower()}_{r['h']}p.{fmt}"
+        out.append(entry)
+    return out
+
+def _unlink_entries(folder_dir: Path, entries: List[Dict[str, Any]]) -> None:
+    for im in entries:
+        for name in _entry_files(im):
+            try:
+                (folder_dir / name).unlink(missing_ok=True)
+            except OSError:
+                pass
+
+def _entry_files(im: Dict[str, Any]) -> Set[str]:
+    """Every media file name that belongs to an index entry."""
+    names = {im.get("filename"), im.get("thumb"), im.get("poster"), im.get("playback")}
+    for r in im.get("renditions") or []:
+        names.update(r.get(fmt) for fmt in ("webp", "avif"))
+    return {n for n in names if n}
+
+# ---- Videos ----
+
+def _probe_video(path: Path) -> Dict[str, Any]:
+    """Codec, display size, duration and bit rate of the first video stream."""
+    out = run_tool(
+        [FFPROBE_BIN, "-v", "error", "-select_streams", "v:0", "-show_streams", "-show_format", "-of", "json", path],
+        60,
+    )
+    data = json.loads(out or b"{}")
+    streams = data.get("streams") or []
+    if not streams:
+        raise RuntimeError("no video stream")
+    st = streams[0]
+    fmt = data.get("format") or {}
+    w, h = int(st.get("width") or 0), int(st.get("height") or 0)
+    rotation = (st.get("tags") or {}).get("rotate")
+    for side in st.get("side_data_list") or []:
+        rotation = side.get("rotation", rotation)
+    try:
+        if int(float(rotation or 0)) % 180:
+            w, h = h, w  # phones record portrait as rotated landscape
+    except ValueError:
+        pass
+    return {
+        "codec": st.get("codec_name") or "",
+        "width": w,
+        "height": h,
+        "duration": round(float(st.get("duration") or fmt.get("duration") or 0), 2),
+        "bit_rate": int(st.get("bit_rate") or fmt.get("bit_rate") or 0),
+    }
+
+def _video_needs_transcode(probe: Dict[str, Any]) -> bool:
+    return (
+        probe["codec"] not in PLAYABLE_VIDEO_CODECS
+        or max(probe["width"], probe["height"]) > VIDEO_MAX_EDGE
+        or probe["bit_rate"] > VIDEO_MAX_BITRATE
+    )
+
+def _transcode_video(src_path: Path, dst_path: Path, codec: str) -> None:
+    """Write a rendition capped at VIDEO_MAX_EDGE / VIDEO_MAX_BITRATE (first video + audio stream)."""
+    edge = VIDEO_MAX_EDGE
+    scale = (
+        f"scale=w='min(iw,{edge})':h='min(ih,{edge})'"
+        ":force_original_aspect_ratio=decrease:force_divisible_by=2"
+    )
+    if codec == "vp9":
+        enc = ["-c:v", "libvpx-vp9", "-crf", "33", "-b:v", VIDEO_MAX_BITRATE, "-row-mt", "1",
+               "-deadline", "good", "-cpu-used", "5", "-c:a", "libopus", "-b:a", "128k"]
+    else:
+        enc = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+               "-maxrate", VIDEO_MAX_BITRATE, "-bufsize", 2 * VIDEO_MAX_BITRATE, "-pix_fmt", "yuv420p",
+               "-movflags", "+faststart", "-c:a", "aac", "-b:a", "128k"]
+    part = dst_path.with_name(f"{dst_path.stem}.part{dst_path.suffix}")
+    try:
+        run_tool(
+            [FFMPEG_BIN, "-v", "error", "-y", "-i", src_path, "-map", "0:v:0", "-map", "0:a:0?",
+             "-vf", scale, *enc, part],
+            VIDEO_TIMEOUT_SEC,
+        )
+        os.replace(part, dst_path)
+    finally:
+        part.unlink(missing_ok=True)
+
+def _video_play_ext(codec: str) -> str:
+    return ".webm" if codec == "vp9" else ".mp4"
+
+def _process_video(
+    src_path: Path,
+    poster_path: Path,
+    thumb_path: Path,
+    play_path: Optional[Path],
+    profile_name: str = IMAGE_PROFILE,
+) -> Dict[str, Any]:
+    """Probe one video, write its poster/thumbnail and, if needed, the kiosk rendition.
+
+    Returns the probe fields, ``poster`` (bool), ``playback`` (file extension of
+    the rendition or "") and per-stage ``timings`` in ms. Probe failures raise;
+    a failed poster or transcode only leaves the part out and sets ``error``.
+    """
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal t0
+        now = time.perf_counter()
+        timings[stage] = round((now - t0) * 1000.0, 1)
+        t0 = now
+
+    probe = _probe_video(src_path)
+    lap("probe")
+    res: Dict[str, Any] = {**probe, "poster": False, "playback": "", "timings": timings}
+    try:
+        video_poster(FFMPEG_BIN, src_path, poster_path, thumb_path, min(1.0, probe["duration"] / 2), profile_name)
+        res["poster"] = True
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        res["error"] = f"poster: {e}"
+    lap("poster")
+    if play_path is not None and _video_needs_transcode(probe):
+        try:
+            _transcode_video(src_path, play_path, VIDEO_TRANSCODE)
+            res["playback"] = play_path.suffix
+        except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+            res["error"] = f"transcode: {e}"
+        lap("transcode")
+    return res
+
+def _video_files(img_id: str, video: Dict[str, Any]) -> Dict[str, str]:
+    """Content-store role -> file name for the derivatives of a video."""
+    out: Dict[str, str] = {}
+    if video.get("poster"):
+        out["poster"] = f"{img_id.lower()}_poster.webp"
+        out["thumb"] = f"{img_id.lower()}_thumb.webp"
+    if video.get("playback"):
+        out["play"] = f"{img_id.lower()}_play{video['playback']}"
+    return out
+
+# at most VIDEO_WORKERS ffmpeg runs at a time; they already use several cores each
+_video_slots = asyncio.Semaphore(max(1, VIDEO_WORKERS))
+
+# ---- Upload jobs ----
+
+class MultipartStager:
+    """Streams a multipart/form-data body straight into staging files.
+
+    Each ``files`` part is written once, to its final file under
+    ``staging_dir``, with the writes (and the SHA-256 of the content) done in a
+    worker thread in ~1 MB batches. The per-file size limit is enforced while
+    streaming: an oversized part is dropped as soon as it crosses the limit and
+    the rest of it is discarded without touching the disk.
+    """
+
+    FLUSH_BYTES = 1024 * 1024
+
+    def __init__(self, staging_dir: Path, boundary: bytes) -> None:
+        self.staging_dir = staging_dir
+        self.entries: List[Dict[str, Any]] = []
+        self._limit = MAX_UPLOAD_MB_PER_FILE * 1024 * 1024
+        self._events: List[Tuple[str, Any]] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._field = b""
+        self._value = b""
+        self._current: Optional[Dict[str, Any]] = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": lambda: self._events.append(("begin", self._headers)),
+            "on_part_data": lambda data, start, end: self._events.append(("data", data[start:end])),
+            "on_part_end": lambda: self._events.append(("end", None)),
+        })
+
+    # parser callbacks (synchronous, only record events)
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._field.lower()] = self._value
+        self._field = b""
+        self._value = b""
+
+    @staticmethod
+    def _write(part: Dict[str, Any], chunks: List[bytes]) -> None:
+        fh = part["fh"]
+        for chunk in chunks:
+            fh.write(chunk)
+            part["hasher"].update(chunk)
+
+    async def _flush(self, part: Dict[str, Any]) -> None:
+        if part["buf"]:
+            chunks, part["buf"], part["buffered"] = part["buf"], [], 0
+            await asyncio.to_thread(self._write, part, chunks)
+
+    async def _begin(self, headers: Dict[bytes, bytes]) -> None:
+        _, opts = parse_options_header(headers.get(b"content-disposition", b""))
+        name = opts.get(b"name", b"").decode("utf-8", "replace")
+        filename = opts.get(b"filename")
+        if name != "files" or filename is None:
+            self._current = None
+            return
+        if len(self.entries) >= MAX_UPLOAD_FILES:
+            raise HTTPException(status_code=400, detail=f"too many files (max {MAX_UPLOAD_FILES})")
+        orig_name = safe_filename(filename.decode("utf-8", "replace") or "upload")
+        path = self.staging_dir / f"{len(self.entries):03d}_{orig_name}"
+        entry = {"name": orig_name, "staged": path.name, "image_id": uuid.uuid4().hex, "status": "pending"}
+        self.entries.append(entry)
+        fh = await asyncio.to_thread(open, path, "wb")
+        self._current = {"entry": entry, "path": path, "fh": fh, "hasher": hashlib.sha256(),
+                         "size": 0, "buf": [], "buffered": 0}
+
+    async def _data(self, chunk: bytes) -> None:
+        part = self._current
+        if part is None or part["fh"] is None:
+            return
+        part["size"] += len(chunk)
+        if part["size"] > self._limit:
+            part["buf"] = []
+            await asyncio.to_thread(part["fh"].close)
+            part["fh"] = None
+            await asyncio.to_thread(part["path"].unlink, missing_ok=True)
+            part["entry"]["status"] = "skipped"
+            part["entry"]["error"] = "too large"
+            return
+        part["buf"].append(chunk)
+        part["buffered"] += len(chunk)
+        if part["buffered"] >= self.FLUSH_BYTES:
+            await self._flush(part)
+
+    async def _end(self) -> None:
+        part, self._current = self._current, None
+        if part is None or part["fh"] is None:
+            return
+        await self._flush(part)
+        await asyncio.to_thread(part["fh"].close)
+        part["entry"]["size"] = part["size"]
+        part["entry"]["sha256"] = part["hasher"].hexdigest()
+
+    async def feed(self, chunk: bytes) -> None:
+        self._parser.write(chunk)
+        events, self._events = self._events, []
+        for kind, payload in events:
+            if kind == "begin":
+                await self._begin(payload)
+            elif kind == "data":
+                await self._data(payload)
+            else:
+                await self._end()
+
+    async def finish(self) -> None:
+        self._parser.finalize()
+        await self.feed(b"")
+
+    async def abort(self) -> None:
+        part, self._current = self._current, None
+        if part is not None and part["fh"] is not None:
+            await asyncio.to_thread(part["fh"].close)
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        # filesystem without hardlinks: fall back to a private copy
+        shutil.copy2(src, dst)
+
+_sha_rx = re.compile(r"[0-9a-f]{64}")
+
+class ContentStore:
+    """Derivatives keyed by the SHA-256 of the uploaded original.
+
+    ``.cas/<sha[:2]>/<sha>/`` holds the derivative files plus a ``meta.json``
+    (written last) with their names and dimensions. Folder files are hardlinks
+    to these, so re-uploading a known original is a lookup plus a link instead
+    of a decode/resize/encode. Entries are reference-counted through the index
+    and the upload jobs: once neither an index entry nor a queued or running
+    job carries the hash any more, ``release`` removes them.
+    """
+
+    def _dir(self, sha: str) -> Path:
+        return CAS_DIR / sha[:2] / sha
+
+    def lookup(self, sha: str) -> Optional[Dict[str, Any]]:
+        if not _sha_rx.fullmatch(sha or ""):
+            return None
+        info = _load_json(self._dir(sha) / "meta.json", None)
+        return info if isinstance(info, dict) and isinstance(info.get("files"), dict) else None
+
+    def materialize(self, sha: str, info: Dict[str, Any], targets: Dict[str, Path]) -> bool:
+        """Link the stored derivatives to ``targets`` (role -> path); False if any is missing."""
+        done: List[Path] = []
+        try:
+            for role, dst in targets.items():
+                name = info["files"].get(role)
+                if not name:
+                    raise FileNotFoundError(role)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                _link_or_copy(self._dir(sha) / name, dst)
+                done.append(dst)
+        except OSError:
+            for p in done:
+                p.unlink(missing_ok=True)
+            return False
+        return True
+
+    def adopt(self, sha: str, files: Dict[str, Path], info: Dict[str, Any]) -> None:
+        """Record freshly produced derivatives (role -> path) under ``sha``."""
+        if not _sha_rx.fullmatch(sha or ""):
+            return
+        d = self._dir(sha)
+        if (d / "meta.json").exists():
+            return
+        d.mkdir(parents=True, exist_ok=True)
+        names: Dict[str, str] = {}
+        for role, src in files.items():
+            name = f"{role}{src.suffix}"
+            dst = d / name
+            dst.unlink(missing_ok=True)
+            _link_or_copy(src, dst)
+            names[role] = name
+        _atomic_write_json(d / "meta.json", {**info, "files": names})
+
+    async def release(self, shas: Set[str]) -> None:
+        """Drop stored derivatives that are no longer referenced by the index or an upload job."""
+        # jobs link and adopt entries before their results reach the index
+        _, _, busy = upload_jobs.active()
+        shas = {sha for sha in shas if sha and sha not in busy and _sha_rx.fullmatch(sha)}
+        if shas:
+            await asyncio.to_thread(self._release, shas)
+
+    def _release(self, shas: Set[str]) -> None:
+        for ims in store.index.snapshot().get("images", {}).values():
+            for im in ims:
+                shas.discard(im.get("sha256"))
+            if not shas:
+                return
+        for sha in shas:
+            d = self._dir(sha)
+            shutil.rmtree(d, ignore_errors=True)
+            try:
+                d.parent.rmdir()
+            except OSError:
+                pass  # still holds other hashes
+
+content_store = ContentStore()
+
+def _image_meta(
+    img_id: str, orig_name: str, width: int, height: int, renditions: Optional[List[Dict[str, Any]]] = None
+) -> Dict[str, Any]:
+    meta = {
+        "id": img_id,
+        "type": "image",
+        "filename": f"{img_id.lower()}.webp",
+        "thumb": f"{img_id.lower()}_thumb.webp",
+        "original_name": orig_name,
+        "uploaded_at": now_iso(),
+        "width": width,
+        "height": height,
+    }
+    if renditions:
+        meta["renditions"] = _rendition_entries(img_id, renditions)
+    return meta
+
+def _video_meta(
+    img_id: str, orig_name: str, filename: str, video: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    meta = {
+        "id": img_id,
+        "type": "video",
+        "filename": filename,
+        "thumb": None,
+        "original_name": orig_name,
+        "uploaded_at": now_iso(),
+        "width": 0,
+        "height": 0,
+    }
+    if video:
+        meta["width"] = video.get("width", 0)
+        meta["height"] = video.get("height", 0)
+        meta["duration"] = video.get("duration", 0)
+        files = _video_files(img_id, video)
+        meta["thumb"] = files.get("thumb")
+        if "poster" in files:
+            meta["poster"] = files["poster"]
+        if "play" in files:
+            meta["playback"] = files["play"]
+    return meta
+
+def _files_size(paths: List[Path]) -> int:
+    total = 0
+    for p in paths:
+        try:
+            total += p.stat().st_size
+        except OSError:
+            pass
+    return total
+
+def _record_upload(
+    pipeline: str, result: str, size_in: int, timings: Optional[Dict[str, float]] = None, size_out: int = 0
+) -> None:
+    metric_media_uploads.inc(pipeline, result)
+    metric_media_bytes.inc(pipeline, "in", value=size_in)
+    if size_out:
+        metric_media_bytes.inc(pipeline, "out", value=size_out)
+    for stage, ms in (timings or {}).items():
+        metric_media_stage_seconds.observe(ms / 1000.0, pipeline, stage)
+
+async def _store_upload(
+    folder_dir: Path,
+    orig_name: str,
+    tmp_file: Path,
+    img_id: str,
+    sha256: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Turn one staged upload into its media file(s); returns the index entry or None.
+
+    Images leave ``tmp_file`` in place (the caller removes it once the result is
+    journaled), videos are moved into the folder. Originals already known to the
+    content store are linked instead of processed again. Per-stage timings are
+    added to ``stats`` when given.
+    """
+    ext = os.path.splitext(orig_name)[1].lower()
+    is_video = ext in ALLOWED_VIDEO_EXTS
+    pipeline = "video" if is_video else "image"
+    try:
+        size_in = (await asyncio.to_thread(tmp_file.stat)).st_size
+    except OSError:
+        size_in = 0
+    if is_video:
+        filename = f"{img_id.lower()}{ext}"
+        targets = {"main": folder_dir / filename}
+    else:
+        filename = f"{img_id.lower()}.webp"
+        targets = {"main": folder_dir / filename, "thumb": folder_dir / f"{img_id.lower()}_thumb.webp"}
+
+    if sha256:
+        info = await asyncio.to_thread(content_store.lookup, sha256)
+        if (
+            info is not None
+            and info.get("type") == ("video" if is_video else "image")
+            and info["files"].get("main", "").endswith(targets["main"].suffix)
+            and await asyncio.to_thread(
+                content_store.materialize,
+                sha256,
+                info,
+                {**targets, **{role: folder_dir / name for role, name in (
+                    _video_files(img_id, info) if is_video else _rendition_files(img_id, info.get("renditions", []))
+                ).items()}},
+            )
+        ):
+            if stats is not None:
+                stats["dedup"] = True
+            if is_video:
+                meta = _video_meta(img_id, orig_name, filename, info)
+                await asyncio.to_thread(tmp_file.unlink, missing_ok=True)
+            else:
+                meta = _image_meta(img_id, orig_name, info.get("width", 0), info.get("height", 0),
+                                   info.get("renditions"))
+            meta["sha256"] = sha256
+            _record_upload(pipeline, "dedup", size_in)
+            return meta
+
+    # Check for video
+    if is_video:
+        dst = targets["main"]
+        # Move tmp file to dst directly
+        try:
+            # ⚡ Bolt: Offload blocking I/O (large file move) to thread to prevent blocking the async event loop
+            await asyncio.to_thread(shutil.move, str(tmp_file), str(dst))
+        except Exception:
+            # cleanup if move fails
+            try:
+                await asyncio.to_thread(tmp_file.unlink, missing_ok=True)
+            except Exception:
+                pass
+            _record_upload(pipeline, "failed", size_in)
+            return None
+        return await _finish_video(folder_dir, orig_name, img_id, dst, sha256, stats, size_in)
+
+    # Handle Image
+    try:
+        res = await image_pool.run(process_image, tmp_file, targets["main"], targets["thumb"])
+    except Exception:
+        # not an image, corrupted or over the pixel budget
+        _record_upload(pipeline, "failed", size_in)
+        return None
+    timings = res["timings"]
+    if stats is not None:
+        stats["profile"] = IMAGE_PROFILE
+        stats["timings_ms"] = timings
+    w, h, renditions = res["width"], res["height"], res["renditions"]
+    meta = _image_meta(img_id, orig_name, w, h, renditions)
+    info = {"type": "image", "width": w, "height": h, "renditions": renditions}
+    targets.update({role: folder_dir / name for role, name in _rendition_files(img_id, renditions).items()})
+    return await _finish_upload("image", meta, info, targets, sha256, size_in, timings)
+
+async def _finish_video(
+    folder_dir: Path,
+    orig_name: str,
+    img_id: str,
+    dst: Path,
+    sha256: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    size_in: int = 0,
+) -> Dict[str, Any]:
+    """Probe a video that is already in the folder, write its poster/thumbnail/rendition; returns the entry.
+
+    Also used when a job resumes after the move, so an interrupted upload gets
+    the same preview and content-store entry as an uninterrupted one.
+    """
+    targets = {"main": dst}
+    timings: Dict[str, float] = {}
+    video = None
+    if FFMPEG_BIN and FFPROBE_BIN:
+        play = folder_dir / f"{img_id.lower()}_play{_video_play_ext(VIDEO_TRANSCODE)}" if VIDEO_TRANSCODE else None
+        try:
+            async with _video_slots:
+                video = await asyncio.to_thread(
+                    _process_video,
+                    dst,
+                    folder_dir / f"{img_id.lower()}_poster.webp",
+                    folder_dir / f"{img_id.lower()}_thumb.webp",
+                    play,
+                )
+        except (RuntimeError, ValueError, OSError, subprocess.TimeoutExpired) as e:
+            # unknown container/codec: keep the upload as it is, without preview
+            if stats is not None:
+                stats["warning"] = f"probe: {e}"
+        else:
+            timings = video.pop("timings")
+            if stats is not None:
+                stats["timings_ms"] = timings
+                if video.get("error"):
+                    stats["warning"] = video["error"]
+            targets.update({role: folder_dir / name for role, name in _video_files(img_id, video).items()})
+    meta = _video_meta(img_id, orig_name, dst.name, video)
+    info = {"type": "video"}
+    if video:
+        info.update({k: video[k] for k in ("width", "height", "duration", "poster", "playback")})
+    return await _finish_upload("video", meta, info, targets, sha256, size_in, timings)
+
+async def _finish_upload(
+    pipeline: str,
+    meta: Dict[str, Any],
+    info: Dict[str, Any],
+    targets: Dict[str, Path],
+    sha256: Optional[str],
+    size_in: int,
+    timings: Dict[str, float],
+) -> Dict[str, Any]:
+    """Record freshly produced derivatives in the content store and the upload metrics."""
+    if sha256:
+        meta["sha256"] = sha256
+        try:
+            await asyncio.to_thread(content_store.adopt, sha256, targets, info)
+        except OSError:
+            pass  # dedup is an optimization; the upload itself succeeded
+    size_out = await asyncio.to_thread(_files_size, list(targets.values()))
+    _record_upload(pipeline, "processed", size_in, timings, size_out)
+    return meta
+
+class UploadJobs:
+    """Background processing of uploaded batches.
+
+    The upload request only stages the raw files under
+    ``tmp_upload/<job_id>/`` and writes a journal to ``jobs/<job_id>.json``.
+    A single worker task then runs the image/video path for each job, records
+    per-file progress in the journal (the admin UI polls ``/api/jobs/<id>``)
+    and adds the results to the index in one save when the job finishes. Jobs
+    that were queued or running when the process stopped are resumed at startup.
+    """
+
+    RETENTION_SEC = 24 * 3600
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._persist_lock = asyncio.Lock()
+
+    def _journal_path(self, job_id: str) -> Path:
+        return JOBS_DIR / f"{job_id}.json"
+
+    async def _persist(self, job: Dict[str, Any]) -> None:
+        # serialized in the loop (files of a job finish concurrently), written in order off it
+        async with self._persist_lock:
+            job["updated_at"] = now_iso()
+            text = json.dumps(job, ensure_ascii=False, indent=2)
+            await asyncio.to_thread(_atomic_write_text, self._journal_path(job["id"]), text)
+
+    def summary(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        files = job.get("files", [])
+        return {
+            "id": job["id"],
+            "folder_id": job["folder_id"],
+            "status": job["status"],
+            "total": len(files),
+            "done": sum(1 for f in files if f["status"] == "done"),
+            "failed": sum(1 for f in files if f["status"] in ("failed", "skipped")),
+            "created_at": job.get("created_at"),
+            "updated_at": job.get("updated_at"),
+        }
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job is None and re.fullmatch(r"[0-9a-f]{32}", job_id):
+            job = _load_json(self._journal_path(job_id), None)
+        return job
+
+    async def submit(self, job_id: str, folder_id: str, files: List[Dict[str, Any]]) -> Dict[str, Any]:
+        job = {
+            "id": job_id,
+            "folder_id": folder_id,
+            "status": "queued",
+            "created_at": now_iso(),
+            "files": files,
+        }
+        await self._persist(job)
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job: Dict[str, Any]) -> None:
+        self._jobs[job["id"]] = job
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait(job["id"])
+        self.start()
+
+    async def _process_file(self, job: Dict[str, Any], folder_dir: Path, entry: Dict[str, Any]) -> None:
+        tmp_file = UPLOAD_STAGING_DIR / job["id"] / entry["staged"]
+        ext = os.path.splitext(entry["name"])[1].lower()
+        stats: Dict[str, Any] = {}
+        if not await asyncio.to_thread(tmp_file.exists):
+            # interrupted after a video had already been moved into place
+            video = folder_dir / f"{entry['image_id']}{ext}"
+            if ext in ALLOWED_VIDEO_EXTS and await asyncio.to_thread(video.exists):
+                entry["meta"] = await _finish_video(
+                    folder_dir, entry["name"], entry["image_id"], video, entry.get("sha256"), stats,
+                    entry.get("size", 0),
+                )
+                entry.update(stats)
+                entry["status"] = "done"
+            else:
+                entry["status"] = "failed"
+                entry["error"] = "staged file missing"
+        else:
+            meta = await _store_upload(
+                folder_dir, entry["name"], tmp_file, entry["image_id"], entry.get("sha256"), stats
+            )
+            entry.update(stats)
+            if meta is None:
+                entry["status"] = "failed"
+                entry["error"] = "unsupported or corrupted file"
+            else:
+                entry["meta"] = meta
+                entry["status"] = "done"
+        await self._persist(job)
+        await asyncio.to_thread(tmp_file.unlink, missing_ok=True)
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        try:
+            folder = _find_folder(job["folder_id"])
+        except HTTPException:
+            for entry in job["files"]:
+                if entry["status"] == "pending":
+                    entry["status"] = "failed"
+                    entry["error"] = "folder deleted"
+            job["status"] = "failed"
+        else:
+            job["status"] = "running"
+            await self._persist(job)
+            folder_dir = _folder_path(folder)
+            await asyncio.to_thread(folder_dir.mkdir, parents=True, exist_ok=True)
+            pending = [f for f in job["files"] if f["status"] == "pending"]
+            # the same original twice in one batch: process it once, then link the copies
+            # from the content store instead of decoding and encoding each of them
+            first: List[Dict[str, Any]] = []
+            repeats: List[Dict[str, Any]] = []
+            shas: Set[str] = set()
+            for f in pending:
+                sha = f.get("sha256")
+                (repeats if sha and sha in shas else first).append(f)
+                if sha:
+                    shas.add(sha)
+            await asyncio.gather(*(self._process_file(job, folder_dir, f) for f in first))
+            await asyncio.gather(*(self._process_file(job, folder_dir, f) for f in repeats))
+
+            # upload order is kept: metas are committed in file order
+            added = [f["meta"] for f in job["files"] if f.get("meta")]
+            if added:
+
+                def append(images: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+                    known = {im.get("id") for im in images}
+                    new = [m for m in added if m["id"] not in known]
+                    return images + new if new else None
+
+                async with mutations.folder(job["folder_id"]):
+                    _find_folder(job["folder_id"])  # deleted meanwhile: fail the job
+                    await _update_image_list(job["folder_id"], append)
+                refresher.request("images")
+            job["status"] = "done"
+        await self._persist(job)
+        await asyncio.to_thread(shutil.rmtree, UPLOAD_STAGING_DIR / job["id"], ignore_errors=True)
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            try:
+                await self._process(job)
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                try:
+                    await self._persist(job)
+                except Exception:
+                    pass
+            finally:
+                self._jobs.pop(job_id, None)
+
+    def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def active(self) -> Tuple[Set[str], Set[str], Set[str]]:
+        """Job ids, image ids and content hashes of queued or running jobs."""
+        jobs = list(self._jobs.values())
+        files = [f for job in jobs for f in job.get("files", [])]
+        return (
+            {job["id"] for job in jobs},
+            {f.get("image_id") for f in files if f.get("image_id")},
+            {f.get("sha256") for f in files if f.get("sha256")},
+        )
+
+    def resume(self) -> None:
+        """Re-queue unfinished jobs from the journal and prune old finished ones."""
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        cutoff = time.time() - self.RETENTION_SEC
+        for path in sorted(JOBS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime):
+            job = _load_json(path, None)
+            if not isinstance(job, dict) or "id" not in job:
+                continue
+            if job.get("status") in ("queued", "running"):
+                job["status"] = "queued"
+                self._enqueue(job)
+            elif path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+upload_jobs = UploadJobs()
+
+# ---- Reconciler ----
+
+_media_name_rx = re.compile(r"^([0-9a-f]{32})(?:_(thumb|poster|play|\d+p))?(\.[a-z0-9]+)$")
+
+def _scandir_batch(it: Any, n: int) -> List[Tuple[str, str, bool, float, int]]:
+    """Next ``n`` entries of a scandir iterator as (name, path, is_dir, age anchor, size)."""
+    out = []
+    for entry in it:
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        # ctime moves when a hardlink is added, so deduplicated files count as new too
+        out.append((entry.name, entry.path, entry.is_dir(follow_symlinks=False),
+                    max(st.st_mtime, st.st_ctime), st.st_size))
+        if len(out) >= n:
+            break
+    return out
+
+class MediaReconciler:
+    """Background consistency check of MEDIA_DIR against the index.
+
+    Every pass walks the folder directories, the content store and the upload
+    staging area with ``os.scandir`` in small batches with pauses in between.
+    Folders whose directory and index list are unchanged since the last clean
+    pass are skipped. It reports files nobody references, index entries whose
+    files are missing and stale temp data; with ``remove`` the orphans and
+    stale temp data are deleted and entries without their main file dropped.
+    Anything younger than RECONCILE_GRACE_SEC or owned by a running upload
+    job is left alone. An empty index is rebuilt from the files first, and a
+    pass that starts from an empty index never deletes anything.
+    """
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+        self._running: Optional[asyncio.Task] = None
+        self._clean: Dict[str, Tuple[int, Any]] = {}
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    async def _entries(self, path: Path) -> Any:
+        """Async iterator over directory entries, one batch per thread hop."""
+        try:
+            it = await asyncio.to_thread(os.scandir, path)
+        except OSError:
+            return
+        try:
+            while True:
+                batch = await asyncio.to_thread(_scandir_batch, it, RECONCILE_BATCH)
+                for item in batch:
+                    yield item
+                if len(batch) < RECONCILE_BATCH:
+                    return
+                await asyncio.sleep(RECONCILE_PAUSE_SEC)
+        finally:
+            it.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {"running": self._running is not None and not self._running.done(), "report": self.last_report}
+
+    def trigger(self, remove: bool = RECONCILE_REMOVE) -> bool:
+        """Start a pass now unless one is running."""
+        if self._running is not None and not self._running.done():
+            return False
+        self._running = asyncio.create_task(self.run(remove))
+        return True
+
+    async def run(self, remove: bool = RECONCILE_REMOVE) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        report: Dict[str, Any] = {
+            "started_at": now_iso(), "remove": remove, "scanned": 0, "skipped_folders": 0,
+            "orphans": [], "orphan_bytes": 0, "missing": [], "stale_tmp": [], "removed": 0,
+        }
+        cutoff = time.time() - RECONCILE_GRACE_SEC
+        active_jobs, active_ids, active_shas = upload_jobs.active()
+        folders = store.folders.snapshot().get("folders", [])
+        idx = store.index.snapshot().get("images", {})
+        if not any(idx.values()):
+            if await asyncio.to_thread(_media_on_disk, folders):
+                # media on disk but an empty index: the index was lost or reset after corruption
+                report["rebuilt"] = await rebuild_index()
+                idx = store.index.snapshot().get("images", {})
+            # an empty or just rebuilt index is no ground truth: report, but never delete
+            remove = report["remove"] = False
+        by_slug = {f["slug"]: f for f in folders}
+        # folder id -> ids of entries whose main file is gone (uncapped, unlike report["missing"])
+        gone: Dict[str, Set[str]] = {}
+
+        def note(kind: str, item: Any) -> None:
+            report[f"{kind}_count"] = report.get(f"{kind}_count", 0) + 1
+            if len(report[kind]) < RECONCILE_REPORT_MAX:
+                report[kind].append(item)
+
+        async def drop(path: str, is_dir: bool) -> None:
+            if not remove:
+                return
+            try:
+                if is_dir:
+                    await asyncio.to_thread(shutil.rmtree, path)
+                else:
+                    await asyncio.to_thread(os.unlink, path)
+                report["removed"] += 1
+            except OSError:
+                pass
+
+        async for name, path, is_dir, anchor, size in self._entries(MEDIA_DIR):
+            report["scanned"] += 1
+            if name == CAS_DIR.name:
+                continue
+            folder = by_slug.get(name)
+            if folder is None:
+                if anchor < cutoff:
+                    note("orphans", name + ("/" if is_dir else ""))
+                    await drop(path, is_dir)
+                continue
+            await self._scan_folder(folder, idx.get(folder["id"]) or [], Path(path),
+                                    cutoff, active_ids, report, note, drop, gone)
+
+        referenced = {im.get("sha256") for ims in idx.values() for im in ims} | active_shas
+        async for prefix, prefix_path, is_dir, _, _ in self._entries(CAS_DIR):
+            if not is_dir:
+                continue
+            async for sha, path, _, anchor, _ in self._entries(Path(prefix_path)):
+                report["scanned"] += 1
+                if sha not in referenced and anchor < cutoff:
+                    note("orphans", f"{CAS_DIR.name}/{prefix}/{sha}/")
+                    await drop(path, True)
+
+        async for name, path, is_dir, anchor, _ in self._entries(UPLOAD_STAGING_DIR):
+            report["scanned"] += 1
+            if name not in active_jobs and anchor < cutoff:
+                note("stale_tmp", f"{UPLOAD_STAGING_DIR.name}/{name}")
+                await drop(path, is_dir)
+        folder_ids = {f["id"] for f in folders}
+        async for name, path, is_dir, anchor, _ in self._entries(SHEET_DIR):
+            report["scanned"] += 1
+            if name not in folder_ids and anchor < cutoff:
+                note("stale_tmp", f"{SHEET_DIR.name}/{name}")
+                await drop(path, is_dir)
+        async for name, path, is_dir, anchor, _ in self._entries(DATA_DIR):
+            if not is_dir and name.endswith(".tmp") and anchor < cutoff:
+                note("stale_tmp", name)
+                await drop(path, False)
+
+        if remove and gone:
+            await self._drop_missing(gone)
+
+        report["finished_at"] = now_iso()
+        report["duration_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        self.last_report = report
+        return report
+
+    async def _scan_folder(
+        self,
+        folder: Dict[str, Any],
+        images: List[Dict[str, Any]],
+        folder_dir: Path,
+        cutoff: float,
+        active_ids: Set[str],
+        report: Dict[str, Any],
+        note: Callable[[str, Any], None],
+        drop: Callable[[str, bool], Any],
+        gone: Dict[str, Set[str]],
+    ) -> None:
+        try:
+            dir_mtime = (await asyncio.to_thread(os.stat, folder_dir)).st_mtime_ns
+        except OSError:
+            return
+        clean = self._clean.get(folder["id"])
+        if clean is not None and clean[0] == dir_mtime and clean[1] is images:
+            report["skipped_folders"] += 1
+            return
+        expected = {name: im for im in images for name in _entry_files(im)}
+        seen: Set[str] = set()
+        deferred = False  # only a pass without findings lets the folder be skipped next time
+        async for name, path, is_dir, anchor, size in self._entries(folder_dir):
+            report["scanned"] += 1
+            if name in expected:
+                seen.add(name)
+                continue
+            m = _media_name_rx.match(name)
+            if (m and m.group(1) in active_ids) or anchor >= cutoff:
+                deferred = True  # maybe an upload in progress; look again next pass
+                continue
+            note("orphans", f"{folder['slug']}/{name}")
+            report["orphan_bytes"] += size
+            await drop(path, is_dir)
+            deferred = True
+        for name, im in expected.items():
+            if name not in seen:
+                main = name == im.get("filename")
+                note("missing", {"folder_id": folder["id"], "image_id": im.get("id"), "file": name, "main": main})
+                if main:
+                    gone.setdefault(folder["id"], set()).add(im.get("id"))
+                deferred = True
+        if not deferred:
+            self._clean[folder["id"]] = (dir_mtime, images)
+
+    async def _drop_missing(self, gone: Dict[str, Set[str]]) -> None:
+        """Remove index entries whose main file is gone; the kiosk would only get 404s."""
+        released: Set[str] = set()
+        for folder_id, ids in gone.items():
+            dropped: List[Dict[str, Any]] = []
+
+            def apply(ims: List[Dict[str, Any]], ids: Set[str] = ids) -> List[Dict[str, Any]]:
+                dropped[:] = [im for im in ims if im.get("id") in ids]
+                return [im for im in ims if im.get("id") not in ids]
+
+            async with mutations.folder(folder_id):
+                await _update_image_list(folder_id, apply)
+                folder = next((f for f in store.folders.snapshot().get("folders", []) if f["id"] == folder_id), None)
+                if folder is not None:
+                    # thumbnails and renditions of the dropped entries
+                    await asyncio.to_thread(_unlink_entries, _folder_path(folder), dropped)
+            released.update(im.get("sha256") for im in dropped)
+        if gone:
+            await content_store.release(released)
+            refresher.request("images")
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                if broadcast.is_leader():  # one worker per deployment
+                    await self.run()
+            except asyncio.CancelledError:
+                raise
             except Exception:
                 pass
+            await asyncio.sleep(RECONCILE_INTERVAL_SEC)
 
-        meta = {
-            "id": img_id,
-            "type": "image",
-            "filename": filename,
-            "thumb": f"{img_id.lower()}_thumb.webp",
-            "original_name": orig_name,
-            "uploaded_at": now_iso(),
-            "width": w,
-            "height": h,
+    def start(self) -> None:
+        if self._task is None and RECONCILE_INTERVAL_SEC > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._running):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._running = None
+
+reconciler = MediaReconciler()
+
+def _media_on_disk(folders: List[Dict[str, Any]]) -> bool:
+    for folder in folders:
+        try:
+            with os.scandir(_folder_path(folder)) as it:
+                if any(_media_name_rx.match(e.name) for e in it):
+                    return True
+        except OSError:
+            continue
+    return False
+
+def _cas_inodes() -> Dict[Tuple[int, int], Tuple[str, Dict[str, Any]]]:
+    """(dev, inode) of every content-store file -> (sha, stored info)."""
+    out: Dict[Tuple[int, int], Tuple[str, Dict[str, Any]]] = {}
+    if not CAS_DIR.is_dir():
+        return out
+    for prefix in os.scandir(CAS_DIR):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            info = content_store.lookup(entry.name)
+            if info is None:
+                continue
+            for name in info["files"].values():
+                try:
+                    st = os.stat(Path(entry.path) / name)
+                except OSError:
+                    continue
+                out[(st.st_dev, st.st_ino)] = (entry.name, info)
+    return out
+
+def _rebuild_folder(
+    folder_dir: Path, known: Dict[str, Dict[str, Any]], cas: Dict[Tuple[int, int], Tuple[str, Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """Index entries for the media in one folder directory, in upload (mtime) order."""
+    groups: Dict[str, Dict[str, str]] = {}
+    try:
+        entries = list(os.scandir(folder_dir))
+    except OSError:
+        return []
+    for entry in entries:
+        m = _media_name_rx.match(entry.name)
+        if m:
+            groups.setdefault(m.group(1), {})[(m.group(2) or "main") + m.group(3)] = entry.name
+    out: List[Tuple[float, Dict[str, Any]]] = []
+    for img_id, files in groups.items():
+        main = next((files[k] for k in ("main.webp", "main.mp4", "main.webm", "main.mov") if k in files), None)
+        if main is None:
+            continue
+        try:
+            entry = _rebuild_entry(folder_dir, img_id, main, files, known, cas)
+        except (OSError, ValueError):
+            continue  # unreadable file: leave it to the orphan report
+        out.append(entry)
+    out.sort(key=lambda t: t[0])
+    return [meta for _, meta in out]
+
+def _rebuild_entry(
+    folder_dir: Path,
+    img_id: str,
+    main: str,
+    files: Dict[str, str],
+    known: Dict[str, Dict[str, Any]],
+    cas: Dict[Tuple[int, int], Tuple[str, Dict[str, Any]]],
+) -> Tuple[float, Dict[str, Any]]:
+    st = os.stat(folder_dir / main)
+    if img_id in known:
+        return st.st_mtime, known[img_id]
+    sha, info = cas.get((st.st_dev, st.st_ino), (None, None))
+    if main.endswith(".webp"):
+        if info is None:
+            Image = pil()
+            rungs: Dict[int, List[str]] = {}
+            for key in files:
+                label, _, fmt = key.partition(".")
+                if label.endswith("p") and label[:-1].isdigit():
+                    rungs.setdefault(int(label[:-1]), []).append(fmt)
+            renditions = []
+            for hgt, fmts in sorted(rungs.items()):
+                # the rung that is the main file only has its extra formats on disk
+                is_main = "webp" not in fmts
+                with Image.open(folder_dir / (main if is_main else files[f"{hgt}p.webp"])) as im:
+                    rw, rh = im.size
+                formats = ["webp"] + [f for f in fmts if f != "webp"]
+                renditions.append({"h": hgt, "width": rw, "height": rh, "formats": formats, "main": is_main})
+            with Image.open(folder_dir / main) as im:
+                w, h = im.size
+            info = {"width": w, "height": h, "renditions": renditions}
+        meta = _image_meta(img_id, main, info.get("width", 0), info.get("height", 0), info.get("renditions"))
+    else:
+        video = info
+        if video is None:
+            play = next((n for k, n in files.items() if k.startswith("play.")), None)
+            video = {"poster": "poster.webp" in files and "thumb.webp" in files,
+                     "playback": os.path.splitext(play)[1] if play else ""}
+        meta = _video_meta(img_id, main, main, video)
+    meta["uploaded_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(st.st_mtime))
+    if sha:
+        meta["sha256"] = sha
+    return st.st_mtime, meta
+
+async def rebuild_index() -> Dict[str, int]:
+    """Recreate index entries from the folder directories.
+
+    Entries that still exist in the index are kept as they are (their
+    original names and upload times are not on disk). Anything else with a
+    main file is re-derived, from the content store's info when the file is
+    one of its hardlinks, otherwise from the image headers. Files of queued or
+    running upload jobs are skipped; the job adds their full entries itself.
+    Returns the number of entries per folder slug.
+    """
+    folders = store.folders.snapshot().get("folders", [])
+    _, active_ids, _ = upload_jobs.active()
+    cas = await asyncio.to_thread(_cas_inodes)
+    counts: Dict[str, int] = {}
+    for folder in folders:
+        async with mutations.folder(folder["id"]):
+            known = {im.get("id"): im for im in _image_list_for(folder["id"])}
+            rebuilt = await asyncio.to_thread(_rebuild_folder, _folder_path(folder), known, cas)
+            rebuilt = [im for im in rebuilt if im["id"] in known or im["id"] not in active_ids]
+            # keep the index order for entries it already has
+            order = {img_id: i for i, img_id in enumerate(known)}
+            rebuilt.sort(key=lambda im: order.get(im["id"], len(order)))
+            await _update_image_list(folder["id"], lambda ims, new=rebuilt: new if new != ims else None)
+        counts[folder["slug"]] = len(rebuilt)
+    refresher.request("images")
+    return counts
+
+# ---- Media files ----
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+class MediaFileResponse(Response):
+    """One media file, or one byte range of it.
+
+    Uses the ASGI ``http.response.zerocopysend`` extension (sendfile) when the
+    server offers it and otherwise streams chunks read in a thread. Stops early
+    when the client goes away, e.g. a kiosk skipping to the next video.
+    """
+
+    def __init__(self, path: Path, start: int, length: int, status_code: int, headers: Dict[str, str]) -> None:
+        super().__init__(
+            status_code=status_code,
+            headers={**headers, "Content-Length": str(length)},
+            media_type=mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+        )
+        self.path = path
+        self.start = start
+        self.length = length
+
+    async def _send_body(self, scope: Dict[str, Any], send: Callable) -> None:
+        f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in (scope.get("extensions") or {}):
+                await send({"type": "http.response.zerocopysend", "file": f,
+                            "offset": self.start, "count": self.length})
+                return
+            await asyncio.to_thread(f.seek, self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(MEDIA_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break  # truncated underneath us; the client sees a short body
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def disconnected() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        body = asyncio.ensure_future(self._send_body(scope, send))
+        watch = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({body, watch}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (body, watch):
+                task.cancel()
+        if body.done() and not body.cancelled():
+            body.result()
+
+class MediaFiles:
+    """Lookup and validators for files under MEDIA_DIR.
+
+    ETags are the SHA-256 of the content (first 16 bytes), cached per
+    inode/mtime/size so each file is hashed once per process. Files above
+    MEDIA_HASH_MAX_BYTES get a stamp-based tag instead of a full read.
+    """
+
+    MAX_ETAGS = 4096
+
+    def __init__(self) -> None:
+        self._etags: Dict[Tuple[int, int, int, int], str] = {}
+
+    def resolve(self, rel: str) -> Optional[Path]:
+        parts = rel.split("/")
+        if len(parts) != 2 or any(not p or p.startswith(".") for p in parts):
+            return None  # only <folder>/<file>; hides .cas and partial files
+        return MEDIA_DIR / parts[0] / parts[1]
+
+    def _hash(self, path: Path) -> str:
+        with path.open("rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()[:32]
+
+    async def etag(self, path: Path, st: os.stat_result) -> str:
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        tag = self._etags.get(key)
+        if tag is None:
+            if st.st_size > MEDIA_HASH_MAX_BYTES:
+                tag = f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+            else:
+                tag = await asyncio.to_thread(self._hash, path)
+            if len(self._etags) >= self.MAX_ETAGS:
+                self._etags.pop(next(iter(self._etags)))
+            self._etags[key] = tag
+        return f'"{tag}"'
+
+media_files = MediaFiles()
+
+def _not_modified_since(request: Request, st: os.stat_result) -> bool:
+    header = request.headers.get("if-modified-since")
+    if not header:
+        return False
+    try:
+        return int(st.st_mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def _byte_range(request: Request, size: int, etag: str, last_modified: str) -> Optional[Tuple[int, int]]:
+    """(start, end inclusive) of a single satisfiable range; None for the whole file.
+
+    Raises HTTPException(416) for unsatisfiable ranges. Multi-range requests
+    are answered with the full file, which RFC 9110 allows.
+    """
+    header = request.headers.get("range")
+    if not header or not header.startswith("bytes="):
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range and if_range not in (etag, last_modified):
+        return None  # changed since the client's partial copy
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    first, _, last = spec.partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+# ---- Playlist ----
+
+def _pick_rendition(im: Dict[str, Any], width: int, height: int) -> Dict[str, Any]:
+    """Smallest rendition that fills ``width`` x ``height`` (object-fit: cover), else the largest.
+
+    Without a viewport the main file is used.
+    """
+    main = {"width": im.get("width") or 0, "height": im.get("height") or 0, "webp": im["filename"]}
+    options = [main]
+    for r in im.get("renditions") or []:
+        if r.get("webp") == im["filename"]:
+            if r.get("avif"):
+                main["avif"] = r["avif"]
+        else:
+            options.append(r)
+    if width <= 0 or height <= 0:
+        return main
+    options.sort(key=lambda r: r["width"] * r["height"])
+    for r in options:
+        if r["width"] >= width and r["height"] >= height:
+            return r
+    return options[-1]
+
+class PlaylistCache:
+    """Carousel order per (state version, seed).
+
+    The selection follows ``carousel.folders`` in folder order, then upload
+    order; with ``carousel.shuffle`` it is shuffled by ``random.Random(seed)``
+    so every page of one pass comes from the same order.
+    """
+
+    MAX_ENTRIES = 8
+
+    def __init__(self) -> None:
+        self._orders: Dict[Tuple[int, int], List[Tuple[Dict[str, Any], Dict[str, Any]]]] = {}
+
+    def order(self, version: int, seed: int) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        key = (version, seed)
+        items = self._orders.get(key)
+        if items is not None:
+            return items
+        cfg = store.config.snapshot()
+        folders = store.folders.snapshot().get("folders", [])
+        idx = store.index.snapshot().get("images", {})
+        selected = cfg.get("carousel", {}).get("folders", "all")
+        if selected == "all":
+            chosen = folders
+        else:
+            by_id = {f["id"]: f for f in folders}
+            chosen = [by_id[fid] for fid in selected if fid in by_id] if isinstance(selected, list) else []
+        items = [(f, im) for f in chosen for im in idx.get(f["id"], [])]
+        if cfg.get("carousel", {}).get("shuffle"):
+            random.Random(seed).shuffle(items)
+        if len(self._orders) >= self.MAX_ENTRIES:
+            self._orders.pop(next(iter(self._orders)))
+        self._orders[key] = items
+        return items
+
+playlist_cache = PlaylistCache()
+
+def _playlist_item(folder: Dict[str, Any], im: Dict[str, Any], interval: int, width: int, height: int) -> Dict[str, Any]:
+    base = f"/media/{folder['slug']}"
+    item: Dict[str, Any] = {"id": im["id"], "type": im.get("type") or "image", "caption": folder.get("name", "")}
+    if item["type"] == "video":
+        item["url"] = f"{base}/{im.get('playback') or im['filename']}"
+        if im.get("poster"):
+            item["poster"] = f"{base}/{im['poster']}"
+        item["duration"] = im.get("duration") or None  # plays to the end
+    else:
+        r = _pick_rendition(im, width, height)
+        item["url"] = f"{base}/{r['webp']}"
+        if r.get("avif"):
+            item["avif"] = f"{base}/{r['avif']}"
+        item["duration"] = interval
+    return item
+
+def _preload_links(items: List[Dict[str, Any]]) -> str:
+    links: Dict[str, str] = {}
+    for item in items[:PLAYLIST_PRELOAD]:
+        if item["type"] == "video":
+            if item.get("poster"):
+                links[item["poster"]] = f'<{item["poster"]}>; rel=preload; as=image'
+        elif item.get("avif"):
+            # browsers skip preloads with a type they can't decode
+            links[item["avif"]] = f'<{item["avif"]}>; rel=preload; as=image; type="image/avif"'
+        else:
+            links[item["url"]] = f'<{item["url"]}>; rel=preload; as=image'
+    return ", ".join(links.values())
+
+# ---- Image listing ----
+
+def _sort_value(im: Dict[str, Any], sort: str) -> str:
+    if sort == "name":
+        return str(im.get("original_name") or im.get("filename") or "").casefold()
+    return str(im.get("uploaded_at") or "")
+
+ImageOrder = Tuple[List[Dict[str, Any]], List[str], Dict[str, int]]  # entries, sort values, id -> position
+
+class ImageOrderCache:
+    """A folder's images sorted by ``sort``, reused until the list changes.
+
+    The sort is stable, so ties (a batch uploaded within one second) keep the
+    index order. Snapshot lists are replaced, never edited, when a folder
+    changes, so the cached order is valid while the snapshot holds the same list.
+    """
+
+    MAX_ENTRIES = 16
+
+    def __init__(self) -> None:
+        # (folder id, sort) -> (snapshot list it was built from, order)
+        self._orders: Dict[Tuple[str, str], Tuple[List[Dict[str, Any]], ImageOrder]] = {}
+        self._lock = threading.Lock()
+
+    def order(self, folder_id: str, sort: str) -> ImageOrder:
+        images = store.index.snapshot().get("images", {}).get(folder_id) or []
+        key = (folder_id, sort)
+        with self._lock:
+            hit = self._orders.get(key)
+            if hit is not None and hit[0] is images:
+                return hit[1]
+        entries = sorted(images, key=lambda im: _sort_value(im, sort))
+        values = [_sort_value(im, sort) for im in entries]
+        positions = {im.get("id"): n for n, im in enumerate(entries)}
+        with self._lock:
+            self._orders.pop(key, None)
+            if len(self._orders) >= self.MAX_ENTRIES:
+                self._orders.pop(next(iter(self._orders)))
+            self._orders[key] = (images, (entries, values, positions))
+        return entries, values, positions
+
+image_orders = ImageOrderCache()
+
+def _encode_cursor(value: str, img_id: str, pos: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, img_id, pos]).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[str, str, int]:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if (isinstance(key, list) and len(key) == 3 and isinstance(key[0], str)
+                and isinstance(key[1], str) and isinstance(key[2], int)):
+            return key[0], key[1], key[2]
+    except (ValueError, UnicodeDecodeError):
+        pass
+    raise HTTPException(status_code=400, detail="invalid cursor")
+
+def _image_page(
+    folder_id: str, sort: str, order: str, cursor: Optional[str], limit: Optional[int]
+) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+    """One page of a folder's images after ``cursor``: (images, total, next cursor).
+
+    The cursor names the last image of the previous page, its sort value and
+    position, so uploads and deletes in between neither shift nor repeat later
+    pages. If that image itself was deleted, its old position is used, kept
+    within the images sharing its sort value (e.g. one batch upload).
+    """
+    if sort not in IMAGE_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(IMAGE_SORTS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    entries, values, positions = image_orders.order(folder_id, sort)
+    total = len(entries)
+    n = total if limit is None else max(1, min(limit, IMAGE_PAGE_MAX))
+    at: Optional[int] = None  # position of the cursor image, None without a cursor
+    gone = False
+    if cursor:
+        value, img_id, old = _decode_cursor(cursor)
+        at = positions.get(img_id)
+        if at is None or values[at] != value:
+            lo, hi = bisect.bisect_left(values, value), bisect.bisect_right(values, value)
+            at, gone = min(max(old, lo), hi), True
+    if order == "asc":
+        start = 0 if at is None else at + (0 if gone else 1)
+        page = entries[start:start + n]
+        first, more = start, start + n < total
+    else:
+        end = total if at is None else at
+        first = max(0, end - n)
+        page = entries[first:end][::-1]
+        more = first > 0
+    if not page or not more:
+        return page, total, None
+    last = first + len(page) - 1 if order == "asc" else first
+    return page, total, _encode_cursor(values[last], page[-1].get("id", ""), last)
+
+class ContactSheets:
+    """One sprite image per page of a folder's thumbnails, rendered on demand.
+
+    ``layout`` packs the page's thumbnails into rows of ``SHEET_TILE_HEIGHT``
+    using the aspect ratios from the index, so the coordinate map is known
+    without opening a file. The key hashes the layout and the files on it:
+    any change to those images gives the page a new sheet URL, and a rendered
+    sheet never has to be invalidated. Entries without a thumbnail (videos
+    without poster) are left out of the map.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def layout(self, images: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        th = SHEET_TILE_HEIGHT
+        tiles: List[SheetTile] = []
+        coords: Dict[str, List[int]] = {}
+        shas: List[Optional[str]] = []
+        x = y = width = 0
+        for im in images:
+            w, h = im.get("width") or 0, im.get("height") or 0
+            if not im.get("thumb") or w <= 0 or h <= 0:
+                continue
+            tw = max(th // 2, min(th * 2, round(th * w / h)))
+            if x and x + tw > SHEET_WIDTH:
+                x, y = 0, y + th
+            tiles.append((im["thumb"], x, y, tw, th))
+            coords[im["id"]] = [x, y, tw, th]
+            shas.append(im.get("sha256"))
+            x += tw
+            width = max(width, x)
+        if not tiles:
+            return None
+        size = (width, y + th)
+        digest = hashlib.sha256(json.dumps([size, tiles, shas]).encode("utf-8")).hexdigest()[:20]
+        return {"key": digest, "width": size[0], "height": size[1], "tiles": coords, "files": tiles}
+
+    def path(self, folder_id: str, key: str) -> Path:
+        return self.root / folder_id / f"{key}.webp"
+
+    async def render(self, folder: Dict[str, Any], layout: Dict[str, Any]) -> Path:
+        path = self.path(folder["id"], layout["key"])
+        task = self._inflight.get(layout["key"])
+        if task is None:
+            task = asyncio.create_task(self._render(folder, layout, path))
+            self._inflight[layout["key"]] = task
+            task.add_done_callback(lambda _: self._inflight.pop(layout["key"], None))
+        await asyncio.shield(task)
+        return path
+
+    async def _render(self, folder: Dict[str, Any], layout: Dict[str, Any], path: Path) -> None:
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        await image_pool.run(render_sheet, str(_folder_path(folder)), layout["files"],
+                             (layout["width"], layout["height"]), str(path))
+        await asyncio.to_thread(self._prune, path.parent)
+
+    @staticmethod
+    def _prune(folder_dir: Path) -> None:
+        try:
+            entries = sorted(os.scandir(folder_dir), key=lambda e: e.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+        for entry in entries[SHEET_KEEP:]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def drop(self, folder_id: str) -> None:
+        shutil.rmtree(self.root / folder_id, ignore_errors=True)
+
+contact_sheets = ContactSheets(SHEET_DIR)
+
+# ---- Frontend assets ----
+
+# compressible text assets; everything else is served as stored
+ASSET_TEXT_SUFFIXES = {".html", ".js", ".mjs", ".css", ".svg", ".json", ".txt", ".webmanifest"}
+ASSET_IMMUTABLE = "public, max-age=31536000, immutable"
+# "./utils.js" module imports and "/static/styles.css" references in HTML/CSS/JS
+_asset_ref_rx = re.compile(r"""(["'(])(\./|/static/)([A-Za-z0-9_./-]+)(["')])""")
+
+@dataclass
+class StaticAsset:
+    name: str  # path below the frontend directory
+    url_name: str  # fingerprinted name, equal to ``name`` for HTML
+    media_type: str
+    digest: str  # sha256 of the served (rewritten) body
+    compressible: bool
+    bodies: Dict[str, bytes]  # encoding -> body; "identity" always present
+
+class FrontendAssets:
+    """The frontend, read once and served from memory.
+
+    Every non-HTML file gets a content-hash name (``kiosk.3f9a0c1d.js``) served
+    with an immutable Cache-Control, and references to it in HTML, CSS and JS
+    modules are rewritten to that name, so a kiosk only refetches what actually
+    changed after an update. Dependencies are hashed first, so editing
+    ``utils.js`` also renames the modules importing it. The plain names keep
+    working with ``no-cache`` and an ETag. Changes on disk need a restart.
+
+    gzip/brotli variants are compressed at the highest level when first asked
+    for and kept in ``ASSET_CACHE_DIR``, so after a restart they are read back
+    instead of recompressed and nothing is compressed before the first request.
+    """
+
+    def __init__(self, root: Path, cache_dir: Path) -> None:
+        self.root = root
+        self.cache_dir = cache_dir
+        self._assets: Dict[str, StaticAsset] = {}  # plain and fingerprinted name -> asset
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            raw = {
+                p.relative_to(self.root).as_posix(): p.read_bytes()
+                for p in sorted(self.root.rglob("*")) if p.is_file()
+            }
+            done: Dict[str, StaticAsset] = {}
+            for name in raw:
+                self._build(name, raw, done, set())
+            assets: Dict[str, StaticAsset] = {}
+            for asset in done.values():
+                assets[asset.name] = asset
+                assets[asset.url_name] = asset
+            self._assets = assets
+            self._loaded = True
+            self._prune({a.digest for a in done.values()})
+
+    def _build(self, name: str, raw: Dict[str, bytes], done: Dict[str, StaticAsset], visiting: Set[str]) -> None:
+        if name in done or name in visiting:
+            return  # a reference cycle keeps its plain name
+        visiting.add(name)
+        body = raw[name]
+        suffix = Path(name).suffix.lower()
+        if suffix in ASSET_TEXT_SUFFIXES:
+            base = name.rpartition("/")[0]
+
+            def target(m: re.Match) -> Optional[str]:
+                ref = m.group(3)
+                if m.group(2) == "./" and base:
+                    ref = f"{base}/{ref}"
+                return ref if ref in raw and ref != name else None
+
+            text = body.decode("utf-8")
+            for m in _asset_ref_rx.finditer(text):
+                ref = target(m)
+                if ref is not None:
+                    self._build(ref, raw, done, visiting)
+
+            def swap(m: re.Match) -> str:
+                ref = target(m)
+                if ref is None or ref not in done:
+                    return m.group(0)
+                new = done[ref].url_name.rpartition("/")[2] if m.group(2) == "./" else done[ref].url_name
+                return f"{m.group(1)}{m.group(2)}{new}{m.group(4)}"
+
+            body = _asset_ref_rx.sub(swap, text).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        url_name = name
+        if suffix != ".html":
+            stem, dot, ext = name.rpartition(".")
+            url_name = f"{stem}.{digest[:8]}.{ext}" if dot else f"{name}.{digest[:8]}"
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if suffix in (".js", ".mjs"):
+            media_type = "text/javascript"
+        if media_type.startswith("text/") or suffix in (".svg", ".json", ".webmanifest"):
+            media_type += "; charset=utf-8"
+        compressible = suffix in ASSET_TEXT_SUFFIXES and len(body) >= 256
+        done[name] = StaticAsset(name, url_name, media_type, digest, compressible, {"identity": body})
+        visiting.discard(name)
+
+    def _prune(self, digests: Set[str]) -> None:
+        """Drop cached variants of earlier frontend versions."""
+        try:
+            entries = list(os.scandir(self.cache_dir))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.partition(".")[0] not in digests:
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+
+    def _variant(self, asset: StaticAsset, encoding: str) -> bytes:
+        body = asset.bodies.get(encoding)
+        if body is not None:
+            return body
+        path = self.cache_dir / f"{asset.digest}.{'br' if encoding == 'br' else 'gz'}"
+        try:
+            body = path.read_bytes()
+        except OSError:
+            identity = asset.bodies["identity"]
+            if encoding == "br":
+                body = brotli.compress(identity, quality=11)
+            else:
+                body = gzip.compress(identity, compresslevel=9, mtime=0)
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                tmp.write_bytes(body)
+                tmp.replace(path)
+            except OSError:
+                pass  # read-only data dir: keep the variant in memory only
+        asset.bodies[encoding] = body
+        return body
+
+    def response(self, name: str, request: Request) -> Response:
+        self.load()
+        asset = self._assets.get(name)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        immutable = name == asset.url_name and asset.url_name != asset.name
+        etag = f'"{asset.digest}"'
+        headers = {"ETag": etag, "Cache-Control": ASSET_IMMUTABLE if immutable else "no-cache"}
+        if asset.compressible:
+            headers["Vary"] = "Accept-Encoding"
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        encoding = _pick_encoding(request) if asset.compressible else "identity"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self._variant(asset, encoding), media_type=asset.media_type, headers=headers)
+
+frontend_assets = FrontendAssets(Path(__file__).parent / "frontend", ASSET_CACHE_DIR)
+
+# ---- App ----
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    frontend_assets.load()
+    broadcast.start(_on_broadcast)
+    if store.shared is not None:
+        await asyncio.to_thread(store.sync_shared, True, True)
+    refresher.reset()
+    image_pool.start(IMAGE_WARM_DELAY_SEC)
+    if broadcast.is_leader():
+        upload_jobs.resume()
+    upload_jobs.start()
+    weather_service.start()
+    hub.start()
+    reconciler.start()
+    startup.mark("ready")
+    try:
+        yield
+    finally:
+        refresher.flush()
+        await reconciler.stop()
+        await upload_jobs.stop()
+        await hub.stop()
+        await weather_service.stop()
+        await broadcast.stop()
+        await asyncio.to_thread(image_pool.shutdown)
+
+app = FastAPI(title=APP_NAME, lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+def _ws_queue_depth() -> Dict[Tuple[str, ...], float]:
+    depths = [c["queued"] for c in hub.stats()["clients"]]
+    return {("sum",): sum(depths), ("max",): max(depths, default=0)}
+
+metrics.gauge("infotafel_ws_connections", "Connected WebSocket clients.", lambda: {(): hub.stats()["connected"]})
+metrics.gauge("infotafel_ws_queue_depth", "Messages waiting in client send queues.", _ws_queue_depth, ("agg",))
+metrics.gauge("infotafel_ws_messages_total", "Messages published to the hub.",
+              lambda: {(): hub.messages}, kind="counter")
+metrics.gauge("infotafel_ws_dropped_total", "Messages dropped because a client queue was full.",
+              lambda: {(): hub.dropped_total}, kind="counter")
+metrics.gauge("infotafel_store_commits_total", "Group commits written by the mutation queue.",
+              lambda: {(): mutations.commits}, kind="counter")
+metrics.gauge("infotafel_store_mutations_total", "State changes folded into those commits.",
+              lambda: {(): mutations.mutations}, kind="counter")
+metrics.gauge("infotafel_broadcast_messages_total", "Messages relayed to/from other workers.",
+              lambda: {(k,): broadcast.stats().get(k, 0) for k in ("sent", "received", "dropped")},
+              ("direction",), kind="counter")
+metrics.gauge("infotafel_upload_queue_depth", "Upload jobs waiting for a worker.",
+              lambda: {(): upload_jobs._queue.qsize() if upload_jobs._queue is not None else 0})
+metrics.gauge("infotafel_startup_seconds", "Seconds from process start to each startup phase.",
+              lambda: {(k,): v for k, v in startup.phases.items()}, ("phase",))
+
+_ensure_data_dirs()
+store.sync()
+startup.mark("module")
+
+
+@app.get("/", response_class=HTMLResponse)
+def kiosk_index(request: Request) -> Response:
+    return frontend_assets.response("index.html", request)
+
+@app.get("/admin", response_class=HTMLResponse)
+def admin_index(request: Request) -> Response:
+    return frontend_assets.response("admin.html", request)
+
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"])
+def static_asset(name: str, request: Request) -> Response:
+    return frontend_assets.response(name, request)
+
+@app.api_route("/media/{rel:path}", methods=["GET", "HEAD"])
+async def media(rel: str, request: Request) -> Response:
+    path = media_files.resolve(rel)
+    try:
+        st = await asyncio.to_thread(os.stat, path) if path is not None else None
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    etag = await media_files.etag(path, st)
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": MEDIA_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if _etag_matches(request, etag) or (
+        "if-none-match" not in request.headers and _not_modified_since(request, st)
+    ):
+        return Response(status_code=304, headers=headers)
+
+    rng = _byte_range(request, st.st_size, etag, last_modified)
+    if rng is None:
+        return MediaFileResponse(path, 0, st.st_size, 200, headers)
+    start, end = rng
+    headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+    return MediaFileResponse(path, start, end - start + 1, 206, headers)
+
+@app.get("/healthz")
+def healthz() -> Dict[str, Any]:
+    return {"status": "ok", "startup": startup.phases}
+
+# ---- Public API for kiosk ----
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+def _state_delta(
+    changes: List[StateChange], folders: List[Dict[str, Any]], idx: Dict[str, Any], images: bool = True
+) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    sections = {c.section for c in changes}
+    if "config" in sections:
+        out["config"] = store.config.snapshot()
+    if "folders" in sections:
+        out["folders"] = folders
+    changed_folders = {fid for c in changes for fid in c.folder_ids}
+    if changed_folders:
+        out["image_folders"] = sorted(changed_folders)
+        if images:
+            out["images"] = {fid: idx[fid] for fid in changed_folders if fid in idx}
+            out["removed_folders"] = sorted(fid for fid in changed_folders if fid not in idx)
+    return out
+
+@app.get("/api/state")
+async def api_state(
+    request: Request, response: Response, since: Optional[int] = None, images: bool = True
+) -> Any:
+    """Config, folders, weather and (unless ``images=0``, as kiosks ask) the image index."""
+    store.sync()
+    # read the version before the data: a concurrent change then yields a newer ETag on the next poll
+    version = store.version
+    cfg = store.config.snapshot()
+    weather_enabled = cfg.get("info_boxes", {}).get("weather_enabled", True)
+    weather = None
+    if weather_enabled:
+        weather = await get_weather_cached(cfg)
+    weather_version = weather_service.version if weather_enabled else 0
+    etag = f'"{version}-{weather_version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    changes = store.changes_since(since) if since is not None else None
+    if changes is not None:
+        # deltas are small; let FastAPI encode them
+        response.headers.update(headers)
+        folders = store.folders.snapshot().get("folders", [])
+        idx = store.index.snapshot().get("images", {})
+        out = _state_delta(changes, folders, idx, images)
+        out.update({"delta": True, "since": since, "version": version, "weather": weather, "server_time": now_iso()})
+        return out
+
+    encoding = _pick_encoding(request)
+    body = await state_body_cache.body(version, weather_version, weather, encoding, images)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/playlist")
+def api_playlist(
+    request: Request,
+    response: Response,
+    offset: int = 0,
+    limit: int = PLAYLIST_PAGE_DEFAULT,
+    seed: Optional[int] = None,
+    w: int = 0,
+    h: int = 0,
+) -> Any:
+    """One page of the carousel order for a kiosk of ``w`` x ``h`` device pixels.
+
+    ``seed`` pins the shuffle across pages (a new one is chosen when absent);
+    ``next`` is null at the end of a pass.
+    """
+    store.sync()
+    version = store.version
+    cfg = store.config.snapshot()
+    shuffle = bool(cfg.get("carousel", {}).get("shuffle"))
+    if not shuffle:
+        seed = 0
+    elif seed is None:
+        seed = random.randrange(1 << 31)
+    offset = max(0, offset)
+    limit = max(1, min(limit, PLAYLIST_PAGE_MAX))
+    etag = f'"{version}-{seed}-{offset}-{limit}-{w}x{h}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    order = playlist_cache.order(version, seed)
+    try:
+        interval = max(3, min(int(cfg.get("carousel", {}).get("interval_sec", 10)), 120))
+    except (TypeError, ValueError):
+        interval = 10
+    items = [_playlist_item(f, im, interval, w, h) for f, im in order[offset:offset + limit]]
+    end = offset + len(items)
+    links = _preload_links(items)
+    if links:
+        headers["Link"] = links
+    response.headers.update(headers)
+    return {
+        "version": version,
+        "seed": seed,
+        "total": len(order),
+        "offset": offset,
+        "next": end if end < len(order) else None,
+        "items": items,
+    }
+
+@app.get("/api/weather")
+async def api_weather() -> Dict[str, Any]:
+    cfg = store.config.snapshot()
+    return await get_weather_cached(cfg)
+
+# ---- Admin API ----
+
+@app.get("/api/config")
+def get_config(request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    return store.config.snapshot()
+
+@app.put("/api/config")
+async def put_config(request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    payload = await request.json()
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="config must be an object")
+
+    def apply(current: Dict[str, Any]) -> Dict[str, Any]:
+        cfg = dict(current)
+        # allow overwrite of known top-level keys only to keep it safer
+        for key in ["theme","layout","carousel","text_panel","info_boxes","ticker","autorefresh","events"]:
+            if key in payload:
+                cfg[key] = payload[key]
+        return cfg
+
+    cfg = await mutations.update(store.config, apply)
+    refresher.request("config")
+    return {"ok": True, "config": cfg}
+
+@app.post("/api/export")
+def export_state(request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    return {"ok": True, "backend": STORE_BACKEND, "written": store.export_json()}
+
+@app.get("/api/reconcile")
+def reconcile_status(request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    return reconciler.status()
+
+@app.post("/api/reconcile", status_code=202)
+async def reconcile_now(request: Request, remove: bool = RECONCILE_REMOVE) -> Dict[str, Any]:
+    ensure_admin(request)
+    return {"ok": True, "started": reconciler.trigger(remove)}
+
+@app.post("/api/reconcile/rebuild-index")
+async def reconcile_rebuild(request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    return {"ok": True, "images": await rebuild_index()}
+
+@app.get("/metrics")
+def get_metrics(request: Request) -> Response:
+    # Prometheus can only send a bearer token, so accept the admin password that way too
+    auth = request.headers.get("Authorization", "")
+    if not (auth.startswith("Bearer ") and secrets.compare_digest(auth[7:], ADMIN_PASSWORD)):
+        ensure_admin(request)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/ws/stats")
+def ws_stats(request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    return hub.stats()
+
+@app.get("/api/folders")
+def list_folders(request: Request) -> Dict[str, Any]:
+    """Folders with ``image_count`` and the first entries as ``preview`` for the folder cards."""
+    ensure_admin(request)
+    idx = store.index.snapshot().get("images", {})
+    out = []
+    for f in store.folders.snapshot().get("folders", []):
+        images = idx.get(f.get("id")) or []
+        preview = [
+            {k: im.get(k) for k in ("id", "type", "filename", "thumb")} for im in images[:FOLDER_PREVIEW]
+        ]
+        out.append({**f, "image_count": len(images), "preview": preview})
+    return {"folders": out}
+
+@app.post("/api/folders")
+async def create_folder(request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    data = await request.json()
+    name = str(data.get("name", "")).strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="name required")
+    folder_id = uuid.uuid4().hex
+    folder: Dict[str, Any] = {}
+
+    def add(folders_data: Dict[str, Any]) -> Dict[str, Any]:
+        folders = folders_data.get("folders", [])
+        # unique slug
+        slug = slugify(name)
+        used = {f["slug"] for f in folders}
+        base_slug = slug
+        i = 2
+        while slug in used:
+            slug = f"{base_slug}-{i}"
+            i += 1
+        folder.clear()
+        folder.update({"id": folder_id, "name": name, "slug": slug, "created_at": now_iso()})
+        return {**folders_data, "folders": folders + [dict(folder)]}
+
+    await mutations.update(store.folders, add)
+    await asyncio.to_thread(_folder_path(folder).mkdir, parents=True, exist_ok=True)
+    # init index
+    await _update_image_list(folder_id, lambda images: None if images else [])
+    refresher.request("folders")
+    return {"ok": True, "folder": folder}
+
+@app.delete("/api/folders/{folder_id}")
+async def delete_folder(folder_id: str, request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    async with mutations.folder(folder_id):
+        folder = _find_folder(folder_id)
+        # remove from folders first, so nothing new is added to it
+        await mutations.update(
+            store.folders,
+            lambda data: {**data, "folders": [f for f in data.get("folders", []) if f["id"] != folder_id]},
+        )
+        # delete media directory
+        try:
+            # ⚡ Bolt: Offload blocking I/O (directory deletion) to thread to prevent blocking the async event loop
+            await asyncio.to_thread(shutil.rmtree, _folder_path(folder), ignore_errors=True)
+        except Exception:
+            pass
+        # remove index
+        removed_images: List[Dict[str, Any]] = []
+
+        def drop(idx: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            removed_images[:] = idx.get("images", {}).get(folder_id) or []
+            return _index_with(idx, folder_id, None) if folder_id in idx.get("images", {}) else None
+
+        await mutations.update(store.index, drop)
+    await content_store.release({im.get("sha256") for im in removed_images})
+    await asyncio.to_thread(contact_sheets.drop, folder_id)
+    refresher.request("folders")
+    return {"ok": True}
+
+@app.get("/api/folders/{folder_id}/images")
+def list_images(
+    folder_id: str,
+    request: Request,
+    sort: str = "uploaded",
+    order: str = "asc",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    sheet: bool = False,
+) -> Dict[str, Any]:
+    """A folder's images, sorted by ``uploaded`` or ``name``; paged when ``limit`` is given.
+
+    ``next`` is the cursor for the following page (null on the last one). With
+    ``sheet=1`` the response also names a contact sheet for the page: one
+    image with every thumbnail, ``tiles`` maps image id -> [x, y, w, h].
+    """
+    ensure_admin(request)
+    _find_folder(folder_id)
+    images, total, nxt = _image_page(folder_id, sort, order, cursor, limit)
+    out: Dict[str, Any] = {"images": images, "total": total, "next": nxt, "sort": sort, "order": order}
+    layout = contact_sheets.layout(images) if sheet else None
+    if layout is not None:
+        params = {"key": layout["key"], "sort": sort, "order": order}
+        if cursor:
+            params["cursor"] = cursor
+        if limit is not None:
+            params["limit"] = str(limit)
+        out["sheet"] = {
+            "url": f"/api/folders/{folder_id}/sheet?" + urllib.parse.urlencode(params),
+            "width": layout["width"],
+            "height": layout["height"],
+            "tiles": layout["tiles"],
         }
-        images.append(meta)
-        added.append(meta)
+    return out
+
+@app.get("/api/folders/{folder_id}/sheet")
+async def folder_sheet(
+    folder_id: str,
+    key: str,
+    sort: str = "uploaded",
+    order: str = "asc",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Response:
+    """The contact sheet named by ``list_images``; rendered on first request.
+
+    No admin header: it is loaded by an <img>, and shows the same thumbnails
+    that ``/media`` serves. A key that no longer matches the page is a 404.
+    """
+    folder = _find_folder(folder_id)
+    if not re.fullmatch(r"[0-9a-f]{20}", key):
+        raise HTTPException(status_code=404, detail="Not Found")
+    path = contact_sheets.path(folder_id, key)
+    if not await asyncio.to_thread(path.is_file):
+        images, _, _ = _image_page(folder_id, sort, order, cursor, limit)
+        layout = contact_sheets.layout(images)
+        if layout is None or layout["key"] != key:
+            raise HTTPException(status_code=404, detail="Contact sheet is outdated")
+        await contact_sheets.render(folder, layout)
+    return FileResponse(path, media_type="image/webp", headers={"Cache-Control": MEDIA_CACHE_CONTROL})
+
+@app.post("/api/folders/{folder_id}/images", status_code=202)
+async def upload_images(folder_id: str, request: Request) -> Dict[str, Any]:
+    """Multipart upload (field ``files``), streamed to disk in a single pass."""
+    ensure_admin(request)
+    _find_folder(folder_id)
+    ctype, opts = parse_options_header(request.headers.get("content-type", ""))
+    boundary = opts.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="multipart/form-data with 'files' required")
+
+    job_id = uuid.uuid4().hex
+    staging_dir = UPLOAD_STAGING_DIR / job_id
+    await asyncio.to_thread(staging_dir.mkdir, parents=True, exist_ok=True)
+    stager = MultipartStager(staging_dir, boundary)
+    try:
+        async for chunk in request.stream():
+            await stager.feed(chunk)
+        await stager.finish()
+    except BaseException as e:
+        await stager.abort()
+        await asyncio.to_thread(shutil.rmtree, staging_dir, ignore_errors=True)
+        if isinstance(e, Exception) and not isinstance(e, HTTPException):
+            raise HTTPException(status_code=400, detail="invalid multipart body") from e
+        raise
 
-    _save_image_list_for(folder_id, images)
-    await hub.broadcast({"type": "refresh", "reason": "images"})
-    return {"ok": True, "added": added}
+    if not stager.entries:
+        await asyncio.to_thread(shutil.rmtree, staging_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail="no files")
+
+    job = await upload_jobs.submit(job_id, folder_id, stager.entries)
+    return {"ok": True, "job": upload_jobs.summary(job)}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str, request: Request) -> Dict[str, Any]:
+    ensure_admin(request)
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    out = upload_jobs.summary(job)
+    out["files"] = [
+        {
+            k: f.get(k)
+            for k in ("name", "status", "image_id", "error", "warning", "size", "dedup", "profile", "timings_ms")
+            if f.get(k) is not None
+        }
+        for f in job.get("files", [])
+    ]
+    out["added"] = [f["meta"] for f in job.get("files", []) if f.get("meta")]
+    return out
 
 @app.post("/api/folders/{folder_id}/images/batch-delete")
 async def batch_delete_images(folder_id: str, request: Request) -> Dict[str, Any]:
@@ -623,88 +4283,78 @@ async def batch_delete_images(folder_id: str, request: Request) -> Dict[str, Any
 
     folder = _find_folder(folder_id)
     folder_dir = _folder_path(folder)
+    removed: List[Dict[str, Any]] = []
 
-    images = _image_list_for(folder_id)
-    keep: List[Dict[str, Any]] = []
-    removed_count = 0
+    def drop(images: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        removed[:] = [im for im in images if im.get("id") in image_ids]
+        return [im for im in images if im.get("id") not in image_ids] if removed else None
 
-    for im in images:
-        if im.get("id") in image_ids:
-            # delete files
-            try:
-                (folder_dir / im["filename"]).unlink(missing_ok=True)
-                thumb = im.get("thumb")
-                if thumb:
-                    (folder_dir / thumb).unlink(missing_ok=True)
-            except Exception:
-                pass
-            removed_count += 1
-        else:
-            keep.append(im)
+    async with mutations.folder(folder_id):
+        await _update_image_list(folder_id, drop)
+        if removed:
+            # files go after the index no longer references them
+            await asyncio.to_thread(_unlink_entries, folder_dir, removed)
 
-    if removed_count > 0:
-        _save_image_list_for(folder_id, keep)
-        await hub.broadcast({"type": "refresh", "reason": "images"})
+    if removed:
+        await content_store.release({im.get("sha256") for im in removed})
+        refresher.request("images")
 
-    return {"ok": True, "deleted": removed_count}
+    return {"ok": True, "deleted": len(removed)}
 
 @app.delete("/api/folders/{folder_id}/images/{image_id}")
 async def delete_image(folder_id: str, image_id: str, request: Request) -> Dict[str, Any]:
     ensure_admin(request)
     folder = _find_folder(folder_id)
     folder_dir = _folder_path(folder)
+    removed: List[Dict[str, Any]] = []
 
-    images = _image_list_for(folder_id)
-    keep: List[Dict[str, Any]] = []
-    removed = None
-    for im in images:
-        if im.get("id") == image_id:
-            removed = im
-        else:
-            keep.append(im)
-
-    if removed is None:
-        raise HTTPException(status_code=404, detail="Image not found")
+    def drop(images: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        removed[:] = [im for im in images if im.get("id") == image_id]
+        return [im for im in images if im.get("id") != image_id] if removed else None
 
-    # delete files
-    try:
-        (folder_dir / removed["filename"]).unlink(missing_ok=True)
-        thumb = removed.get("thumb")
-        if thumb:
-            (folder_dir / thumb).unlink(missing_ok=True)
-    except Exception:
-        pass
+    async with mutations.folder(folder_id):
+        await _update_image_list(folder_id, drop)
+        if not removed:
+            raise HTTPException(status_code=404, detail="Image not found")
+        await asyncio.to_thread(_unlink_entries, folder_dir, removed)
 
-    _save_image_list_for(folder_id, keep)
-    await hub.broadcast({"type": "refresh", "reason": "images"})
+    await content_store.release({removed[0].get("sha256")})
+    refresher.request("images")
     return {"ok": True}
 
 # ---- WebSocket ----
 
+async def _ws_reader(ws: WebSocket, sub: Subscriber) -> None:
+    try:
+        while True:
+            text = await ws.receive_text()
+            sub.last_seen = time.monotonic()
+            if text.strip().lower() == "ping":
+                sub.offer("pong")
+            # anything else (e.g. "pong") only counts as a sign of life
+    except Exception:
+        pass
+    finally:
+        sub.close()
+
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
-    q = await hub.connect(ws)
+    # one long-lived reader task per connection; this coroutine is the writer
+    sub = await hub.connect(ws)
+    reader = asyncio.create_task(_ws_reader(ws, sub))
     try:
         while True:
-            # Wait for either: a broadcast message OR any client message (for keepalive / disconnect detection)
-            t_queue = asyncio.create_task(q.get())
-            t_recv = asyncio.create_task(ws.receive_text())
-            done, pending = await asyncio.wait({t_queue, t_recv}, return_when=asyncio.FIRST_COMPLETED)
-
-            for t in pending:
-                t.cancel()
-
-            if t_queue in done:
-                msg = t_queue.result()
-                await ws.send_json(msg)
-                continue
-
-            if t_recv in done:
-                text = (t_recv.result() or "").strip().lower()
-                if text == "ping":
-                    await ws.send_text("pong")
-                # ignore anything else
-    except WebSocketDisconnect:
-        await hub.disconnect(ws)
+            text = await sub.queue.get()
+            if text is None:
+                break
+            await ws.send_text(text)
+            sub.sent += 1
     except Exception:
+        pass
+    finally:
+        reader.cancel()
         await hub.disconnect(ws)
+        try:
+            await ws.close()
+        except Exception:
+            pass
@@ -0,0 +1,28 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("ADMIN_PASSWORD", "test-password")
+    monkeypatch.setenv("STORE_BACKEND", "json")
+    monkeypatch.setenv("IMAGE_POOL", "thread")
+    return tmp_path
+
+
+@pytest.fixture
+def load_main(data_dir):
+    """Import a fresh ``backend.main``; it reads DATA_DIR and loads the store at import."""
+
+    def load():
+        sys.modules.pop("backend.main", None)
+        return importlib.import_module("backend.main")
+
+    yield load
+    sys.modules.pop("backend.main", None)
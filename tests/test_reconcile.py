@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import json
+import uuid
+
+from PIL import Image
+
+FOLDER = {"id": "f1", "name": "Gruppe A", "slug": "gruppe-a"}
+
+
+def _sha(n):
+    return hashlib.sha256(str(n).encode()).hexdigest()
+
+
+def _entry(img_id, sha=None):
+    entry = {"id": img_id, "type": "image", "filename": f"{img_id}.webp", "thumb": f"{img_id}_thumb.webp",
+             "original_name": f"{img_id}.jpg", "uploaded_at": "2024-01-01T00:00:00+0000",
+             "width": 64, "height": 48}
+    if sha:
+        entry["sha256"] = sha
+    return entry
+
+
+def _webp(path, size=(64, 48)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size, (200, 40, 40)).save(path, "WEBP")
+
+
+def _seed(data_dir, images=(), folders=(FOLDER,)):
+    """Write folders.json/index.json and the media files of ``images`` (folder id -> entries on disk)."""
+    (data_dir / "folders.json").write_text(json.dumps({"folders": list(folders)}))
+    index = {f["id"]: [] for f in folders}
+    for folder_id, entry in images:
+        index[folder_id].append(entry)
+    (data_dir / "index.json").write_text(json.dumps({"images": index}))
+    media = data_dir / "media" / FOLDER["slug"]
+    media.mkdir(parents=True, exist_ok=True)
+    return media
+
+
+def _cas_entry(main, sha):
+    d = main.CAS_DIR / sha[:2] / sha
+    d.mkdir(parents=True, exist_ok=True)
+    (d / "meta.json").write_text(json.dumps({"files": {"main": "main.webp"}}))
+    return d
+
+
+def test_young_orphans_survive_the_grace_period(data_dir, load_main, monkeypatch):
+    kept = uuid.uuid4().hex
+    media = _seed(data_dir, [("f1", _entry(kept))])
+    _webp(media / f"{kept}.webp")
+    _webp(media / f"{kept}_thumb.webp")
+    orphan = media / f"{uuid.uuid4().hex}.webp"
+    _webp(orphan)
+    main = load_main()
+
+    report = asyncio.run(main.reconciler.run(True))
+    assert orphan.exists()
+    assert report["orphans"] == [] and report["removed"] == 0
+
+    monkeypatch.setattr(main, "RECONCILE_GRACE_SEC", -60)
+    report = asyncio.run(main.reconciler.run(True))
+    assert not orphan.exists()
+    assert report["orphans"] == [f"{FOLDER['slug']}/{orphan.name}"]
+    assert (media / f"{kept}.webp").exists() and (media / f"{kept}_thumb.webp").exists()
+
+
+def test_files_of_a_running_upload_job_are_left_alone(data_dir, load_main, monkeypatch):
+    indexed = uuid.uuid4().hex  # a non-empty index, so the pass may delete
+    media = _seed(data_dir, [("f1", _entry(indexed))])
+    _webp(media / f"{indexed}.webp")
+    _webp(media / f"{indexed}_thumb.webp")
+    img_id, job_id, sha = uuid.uuid4().hex, uuid.uuid4().hex, _sha("job")
+    _webp(media / f"{img_id}.webp")
+    staged = data_dir / "tmp_upload" / job_id / "000_a.jpg"
+    staged.parent.mkdir(parents=True)
+    staged.write_bytes(b"raw")
+    main = load_main()
+    cas = _cas_entry(main, sha)
+    monkeypatch.setattr(main, "RECONCILE_GRACE_SEC", -60)
+    main.upload_jobs._jobs[job_id] = {
+        "id": job_id, "folder_id": "f1", "status": "running",
+        "files": [{"name": "a.jpg", "image_id": img_id, "sha256": sha, "status": "pending"}],
+    }
+
+    report = asyncio.run(main.reconciler.run(True))
+    assert (media / f"{img_id}.webp").exists()
+    assert staged.exists()
+    assert cas.exists()
+    assert report["removed"] == 0
+
+    main.upload_jobs._jobs.clear()
+    asyncio.run(main.reconciler.run(True))
+    assert not (media / f"{img_id}.webp").exists()
+    assert not staged.parent.exists()
+    assert not cas.exists()
+
+
+def test_empty_index_is_rebuilt_and_nothing_is_deleted(data_dir, load_main, monkeypatch):
+    media = _seed(data_dir)
+    ids = [uuid.uuid4().hex for _ in range(2)]
+    for img_id in ids:
+        _webp(media / f"{img_id}.webp")
+        _webp(media / f"{img_id}_thumb.webp", (32, 24))
+    (media / "notes.txt").write_text("kept")
+    before = sorted(p.name for p in media.iterdir())
+    main = load_main()
+    monkeypatch.setattr(main, "RECONCILE_GRACE_SEC", -60)
+
+    report = asyncio.run(main.reconciler.run(True))
+    assert report["remove"] is False
+    assert report["removed"] == 0
+    assert report["rebuilt"] == {FOLDER["slug"]: 2}
+    assert sorted(p.name for p in media.iterdir()) == before
+    assert sorted(im["id"] for im in main._image_list_for("f1")) == sorted(ids)
+
+
+def test_rebuild_skips_files_of_running_upload_jobs(data_dir, load_main):
+    media = _seed(data_dir)
+    done, uploading = uuid.uuid4().hex, uuid.uuid4().hex
+    for img_id in (done, uploading):
+        _webp(media / f"{img_id}.webp")
+    main = load_main()
+    main.upload_jobs._jobs["j1"] = {"id": "j1", "folder_id": "f1", "status": "running",
+                                    "files": [{"image_id": uploading, "status": "pending"}]}
+
+    report = asyncio.run(main.reconciler.run(True))
+    assert report["rebuilt"] == {FOLDER["slug"]: 1}
+    assert [im["id"] for im in main._image_list_for("f1")] == [done]
+    assert (media / f"{uploading}.webp").exists()
+
+
+def test_empty_index_without_media_never_deletes(data_dir, load_main, monkeypatch):
+    media = _seed(data_dir)
+    (media / "notes.txt").write_text("kept")
+    main = load_main()
+    monkeypatch.setattr(main, "RECONCILE_GRACE_SEC", -60)
+
+    report = asyncio.run(main.reconciler.run(True))
+    assert report["remove"] is False
+    assert "rebuilt" not in report
+    assert (media / "notes.txt").exists()
+
+
+def test_every_entry_with_a_missing_main_file_is_dropped(data_dir, load_main):
+    kept = uuid.uuid4().hex
+    missing = [_entry(uuid.uuid4().hex) for _ in range(250)]
+    media = _seed(data_dir, [("f1", _entry(kept))] + [("f1", e) for e in missing])
+    _webp(media / f"{kept}.webp")
+    _webp(media / f"{kept}_thumb.webp")
+    main = load_main()
+    assert len(missing) > main.RECONCILE_REPORT_MAX
+
+    report = asyncio.run(main.reconciler.run(True))
+    assert len(report["missing"]) == main.RECONCILE_REPORT_MAX
+    assert report["missing_count"] == 2 * len(missing)  # main file and thumbnail
+    assert [im["id"] for im in main._image_list_for("f1")] == [kept]
+
+
+def test_release_keeps_hashes_still_in_the_index(data_dir, load_main):
+    shared, single = _sha("shared"), _sha("single")
+    a, b = _entry(uuid.uuid4().hex, shared), _entry(uuid.uuid4().hex, shared)
+    _seed(data_dir, [("f1", a), ("f1", b), ("f1", _entry(uuid.uuid4().hex, single))])
+    main = load_main()
+    dirs = {sha: _cas_entry(main, sha) for sha in (shared, single, _sha("unused"))}
+
+    async def scenario():
+        await main.content_store.release({shared, single, _sha("unused")})
+        assert dirs[shared].exists() and dirs[single].exists()
+        assert not dirs[_sha("unused")].exists()
+
+        # one of two references gone: the entry stays
+        await main._update_image_list("f1", lambda ims: [im for im in ims if im["id"] != a["id"]])
+        await main.content_store.release({shared})
+        assert dirs[shared].exists()
+
+        await main._update_image_list("f1", lambda ims: [im for im in ims if im["id"] != b["id"]])
+        await main.content_store.release({shared})
+        assert not dirs[shared].exists()
+        assert dirs[single].exists()
+
+    asyncio.run(scenario())
+
+
+def test_release_keeps_hashes_of_running_upload_jobs(data_dir, load_main):
+    _seed(data_dir)
+    main = load_main()
+    sha = _sha("upload")
+    cas = _cas_entry(main, sha)
+    main.upload_jobs._jobs["j1"] = {"id": "j1", "folder_id": "f1", "status": "running",
+                                    "files": [{"sha256": sha, "status": "pending"}]}
+
+    asyncio.run(main.content_store.release({sha}))
+    assert cas.exists()
+
+    main.upload_jobs._jobs.clear()
+    asyncio.run(main.content_store.release({sha}))
+    assert not cas.exists()
+
+
+def test_reconcile_removes_only_unreferenced_cas_entries(data_dir, load_main, monkeypatch):
+    img_id, used = uuid.uuid4().hex, _sha("used")
+    media = _seed(data_dir, [("f1", _entry(img_id, used))])
+    _webp(media / f"{img_id}.webp")
+    _webp(media / f"{img_id}_thumb.webp")
+    main = load_main()
+    kept, dropped = _cas_entry(main, used), _cas_entry(main, _sha("orphan"))
+
+    asyncio.run(main.reconciler.run(True))
+    assert kept.exists() and dropped.exists()  # within the grace period
+
+    monkeypatch.setattr(main, "RECONCILE_GRACE_SEC", -60)
+    asyncio.run(main.reconciler.run(True))
+    assert kept.exists()
+    assert not dropped.exists()